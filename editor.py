@@ -1,23 +1,38 @@
 #!/usr/bin/env python
 
 from array import array
+import argparse
+import bz2
+import collections
+import concurrent.futures
+import contextlib
+import gzip
 import itertools
+import json
+import lzma
+import os
 import sys
 from enum import Enum, auto
 import pathlib
+import queue
 import re
 import copy
+import cProfile
 import math
+import operator
+import pstats
 import signal
+import struct
+import threading
+import time
+import io
+import zlib
 
 import blessed
 
-# TODO: More selection functions.
-#         shift 1px - pixels
-#         Maybe affine transforms?
 # TODO: Maybe add preview viewport. (probably not)
 # TODO: Various screen refresh bugs.
-# TODO: Maybe revamped paste for affine pasting? also multiple named clipboards
+# TODO: Maybe revamped paste for affine pasting?
 
 # TODO: undo quirk undoing a color put on top row
 # TODO: another undo quirk with undoing pastes
@@ -25,6 +40,13 @@ import blessed
 #   but i'll leave them here just in case they crop up again.
 
 UNDO_LEVELS = 100
+# past this many bytes held by the undos, the oldest are dropped, 0 for no limit
+UNDO_MEMORY = 268435456
+# toggles and color puts go in to the same undo while they're no more than
+# this many seconds and pixels from the last one, up to this many changes
+UNDO_GROUP_TIME = 1.0
+UNDO_GROUP_DISTANCE = 4
+UNDO_GROUP_MAX = 1024
 DEFAULT_FILL = False
 ZOOMED_X = 4
 ZOOMED_PAD = 4
@@ -38,6 +60,33 @@ CHARS4 = array('w', ' 𜺨𜴀▘𜴉𜴊🯦𜴍𜺣𜴶𜴹𜴺▖𜵅𜵈▌
                     '𜺠𜵱𜵴𜵵𜶀𜶁𜶄𜶅▂𜶬𜶯𜶰𜶻𜶼𜶿𜷀𜵲𜵳𜵶𜵷𜶂𜶃𜶆𜶇𜶭𜶮𜶱𜶲𜶽𜶾𜷁𜷂𜵸𜵹𜵼𜵽𜶈𜶉𜶌𜶍𜶳𜶴𜶷𜶸𜷃𜷄𜷇𜷈𜵺𜵻𜵾𜵿𜶊𜶋𜶎𜶏𜶵𜶶𜶹𜶺𜷅𜷆𜷉𜷊'
                     '▗𜶐𜶓▚𜶜𜶝𜶠𜶡𜷋𜷌𜷏𜷐▄𜷛𜷞▙𜶑𜶒𜶔𜶕𜶞𜶟𜶢𜶣𜷍𜷎𜷑𜷒𜷜𜷝𜷟𜷠𜶖𜶗𜶙𜶚𜶤𜶥𜶨𜶩𜷓𜷔𜷗𜷘𜷡𜷢▆𜷤▐𜶘𜶛▜𜶦𜶧𜶪𜶫𜷕𜷖𜷙𜷚▟𜷣𜷥█')
 
+def make_char_table(masks : tuple[int], get_char):
+    # each bit of the new pattern is set if any of the cell bits in its mask
+    # are set, so converting a cell is just a lookup
+    return array('w', (get_char(sum(1 << bit for bit, mask in enumerate(masks) if cell & mask))
+                        for cell in range(256)))
+
+def get_sextant_char(pattern : int):
+    # the half blocks are already in another block, so they're left out
+    if pattern in SEXTANT_BLOCKS:
+        return SEXTANT_BLOCKS[pattern]
+    return chr(SEXTANT_BASE + pattern - 1 - (pattern > 21) - (pattern > 42))
+
+# braille dots go down the left for 1 to 3, then the right for 4 to 6, then 7
+# and 8 are the bottom row
+BRAILLE_BASE = 0x2800
+CHARS_BRAILLE = make_char_table((0x01, 0x02, 0x04, 0x10, 0x20, 0x40, 0x08, 0x80),
+                                lambda pattern: chr(BRAILLE_BASE + pattern))
+# 2x3 and 2x2 are lossy, the middle row of a sextant is the middle 2 of a
+# cell, and the top row only the top since the row below it mostly goes to
+# the middle.  quadrants are each 2 rows.
+SEXTANT_BASE = 0x1FB00
+SEXTANT_BLOCKS = {0: ' ', 21: '▌', 42: '▐', 63: '█'}
+CHARS_SEXTANT = make_char_table((0x01, 0x10, 0x06, 0x60, 0x08, 0x80), get_sextant_char)
+CHARS_QUADRANT = make_char_table((0x03, 0x30, 0x0C, 0xC0), ' ▘▝▀▖▌▞▛▗▚▐▜▄▙▟█'.__getitem__)
+# both octants and braille can be loaded
+CHAR_CELLS = {char: cell for chars in (CHARS_BRAILLE, CHARS4) for cell, char in enumerate(chars)}
+
 
 t = blessed.Terminal()
 need_winch : bool = False
@@ -48,6 +97,11 @@ orig_cont = None
 canvas_width : int
 canvas_height : int
 canvas_fits = True
+undo_journal = None
+undo_memory : int = UNDO_MEMORY
+clipboards = None
+script_term = None
+macro = None
 
 class ColorMode(Enum):
     NONE = auto()
@@ -67,8 +121,36 @@ class Term():
 
     def __init__(self, t : blessed.Terminal):
         self.t : blessed.Terminal = t
+        # pick cells or their inverses to send fewer color codes
+        self.minimize_sgr : bool = False
+        self.sgr_lengths : dict = {}
+        # erase runs of blank transparent cells instead of printing spaces
+        self.blank_skip : BlankSkip = BlankSkip.NONE
         self.reset()
 
+    def get_sgr_state(self):
+        # state for plan_row_sgr.  -1 without having sent normal means
+        # whatever was there before is unknown.
+        if self.normal:
+            return SGR_DEFAULT, SGR_DEFAULT
+        fg = SGR_UNSET
+        if self.fg_r >= 0:
+            fg = (self.fg_r, self.fg_g, self.fg_b)
+        bg = SGR_UNSET
+        if self.bg_r >= 0:
+            bg = (self.bg_r, self.bg_g, self.bg_b)
+        return fg, bg
+
+    def send_sgr(self, ops : list):
+        for kind, color in ops:
+            match kind:
+                case SGROp.NORMAL:
+                    self.send_normal()
+                case SGROp.FG:
+                    self.send_fg(color)
+                case SGROp.BG:
+                    self.send_bg(color)
+
     def send_normal(self):
         if not self.normal:
             print(self.t.normal, end='')
@@ -178,6 +260,25 @@ class KeyActions(Enum):
     SWAP = auto()
     PICK_FG_COLOR = auto()
     PICK_BG_COLOR = auto()
+    PASTE_MODE = auto()
+    PASTE_LAYERS = auto()
+    HEATMAP = auto()
+    EXPORT = auto()
+    MINIMIZE_SGR = auto()
+    BLANK_SKIP = auto()
+    GLYPHS = auto()
+    NEW_FRAME = auto()
+    DELETE_FRAME = auto()
+    NEXT_FRAME = auto()
+    PREV_FRAME = auto()
+    ONION = auto()
+    PLAY = auto()
+    SELECT_CLIPBOARD = auto()
+    RECORD_MACRO = auto()
+    PLAY_MACRO = auto()
+    PROFILE = auto()
+    FRAME_STATS = auto()
+    MEMORY = auto()
 
     # for prompt
     BACKSPACE = auto()
@@ -203,6 +304,15 @@ class KeyActions(Enum):
     TOOL_MODE = auto()
     RECT = auto()
     CIRCLE = auto()
+    FLIP_H = auto()
+    FLIP_V = auto()
+    ROTATE_CW = auto()
+    ROTATE_CCW = auto()
+    SCALE = auto()
+    NUDGE_LEFT = auto()
+    NUDGE_RIGHT = auto()
+    NUDGE_UP = auto()
+    NUDGE_DOWN = auto()
 
 KEY_ACTIONS = {
     ord('Q'): KeyActions.QUIT,
@@ -238,7 +348,26 @@ KEY_ACTIONS = {
     ord('l'): KeyActions.LINE,
     ord('I'): KeyActions.SWAP,
     ord('o'): KeyActions.PICK_FG_COLOR,
-    ord('O'): KeyActions.PICK_BG_COLOR
+    ord('O'): KeyActions.PICK_BG_COLOR,
+    ord('b'): KeyActions.PASTE_MODE,
+    ord('B'): KeyActions.PASTE_LAYERS,
+    ord('E'): KeyActions.HEATMAP,
+    ord('x'): KeyActions.EXPORT,
+    ord('m'): KeyActions.MINIMIZE_SGR,
+    ord('k'): KeyActions.BLANK_SKIP,
+    ord('G'): KeyActions.GLYPHS,
+    ord('n'): KeyActions.NEW_FRAME,
+    ord('N'): KeyActions.DELETE_FRAME,
+    ord('f'): KeyActions.NEXT_FRAME,
+    ord('F'): KeyActions.PREV_FRAME,
+    ord('y'): KeyActions.ONION,
+    ord('Y'): KeyActions.PLAY,
+    ord('j'): KeyActions.SELECT_CLIPBOARD,
+    ord('q'): KeyActions.RECORD_MACRO,
+    ord('@'): KeyActions.PLAY_MACRO,
+    ord('T'): KeyActions.PROFILE,
+    ord('Z'): KeyActions.FRAME_STATS,
+    ord('A'): KeyActions.MEMORY
 }
 
 KEY_ACTIONS_DESCRIPTIONS = {
@@ -270,7 +399,26 @@ KEY_ACTIONS_DESCRIPTIONS = {
     KeyActions.LINE: "Start drawing a straight line",
     KeyActions.SWAP: "Swap current foreground and background color",
     KeyActions.PICK_FG_COLOR: "Pick only foreground color",
-    KeyActions.PICK_BG_COLOR: "Pick only background color"
+    KeyActions.PICK_BG_COLOR: "Pick only background color",
+    KeyActions.PASTE_MODE: "Cycle paste modes (Replace, OR, AND, XOR, Mask)",
+    KeyActions.PASTE_LAYERS: "Cycle paste layers (Both, Pixels, Colors)",
+    KeyActions.HEATMAP: "Toggle imported color error map in zoomed view",
+    KeyActions.EXPORT: "Export as an image (PNG, PPM, SVG), HTML or asciicast",
+    KeyActions.MINIMIZE_SGR: "Toggle fewer color codes by inverting cells, in display and saves",
+    KeyActions.BLANK_SKIP: "Cycle skipping transparent blanks in display and saves (None, Trim, Cursor)",
+    KeyActions.GLYPHS: "Cycle characters used for saves (Octant, Braille, Sextant, Quadrant)",
+    KeyActions.NEW_FRAME: "Add a copy of the current animation frame after it",
+    KeyActions.DELETE_FRAME: "Delete the current animation frame",
+    KeyActions.NEXT_FRAME: "Go to the next animation frame",
+    KeyActions.PREV_FRAME: "Go to the previous animation frame",
+    KeyActions.ONION: "Toggle showing the previous frame in zoomed view (onion skin)",
+    KeyActions.PLAY: "Play animation until a key is pressed",
+    KeyActions.SELECT_CLIPBOARD: "Select which named clipboard to copy to and paste from",
+    KeyActions.RECORD_MACRO: "Start or stop recording a macro",
+    KeyActions.PLAY_MACRO: "Play the macro, a number of times from the cursor",
+    KeyActions.PROFILE: "Start or stop profiling, saving the stats and showing the slowest functions",
+    KeyActions.FRAME_STATS: "Toggle action and frame times (p50/p99) in the status line",
+    KeyActions.MEMORY: "Show the memory taken by the canvas, undo, redo, clipboards, palette and frames"
 }
 
 KEY_ACTIONS_SELECT_TILES = {
@@ -285,7 +433,12 @@ KEY_ACTIONS_SELECT_TILES = {
     t.KEY_ESCAPE: KeyActions.CANCEL,
     ord('z'): KeyActions.ZOOMED_COLOR,
     ord('c'): KeyActions.COPY,
-    ord('f'): KeyActions.RECT
+    ord('f'): KeyActions.RECT,
+    ord('h'): KeyActions.FLIP_H,
+    ord('v'): KeyActions.FLIP_V,
+    ord('t'): KeyActions.ROTATE_CW,
+    ord('T'): KeyActions.ROTATE_CCW,
+    ord('x'): KeyActions.SCALE
 }
 
 KEY_ACTIONS_SELECT_TILES_DESCRIPTIONS = {
@@ -296,7 +449,12 @@ KEY_ACTIONS_SELECT_TILES_DESCRIPTIONS = {
     KeyActions.CANCEL: "Leave seleciton mode",
     KeyActions.ZOOMED_COLOR: "Toggle zoomed view color",
     KeyActions.COPY: "Copy tiles to clipboard",
-    KeyActions.RECT: "Fill tiles with selected color"
+    KeyActions.RECT: "Fill tiles with selected color",
+    KeyActions.FLIP_H: "Flip tiles horizontally",
+    KeyActions.FLIP_V: "Flip tiles vertically",
+    KeyActions.ROTATE_CW: "Rotate tiles 90 degrees clockwise",
+    KeyActions.ROTATE_CCW: "Rotate tiles 90 degrees counterclockwise",
+    KeyActions.SCALE: "Scale tiles to a new size"
 }
 
 KEY_ACTIONS_SELECT_PIXELS = {
@@ -313,7 +471,11 @@ KEY_ACTIONS_SELECT_PIXELS = {
     ord('o'): KeyActions.OPERATION,
     ord('m'): KeyActions.TOOL_MODE,
     ord('r'): KeyActions.RECT,
-    ord('c'): KeyActions.CIRCLE
+    ord('c'): KeyActions.CIRCLE,
+    ord('A'): KeyActions.NUDGE_LEFT,
+    ord('D'): KeyActions.NUDGE_RIGHT,
+    ord('W'): KeyActions.NUDGE_UP,
+    ord('S'): KeyActions.NUDGE_DOWN
 }
 
 KEY_ACTIONS_SELECT_PIXELS_DESCRIPTIONS = {
@@ -326,7 +488,11 @@ KEY_ACTIONS_SELECT_PIXELS_DESCRIPTIONS = {
     KeyActions.OPERATION: "Cycle pixel operations (Set, Clear, Invert)",
     KeyActions.TOOL_MODE: "Cycle cool modes (Outline, Fill)",
     KeyActions.RECT: "Draw a rectangle fit to the selection box",
-    KeyActions.CIRCLE: "Draw a circle fit to the selection box"
+    KeyActions.CIRCLE: "Draw a circle fit to the selection box",
+    KeyActions.NUDGE_LEFT: "Move selected pixels left 1 pixel",
+    KeyActions.NUDGE_RIGHT: "Move selected pixels right 1 pixel",
+    KeyActions.NUDGE_UP: "Move selected pixels up 1 pixel",
+    KeyActions.NUDGE_DOWN: "Move selected pixels down 1 pixel"
 }
 
 KEY_ACTIONS_PROMPT = {
@@ -470,6 +636,101 @@ COLORS = {
     True:  (DEFAULT_FG, DEFAULT_BG)
 }
 
+XTERM_PALETTE = [(0, 0, 0), (205, 0, 0), (0, 205, 0), (205, 205, 0),
+                 (0, 0, 238), (205, 0, 205), (0, 205, 205), (229, 229, 229),
+                 (127, 127, 127), (255, 0, 0), (0, 255, 0), (255, 255, 0),
+                 (92, 92, 255), (255, 0, 255), (0, 255, 255), (255, 255, 255)]
+XTERM_PALETTE.extend(itertools.product((0, 95, 135, 175, 215, 255), repeat=3))
+XTERM_PALETTE.extend((8 + (i * 10),) * 3 for i in range(24))
+
+BAYER4 = ((0, 8, 2, 10),
+          (12, 4, 14, 6),
+          (3, 11, 1, 9),
+          (15, 7, 13, 5))
+# per row/column of the bayer matrix, a table for bytes.translate that takes
+# a luminance value to a pixel on or off
+DITHER_TABLES = tuple(tuple(bytes(int(v >= level * 16 + 8) for v in range(256)) for level in row) for row in BAYER4)
+THRESHOLD_TABLE = bytes(int(v >= 128) for v in range(256))
+ALPHA_TABLE = THRESHOLD_TABLE
+IMPORT_DITHER = True
+CLASH_KMEANS_ITERATIONS = 8
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+# color state after normal, also what a transparent background is
+SGR_DEFAULT = (-1, -1, -1)
+# color state that's not known, so the next cell has to send it
+SGR_UNSET = ()
+# most color states to keep around per cell while planning a row
+SGR_MAX_STATES = 16
+# compressed files are known by their magic or else by their extension
+COMPRESSION_MAGIC = ((b'\x1f\x8b', gzip),
+                     (b'\xfd7zXZ\x00', lzma),
+                     (b'BZh', bz2))
+COMPRESSION_SUFFIXES = {'.gz': gzip,
+                        '.xz': lzma,
+                        '.bz2': bz2}
+# zoomed view background for pixels set in the frame before
+ONION_COLOR = 8
+ONION_COLOR_RGB = (96, 96, 96)
+ANIMATION_FPS = 10
+# how many entries at a time to compare when looking for changes in frames
+DELTA_CHUNK = 256
+# seconds between checking if a watched file changed
+WATCH_INTERVAL = 1.0
+# seconds between autosaves, 0 to turn it off
+AUTOSAVE_INTERVAL = 30.0
+# bytes per second autosave is allowed to write, 0 for no limit
+AUTOSAVE_BUDGET = 1048576
+AUTOSAVE_SUFFIX = '.autosave'
+AUTOSAVE_UNTITLED = 'untitled'
+# seconds to wait for an autosave in progress when quitting
+AUTOSAVE_STOP_TIMEOUT = 1.0
+# seconds between writing out and syncing undo journal records
+JOURNAL_INTERVAL = 1.0
+JOURNAL_SUFFIX = '.journal'
+# rewrite the journal with just the current canvas and history once it's grown
+# past this many times the size it was after the last rewrite, or the minimum
+JOURNAL_COMPACT_RATIO = 4
+JOURNAL_COMPACT_MIN = 1048576
+# kind, payload length
+JOURNAL_HEADER = '<cI'
+# x, y, w, h in cells, whole buffer, color mode, layers
+JOURNAL_RECT = '<iiiiBBB'
+# color mode, bounds in cells, pixel count, cell count
+JOURNAL_SPARSE = '<BiiiiII'
+# most named clipboards kept and the most bytes they can take up together,
+# the least recently used are dropped past either
+CLIPBOARD_SLOTS = 16
+CLIPBOARD_MEMORY = 16777216
+CLIPBOARD_DEFAULT = ''
+# set to anything to profile from the start, stats are saved on quitting
+PROFILE_ENV = 'TERM42_PROFILE'
+PROFILE_SUFFIX = '.pstats'
+# how many of the functions taking the most time to show when stopped
+PROFILE_TOP = 3
+# how many of the latest times to keep for each action and for drawing
+FRAME_STATS_WINDOW = 1000
+FRAME_STATS_SUFFIX = '.frames.json'
+# terminal size when replaying keys without one
+HEADLESS_WIDTH = 160
+HEADLESS_HEIGHT = 50
+# sent over and over once a replayed key script runs out to back out of
+# whatever it was doing and quit, giving up after this many tries
+HEADLESS_QUIT_KEYS = ('KEY_ESCAPE', 'Q', 'y', 'KEY_ENTER')
+HEADLESS_QUIT_TRIES = 8
+EXPORT_PIXEL_SIZE = (4, 4)
+# what transparent backgrounds become in formats without alpha
+EXPORT_TRANSPARENT = (0, 0, 0)
+# stands in for a transparent background in HTML runs, so it's told apart
+# from "any background"
+EXPORT_TRANSPARENT_HTML = ()
+# how much compressed data to collect before writing out an IDAT chunk
+EXPORT_CHUNK_SIZE = 65536
+
+class SGROp(Enum):
+    NORMAL = auto()
+    FG = auto()
+    BG = auto()
+
 class FillMode(Enum):
     SET = auto()
     CLEAR = auto()
@@ -481,10 +742,94 @@ FILL_MODE_CYCLE = {
     FillMode.INVERT: FillMode.SET
 }
 
+NUDGE_OFFSETS = {
+    KeyActions.NUDGE_LEFT: (-1, 0),
+    KeyActions.NUDGE_RIGHT: (1, 0),
+    KeyActions.NUDGE_UP: (0, -1),
+    KeyActions.NUDGE_DOWN: (0, 1)
+}
+
+class PasteMode(Enum):
+    REPLACE = auto()
+    OR = auto()
+    AND = auto()
+    XOR = auto()
+    MASK = auto() # clear pixels in the clipboard are transparent
+
+PASTE_MODE_CYCLE = {
+    PasteMode.REPLACE: PasteMode.OR,
+    PasteMode.OR: PasteMode.AND,
+    PasteMode.AND: PasteMode.XOR,
+    PasteMode.XOR: PasteMode.MASK,
+    PasteMode.MASK: PasteMode.REPLACE
+}
+
+PASTE_MODE_OPERATORS = {
+    PasteMode.REPLACE: None,
+    PasteMode.OR: operator.or_,
+    PasteMode.AND: operator.and_,
+    PasteMode.XOR: operator.xor,
+    PasteMode.MASK: operator.or_
+}
+
+class PasteLayers(Enum):
+    BOTH = auto()
+    PIXELS = auto()
+    COLORS = auto()
+
+PASTE_LAYERS_CYCLE = {
+    PasteLayers.BOTH: PasteLayers.PIXELS,
+    PasteLayers.PIXELS: PasteLayers.COLORS,
+    PasteLayers.COLORS: PasteLayers.BOTH
+}
+
+class BlankSkip(Enum):
+    NONE = auto()
+    TRIM = auto()
+    CURSOR = auto()
+
+BLANK_SKIP_CYCLE = {
+    BlankSkip.NONE: BlankSkip.TRIM,
+    BlankSkip.TRIM: BlankSkip.CURSOR,
+    BlankSkip.CURSOR: BlankSkip.NONE
+}
+
+class Glyphs(Enum):
+    OCTANT = auto()
+    BRAILLE = auto()
+    SEXTANT = auto()
+    QUADRANT = auto()
+
+GLYPHS_CYCLE = {
+    Glyphs.OCTANT: Glyphs.BRAILLE,
+    Glyphs.BRAILLE: Glyphs.SEXTANT,
+    Glyphs.SEXTANT: Glyphs.QUADRANT,
+    Glyphs.QUADRANT: Glyphs.OCTANT
+}
+
+GLYPHS_CHARS = {
+    Glyphs.OCTANT: CHARS4,
+    Glyphs.BRAILLE: CHARS_BRAILLE,
+    Glyphs.SEXTANT: CHARS_SEXTANT,
+    Glyphs.QUADRANT: CHARS_QUADRANT
+}
+
+# glyphs where a cell's inverse is always drawn as the opposite of it, so it
+# can be drawn that way with the colors swapped.  the others lose detail, so
+# a cell and its inverse can both be drawn mostly filled or mostly empty.
+GLYPHS_INVERTIBLE = (Glyphs.OCTANT, Glyphs.BRAILLE)
+
 class ToolMode(Enum):
     OUTLINE = auto()
     FILL = auto()
 
+class Transform(Enum):
+    FLIP_H = auto()
+    FLIP_V = auto()
+    ROTATE_CW = auto()
+    ROTATE_CCW = auto()
+    SCALE = auto()
+
 class DataRect:
     def __init__(self,
                  x : int, y : int,
@@ -496,64 +841,80 @@ class DataRect:
                  colordata_fg_b : array,
                  colordata_bg_r : array,
                  colordata_bg_g : array,
-                 colordata_bg_b : array):
+                 colordata_bg_b : array,
+                 layers : PasteLayers = PasteLayers.BOTH):
+        # only keep what's on the canvas, so each plane is whole rows of w
+        w = max(0, min(w, dw - x))
+        h = max(0, min(h, len(colordata_fg_r) // dw - y))
         self.x = x
         self.y = y
         self.w = w
+        self.h = h
         self.color_mode = color_mode
         self.whole_buffer = False
         if w == dw and h == len(colordata_fg_r) // dw:
             self.whole_buffer = True
+            layers = PasteLayers.BOTH
+        # an undo only needs to keep what's going to change
+        self.layers = layers
 
         if self.whole_buffer:
-            # if it's the whole thing, just copy it
+            # if it's the whole thing, just copy all of it, since it's all
+            # given back
             self.data = copy.copy(data)
             self.colordata_fg_r = copy.copy(colordata_fg_r)
             self.colordata_bg_r = copy.copy(colordata_bg_r)
-            if color_mode == ColorMode.DIRECT:
-                self.colordata_fg_g = copy.copy(colordata_fg_g)
-                self.colordata_fg_b = copy.copy(colordata_fg_b)
-                self.colordata_bg_g = copy.copy(colordata_bg_g)
-                self.colordata_bg_b = copy.copy(colordata_bg_b)
+            self.colordata_fg_g = copy.copy(colordata_fg_g)
+            self.colordata_fg_b = copy.copy(colordata_fg_b)
+            self.colordata_bg_g = copy.copy(colordata_bg_g)
+            self.colordata_bg_b = copy.copy(colordata_bg_b)
         else:
             # build up the arrays of data to store locally
-            self.data = array('i', itertools.repeat(0, (w * 2) * (h * 4)))
-            self.colordata_fg_r = array('i', itertools.repeat(0, w * h))
-            self.colordata_bg_r = array('i', itertools.repeat(0, w * h))
-            if color_mode == ColorMode.DIRECT:
-                self.colordata_fg_g = array('i', itertools.repeat(0, w * h))
-                self.colordata_fg_b = array('i', itertools.repeat(0, w * h))
-                self.colordata_bg_g = array('i', itertools.repeat(0, w * h))
-                self.colordata_bg_b = array('i', itertools.repeat(0, w * h))
+            self.data = None
+            self.colordata_fg_r = None
+            self.colordata_bg_r = None
+            if layers != PasteLayers.COLORS:
+                self.data = array('i', itertools.repeat(0, (w * 2) * (h * 4)))
+            if layers != PasteLayers.PIXELS:
+                self.colordata_fg_r = array('i', itertools.repeat(0, w * h))
+                self.colordata_bg_r = array('i', itertools.repeat(0, w * h))
+                if color_mode == ColorMode.DIRECT:
+                    self.colordata_fg_g = array('i', itertools.repeat(0, w * h))
+                    self.colordata_fg_b = array('i', itertools.repeat(0, w * h))
+                    self.colordata_bg_g = array('i', itertools.repeat(0, w * h))
+                    self.colordata_bg_b = array('i', itertools.repeat(0, w * h))
             cw = dw * 2
             sw = self.w * 2
             cx = self.x * 2
-            for i in range(h):
-                self.data[i * (sw * 4)           :i * (sw * 4) +            sw] = \
-                    data[((self.y + i) * (cw * 4)) +            cx:((self.y + i) * (cw * 4)) +            cx + sw]
-                self.data[i * (sw * 4) +  sw     :i * (sw * 4) +  sw +      sw] = \
-                    data[((self.y + i) * (cw * 4)) +  cw +      cx:((self.y + i) * (cw * 4)) +  cw +      cx + sw]
-                self.data[i * (sw * 4) + (sw * 2):i * (sw * 4) + (sw * 2) + sw] = \
-                    data[((self.y + i) * (cw * 4)) + (cw * 2) + cx:((self.y + i) * (cw * 4)) + (cw * 2) + cx + sw]
-                self.data[i * (sw * 4) + (sw * 3):i * (sw * 4) + (sw * 3) + sw] = \
-                    data[((self.y + i) * (cw * 4)) + (cw * 3) + cx:((self.y + i) * (cw * 4)) + (cw * 3) + cx + sw]
-
-                self.colordata_fg_r[i * self.w:i * self.w + self.w] = \
-                    colordata_fg_r[(self.y + i) * dw + self.x:(self.y + i) * dw + self.x + self.w]
-                self.colordata_bg_r[i * self.w:i * self.w + self.w] = \
-                    colordata_bg_r[(self.y + i) * dw + self.x:(self.y + i) * dw + self.x + self.w]
-                if color_mode == ColorMode.DIRECT:
-                    self.colordata_fg_g[i * self.w:i * self.w + self.w] = \
-                        colordata_fg_g[(self.y + i) * dw + self.x:(self.y + i) * dw + self.x + self.w]
-                    self.colordata_fg_b[i * self.w:i * self.w + self.w] = \
-                        colordata_fg_b[(self.y + i) * dw + self.x:(self.y + i) * dw + self.x + self.w]
-                    self.colordata_bg_g[i * self.w:i * self.w + self.w] = \
-                        colordata_bg_g[(self.y + i) * dw + self.x:(self.y + i) * dw + self.x + self.w]
-                    self.colordata_bg_b[i * self.w:i * self.w + self.w] = \
-                        colordata_bg_b[(self.y + i) * dw + self.x:(self.y + i) * dw + self.x + self.w]
+            if layers != PasteLayers.COLORS:
+                for i in range(h):
+                    self.data[i * (sw * 4)           :i * (sw * 4) +            sw] = \
+                        data[((self.y + i) * (cw * 4)) +            cx:((self.y + i) * (cw * 4)) +            cx + sw]
+                    self.data[i * (sw * 4) +  sw     :i * (sw * 4) +  sw +      sw] = \
+                        data[((self.y + i) * (cw * 4)) +  cw +      cx:((self.y + i) * (cw * 4)) +  cw +      cx + sw]
+                    self.data[i * (sw * 4) + (sw * 2):i * (sw * 4) + (sw * 2) + sw] = \
+                        data[((self.y + i) * (cw * 4)) + (cw * 2) + cx:((self.y + i) * (cw * 4)) + (cw * 2) + cx + sw]
+                    self.data[i * (sw * 4) + (sw * 3):i * (sw * 4) + (sw * 3) + sw] = \
+                        data[((self.y + i) * (cw * 4)) + (cw * 3) + cx:((self.y + i) * (cw * 4)) + (cw * 3) + cx + sw]
+
+            if layers != PasteLayers.PIXELS:
+                for i in range(h):
+                    self.colordata_fg_r[i * self.w:i * self.w + self.w] = \
+                        colordata_fg_r[(self.y + i) * dw + self.x:(self.y + i) * dw + self.x + self.w]
+                    self.colordata_bg_r[i * self.w:i * self.w + self.w] = \
+                        colordata_bg_r[(self.y + i) * dw + self.x:(self.y + i) * dw + self.x + self.w]
+                    if color_mode == ColorMode.DIRECT:
+                        self.colordata_fg_g[i * self.w:i * self.w + self.w] = \
+                            colordata_fg_g[(self.y + i) * dw + self.x:(self.y + i) * dw + self.x + self.w]
+                        self.colordata_fg_b[i * self.w:i * self.w + self.w] = \
+                            colordata_fg_b[(self.y + i) * dw + self.x:(self.y + i) * dw + self.x + self.w]
+                        self.colordata_bg_g[i * self.w:i * self.w + self.w] = \
+                            colordata_bg_g[(self.y + i) * dw + self.x:(self.y + i) * dw + self.x + self.w]
+                        self.colordata_bg_b[i * self.w:i * self.w + self.w] = \
+                            colordata_bg_b[(self.y + i) * dw + self.x:(self.y + i) * dw + self.x + self.w]
 
     def get_dims(self):
-        return self.w, len(self.colordata_fg_r) // self.w
+        return self.w, self.h
 
     def apply(self,
               dw : int, data : array,
@@ -563,8 +924,12 @@ class DataRect:
               colordata_bg_r : array,
               colordata_bg_g : array,
               colordata_bg_b : array,
-              x : int = -1, y : int = -1):
+              x : int = -1, y : int = -1,
+              mode : PasteMode = PasteMode.REPLACE,
+              layers : None | PasteLayers = None):
         other_dest : bool = False
+        if layers is None:
+            layers = self.layers
         # dw, x and y should be given in characer cell dimensions
         w, h = self.get_dims()
         if x >= 0:
@@ -589,16 +954,37 @@ class DataRect:
             cw = dw * 2
             sw = self.w * 2
             cx = x * 2
+            combine = PASTE_MODE_OPERATORS[mode]
             # reverse of building the arrays?
             for i in range(h):
-                data[((y + i) * (cw * 4)) +            cx:((y + i) * (cw * 4)) +            cx + (w * 2)] = \
-                    self.data[i * (sw * 4)           :i * (sw * 4) +            (w * 2)]
-                data[((y + i) * (cw * 4)) +  cw +      cx:((y + i) * (cw * 4)) +  cw +      cx + (w * 2)] = \
-                    self.data[i * (sw * 4) +  sw     :i * (sw * 4) +  sw +      (w * 2)]
-                data[((y + i) * (cw * 4)) + (cw * 2) + cx:((y + i) * (cw * 4)) + (cw * 2) + cx + (w * 2)] = \
-                    self.data[i * (sw * 4) + (sw * 2):i * (sw * 4) + (sw * 2) + (w * 2)]
-                data[((y + i) * (cw * 4)) + (cw * 3) + cx:((y + i) * (cw * 4)) + (cw * 3) + cx + (w * 2)] = \
-                    self.data[i * (sw * 4) + (sw * 3):i * (sw * 4) + (sw * 3) + (w * 2)]
+                if layers != PasteLayers.COLORS:
+                    for j in range(4):
+                        start = ((y + i) * (cw * 4)) + (cw * j) + cx
+                        src = self.data[i * (sw * 4) + (sw * j):i * (sw * 4) + (sw * j) + (w * 2)]
+                        if combine is None:
+                            data[start:start + (w * 2)] = src
+                        else:
+                            # whole row at once
+                            int_to_span(data, start, start + (w * 2),
+                                        combine(span_to_int(data, start, start + (w * 2)),
+                                                span_to_int(src, 0, len(src))))
+
+                if layers == PasteLayers.PIXELS:
+                    continue
+
+                if mode == PasteMode.MASK:
+                    # only cells with some pixels set take on the colors
+                    for j in range(w):
+                        if make_cell(self.data, j * 2, i * 4, sw) == 0:
+                            continue
+                        colordata_fg_r[(y + i) * dw + x + j] = self.colordata_fg_r[i * self.w + j]
+                        colordata_bg_r[(y + i) * dw + x + j] = self.colordata_bg_r[i * self.w + j]
+                        if self.color_mode == ColorMode.DIRECT:
+                            colordata_fg_g[(y + i) * dw + x + j] = self.colordata_fg_g[i * self.w + j]
+                            colordata_fg_b[(y + i) * dw + x + j] = self.colordata_fg_b[i * self.w + j]
+                            colordata_bg_g[(y + i) * dw + x + j] = self.colordata_bg_g[i * self.w + j]
+                            colordata_bg_b[(y + i) * dw + x + j] = self.colordata_bg_b[i * self.w + j]
+                    continue
 
                 colordata_fg_r[(y + i) * dw + x:(y + i) * dw + x + w] = \
                     self.colordata_fg_r[i * self.w:i * self.w + w]
@@ -616,6 +1002,106 @@ class DataRect:
 
         return None, None, None, None, None, None, None, None, None, None
 
+    def transform(self, transform : Transform, nw : int = 0, nh : int = 0):
+        # returns a new DataRect with the contents transformed, positioned at
+        # the same top left.  nw and nh are the size in character cells for
+        # SCALE, rotations may pad out to the next whole cell.
+        w, h = self.get_dims()
+        pw : int = w * 2
+        ph : int = h * 4
+        planes = [self.colordata_fg_r, self.colordata_bg_r]
+        if self.color_mode == ColorMode.DIRECT:
+            planes.extend((self.colordata_fg_g, self.colordata_fg_b,
+                           self.colordata_bg_g, self.colordata_bg_b))
+
+        match transform:
+            case Transform.FLIP_H:
+                nw = w
+                nh = h
+                new_data = array('i', self.data)
+                for i in range(ph):
+                    new_data[i * pw:i * pw + pw] = self.data[i * pw:i * pw + pw][::-1]
+                new_planes = []
+                for plane in planes:
+                    new_plane = array('i', plane)
+                    for i in range(h):
+                        new_plane[i * w:i * w + w] = plane[i * w:i * w + w][::-1]
+                    new_planes.append(new_plane)
+            case Transform.FLIP_V:
+                nw = w
+                nh = h
+                new_data = array('i', self.data)
+                for i in range(ph):
+                    new_data[i * pw:i * pw + pw] = self.data[(ph - i - 1) * pw:(ph - i - 1) * pw + pw]
+                new_planes = []
+                for plane in planes:
+                    new_plane = array('i', plane)
+                    for i in range(h):
+                        new_plane[i * w:i * w + w] = plane[(h - i - 1) * w:(h - i - 1) * w + w]
+                    new_planes.append(new_plane)
+            case _:
+                # everything else maps each destination pixel back to a
+                # source pixel, which is simplest done a whole row at a time
+                if transform == Transform.SCALE:
+                    if nw < 1 or nh < 1:
+                        raise ValueError("Scaled size must be at least 1 cell.")
+                else:
+                    nw = (ph + 1) // 2
+                    nh = (pw + 3) // 4
+                npw : int = nw * 2
+                nph : int = nh * 4
+                new_data = array('i', itertools.repeat(0, npw * nph))
+
+                match transform:
+                    case Transform.ROTATE_CW:
+                        # destination row is a source column read bottom to top
+                        for i in range(min(nph, pw)):
+                            new_data[i * npw:i * npw + ph] = self.data[i::pw][::-1]
+                        src_xy = lambda x, y: (y, ph - 1 - x)
+                    case Transform.ROTATE_CCW:
+                        # destination row is a source column read top to bottom
+                        for i in range(min(nph, pw)):
+                            new_data[i * npw:i * npw + ph] = self.data[pw - 1 - i::pw]
+                        src_xy = lambda x, y: (pw - 1 - y, x)
+                    case Transform.SCALE:
+                        # nearest neighbor
+                        cols = [(i * pw) // npw for i in range(npw)]
+                        if len(cols) == 1:
+                            getter = lambda row: (row[cols[0]],)
+                        else:
+                            getter = operator.itemgetter(*cols)
+                        for i in range(nph):
+                            src = (i * ph) // nph
+                            new_data[i * npw:i * npw + npw] = \
+                                array('i', getter(self.data[src * pw:src * pw + pw]))
+                        src_xy = lambda x, y: ((x * pw) // npw, (y * ph) // nph)
+
+                # pick colors from whichever source cell the center of each
+                # destination cell lands in
+                src_cells = array('i', itertools.repeat(0, nw * nh))
+                for cy in range(nh):
+                    for cx in range(nw):
+                        sx, sy = src_xy(cx * 2 + 1, cy * 4 + 2)
+                        sx = max(0, min(pw - 1, sx))
+                        sy = max(0, min(ph - 1, sy))
+                        src_cells[cy * nw + cx] = (sy // 4) * w + (sx // 2)
+                new_planes = []
+                for plane in planes:
+                    new_planes.append(array('i', map(plane.__getitem__, src_cells)))
+
+        if self.color_mode == ColorMode.DIRECT:
+            fg_r, bg_r, fg_g, fg_b, bg_g, bg_b = new_planes
+        else:
+            fg_r, bg_r = new_planes
+            fg_g = fg_b = bg_g = bg_b = None
+
+        new_rect = DataRect(0, 0, nw, nh, nw, new_data, self.color_mode,
+                            fg_r, fg_g, fg_b, bg_r, bg_g, bg_b)
+        new_rect.x = self.x
+        new_rect.y = self.y
+        new_rect.whole_buffer = False
+        return new_rect
+
 COLOR_PREVIEW = "𜶉𜶉"
 CURSOR = "🯧🯦"
 BLOCK = "██"
@@ -667,7 +1153,15 @@ def display_zoomed_matrix(term : Term,
                           colordata_fg_b : array,
                           colordata_bg_r : array,
                           colordata_bg_g : array,
-                          colordata_bg_b : array):
+                          colordata_bg_b : array,
+                          heatmap : None | array = None,
+                          onion : None | array = None):
+    if heatmap is not None and len(heatmap) != len(colordata_fg_r):
+        # canvas changed size since the map was made
+        heatmap = None
+    if onion is not None and len(onion) != len(data):
+        onion = None
+
     dx -= pad
     dy -= pad
     cx = dx // 2
@@ -718,7 +1212,15 @@ def display_zoomed_matrix(term : Term,
             if px >= -1 and px <= dw and py >= -1 and py <= dh:
                 if px > -1 and px < dw and py > -1 and py < dh:
                     # set color
-                    if use_color:
+                    if heatmap is not None:
+                        # green is a good fit through to red for the worst
+                        level : int = heatmap[cw * (py // 4) + (px // 2)]
+                        if not data[dw * py + px]:
+                            # keep pixels distinguishable
+                            level //= 2
+                        term.send_bg(level, 255 - level, 0)
+                        term.send_fg(get_visible_inverse_color(level, 255 - level, 0))
+                    elif use_color:
                         ciy : int = py // 4
                         cix : int = px // 2
                         if color_mode == ColorMode.DIRECT:
@@ -783,6 +1285,13 @@ def display_zoomed_matrix(term : Term,
                         term.send_bg(color[0])
                         term.send_fg(color[1])
 
+                    if onion is not None and onion[dw * py + px] and not data[dw * py + px]:
+                        # the frame before shows through unset pixels
+                        if color_mode == ColorMode.DIRECT:
+                            term.send_bg(ONION_COLOR_RGB)
+                        else:
+                            term.send_bg(ONION_COLOR)
+
                     if selecting:
                         sx1 = min(dx + pad, select_x)
                         sy1 = min(dy + pad, select_y)
@@ -969,6 +1478,170 @@ def make_cell(data : array, dx : int, dy : int, dw : int):
 
     return cell
  
+def get_sgr_string(t : blessed.Terminal, kind : SGROp, color : tuple[int, int, int]):
+    match kind:
+        case SGROp.NORMAL:
+            return t.normal
+        case SGROp.FG:
+            if color[1] >= 0:
+                return t.color_rgb(*color)
+            return t.color(color[0])
+        case SGROp.BG:
+            if color[1] >= 0:
+                return t.on_color_rgb(*color)
+            return t.on_color(color[0])
+
+def get_sgr_transition(t : blessed.Terminal, lengths : dict,
+                       state_fg : tuple, state_bg : tuple,
+                       fg : tuple, bg : tuple,
+                       fg_shown : bool, bg_shown : bool):
+    # what needs to be sent to go from one color state to showing a cell.
+    # returns the cost in characters, the new state and what to send.
+    cost : int = 0
+    ops = []
+    if (bg_shown or state_bg == SGR_UNSET) and bg != state_bg:
+        if bg == SGR_DEFAULT:
+            op = (SGROp.NORMAL, None)
+            # fg color is lost too.  if fg was never sent, it still needs to be
+            if state_fg != SGR_UNSET:
+                state_fg = SGR_DEFAULT
+        else:
+            op = (SGROp.BG, bg)
+        if op not in lengths:
+            lengths[op] = len(get_sgr_string(t, *op))
+        cost += lengths[op]
+        ops.append(op)
+        state_bg = bg
+    if (fg_shown or state_fg == SGR_UNSET) and fg != state_fg:
+        op = (SGROp.FG, fg)
+        if op not in lengths:
+            lengths[op] = len(get_sgr_string(t, *op))
+        cost += lengths[op]
+        ops.append(op)
+        state_fg = fg
+
+    return cost, (state_fg, state_bg), ops
+
+def plan_row_sgr(t : blessed.Terminal, lengths : dict,
+                 state : tuple[tuple, tuple],
+                 cells : list[tuple[int, tuple, tuple]],
+                 chars : array = CHARS4,
+                 invert : bool = True):
+    # cells are (cell, fg, bg).  each cell can be drawn as is or as its
+    # inverse with the colors swapped, as long as the background isn't
+    # transparent and invert is set.  the foreground of an empty cell and the background of a
+    # full cell can be left as whatever they were.  find the cheapest way
+    # through the row and return the (character, color codes) to send for
+    # each cell.
+    states = {state: 0}
+    steps = []
+    for cell, fg, bg in cells:
+        choices = [(cell, fg, bg)]
+        if invert and bg != SGR_DEFAULT:
+            choices.append((255 - cell, bg, fg))
+
+        step = {}
+        for prev, prev_cost in states.items():
+            for choice, (c, cfg, cbg) in enumerate(choices):
+                cost, new_state, _ = get_sgr_transition(t, lengths, prev[0], prev[1],
+                                                        cfg, cbg, c != 0, c != 255)
+                cost += prev_cost
+                if new_state not in step or cost < step[new_state][0]:
+                    step[new_state] = (cost, prev, choice)
+
+        # most of the states will be much worse than the best, so only keep
+        # a few of the cheapest
+        best = sorted(step.items(), key=lambda item: item[1][0])[:SGR_MAX_STATES]
+        states = {new_state: cost for new_state, (cost, _, _) in best}
+        steps.append((dict(best), choices))
+
+    # walk back through the cheapest choices
+    picks = []
+    state = min(states, key=states.get)
+    for step, choices in reversed(steps):
+        _, prev, choice = step[state]
+        picks.append(choices[choice])
+        state = prev
+    picks.reverse()
+
+    out = []
+    state_fg, state_bg = state
+    for c, cfg, cbg in picks:
+        _, (state_fg, state_bg), ops = get_sgr_transition(t, lengths, state_fg, state_bg,
+                                                          cfg, cbg, c != 0, c != 255)
+        out.append((chars[c], ops))
+
+    return out
+
+def get_row_cells(data : array, dw : int, iy : int, start : int, end : int,
+                  colordata_fg_r : array,
+                  colordata_fg_g : array,
+                  colordata_fg_b : array,
+                  colordata_bg_r : array,
+                  colordata_bg_g : array,
+                  colordata_bg_b : array):
+    # cells of a row for plan_row_sgr
+    cw : int = dw // 2
+    cells = []
+    for ix in range(start, end):
+        bg = SGR_DEFAULT
+        if colordata_bg_r[iy * cw + ix] >= 0:
+            bg = (colordata_bg_r[iy * cw + ix], colordata_bg_g[iy * cw + ix], colordata_bg_b[iy * cw + ix])
+        cells.append((make_cell(data, ix * 2, iy * 4, dw),
+                      (colordata_fg_r[iy * cw + ix], colordata_fg_g[iy * cw + ix], colordata_fg_b[iy * cw + ix]),
+                      bg))
+
+    return cells
+
+def get_blank_runs(t : blessed.Terminal,
+                   data : array, dw : int, iy : int,
+                   start : int, end : int,
+                   colordata_bg_r : array,
+                   skip : BlankSkip,
+                   erase : bool):
+    # runs of blank cells on transparent backgrounds which are cheaper to skip
+    # over than print, as a dict of start: end.  runs which reach the end
+    # are trimmed, and with CURSOR, runs in between are moved over.  on a
+    # terminal they also have to be erased.
+    runs = {}
+    if skip == BlankSkip.NONE:
+        return runs
+
+    cw : int = dw // 2
+    run_start : int = -1
+    for ix in range(start, end + 1):
+        blank : bool = ix < end and \
+                       colordata_bg_r[iy * cw + ix] < 0 and \
+                       make_cell(data, ix * 2, iy * 4, dw) == 0
+        if blank:
+            if run_start < 0:
+                run_start = ix
+            continue
+        if run_start < 0:
+            continue
+
+        count : int = ix - run_start
+        cost : int = 0
+        if erase:
+            cost += len(t.ech(count))
+        if ix < end:
+            if skip != BlankSkip.CURSOR:
+                run_start = -1
+                continue
+            cost += len(t.move_right(count))
+        if count > cost:
+            runs[run_start] = ix
+        run_start = -1
+
+    return runs
+
+def send_blank_run(term : Term, count : int, trailing : bool):
+    # erase and move over blank transparent cells
+    term.send_normal()
+    print(term.t.ech(count), end='')
+    if not trailing:
+        print(term.t.move_right(count), end='')
+
 def display_matrix(term : Term,
                    color_mode : ColorMode,
                    x : int, y : int,
@@ -988,7 +1661,42 @@ def display_matrix(term : Term,
     for iy in range(cy, min(cy + h, len(colordata_fg_r) // cw)):
         # subtract range start here.  it's simpler than adding it everywhere else
         term.send_pos(x + cx, y + iy)
-        for ix in range(cx, min(cx + w, cw)):
+        end : int = min(cx + w, cw)
+        # erasing needs to be supported
+        runs = {}
+        if len(term.t.ech(1)) > 0:
+            runs = get_blank_runs(term.t, data, dw, iy, cx, end,
+                                  colordata_bg_r, term.blank_skip, True)
+        skip_end : int = 0
+
+        if term.minimize_sgr:
+            cells = get_row_cells(data, dw, iy, cx, end,
+                                  colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                  colordata_bg_r, colordata_bg_g, colordata_bg_b)
+            ix : int = cx
+            while ix < end:
+                if ix in runs:
+                    send_blank_run(term, runs[ix] - ix, runs[ix] == end)
+                    ix = runs[ix]
+                    continue
+                # blank runs reset the colors, so plan up to the next one
+                # from however they're left
+                seg_end : int = min((start for start in runs if start > ix), default=end)
+                for char, ops in plan_row_sgr(term.t, term.sgr_lengths, term.get_sgr_state(),
+                                              cells[ix - cx:seg_end - cx]):
+                    term.send_sgr(ops)
+                    print(char, end='')
+                ix = seg_end
+            continue
+
+        for ix in range(cx, end):
+            if ix < skip_end:
+                continue
+            if ix in runs:
+                skip_end = runs[ix]
+                send_blank_run(term, skip_end - ix, skip_end == end)
+                continue
+
             color_bg_r = colordata_bg_r[iy * cw + ix]
             if color_bg_r < 0:
                 term.send_normal()
@@ -1317,21 +2025,218 @@ def update_matrix_rect(term : Term,
                                                    colordata_fg_r, colordata_fg_g, colordata_fg_b))
                             print(CHARS4[make_cell(data, (cbx + cbw - 1) * 2, i * 4, dw)], end='')
 
-def inkey_numeric(t : blessed.Terminal):
+class Profiler():
+    # cProfile over the main loop, only there while it's turned on
+    def __init__(self):
+        self.profile : None | cProfile.Profile = None
+
+    def is_running(self):
+        return self.profile is not None
+
+    def start(self):
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def pause(self):
+        if self.profile is not None:
+            self.profile.disable()
+
+    def resume(self):
+        if self.profile is not None:
+            self.profile.enable()
+
+    def stop(self, path : pathlib.Path):
+        # returns the functions which took the most time, not counting what
+        # they called, and their share of the total
+        self.profile.disable()
+        stats = pstats.Stats(self.profile)
+        self.profile = None
+        stats.dump_stats(path)
+        # not the profiler turning itself off for pause
+        top = sorted((item for item in stats.stats.items() if '_lsprof' not in item[0][2]),
+                     key=lambda item: item[1][2], reverse=True)[:PROFILE_TOP]
+        total : float = max(stats.total_tt, 1e-9)
+        return ", ".join(f"{func} {tt / total * 100.0:.0f}%"
+                         for (_, _, func), (_, _, tt, _, _) in top)
+
+def get_percentile(samples, percent : float):
+    if len(samples) == 0:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100.0))]
+
+def get_histogram(samples):
+    # counts of times in seconds, in buckets doubling from 1us, as the top of
+    # each bucket in ms and its count
+    buckets : dict[int, int] = {}
+    for sample in samples:
+        bucket : int = max(0, int(sample * 1000000.0)).bit_length()
+        buckets[bucket] = buckets.get(bucket, 0) + 1
+    return [((1 << bucket) / 1000.0, buckets[bucket]) for bucket in sorted(buckets.keys())]
+
+class FrameStats():
+    # how long each action takes to handle, and how long each frame takes to
+    # draw with how many bytes and cells it sent, over the latest few
+    def __init__(self, window : int = FRAME_STATS_WINDOW):
+        self.window : int = window
+        self.actions : dict[str, collections.deque] = {}
+        self.counts : dict[str, int] = {}
+        self.render : collections.deque = collections.deque(maxlen=window)
+        self.bytes : collections.deque = collections.deque(maxlen=window)
+        self.cells : collections.deque = collections.deque(maxlen=window)
+        self.frames : int = 0
+        self.total_bytes : int = 0
+        self.total_cells : int = 0
+        self.last_action : None | str = None
+
+    def add_action(self, name : str, seconds : float):
+        if name not in self.actions:
+            self.actions[name] = collections.deque(maxlen=self.window)
+            self.counts[name] = 0
+        self.actions[name].append(seconds)
+        self.counts[name] += 1
+        self.last_action = name
+
+    def add_frame(self, seconds : float, sent : int, cells : int):
+        self.render.append(seconds)
+        self.bytes.append(sent)
+        self.cells.append(cells)
+        self.frames += 1
+        self.total_bytes += sent
+        self.total_cells += cells
+
+    def get_overlay(self):
+        # for the status line, times in ms
+        text : str = ""
+        if self.last_action is not None:
+            samples = self.actions[self.last_action]
+            text = f"{self.last_action} {get_percentile(samples, 50) * 1000.0:.1f}/" \
+                   f"{get_percentile(samples, 99) * 1000.0:.1f}ms  "
+        if len(self.render) > 0:
+            text += f"Draw {get_percentile(self.render, 50) * 1000.0:.1f}/" \
+                    f"{get_percentile(self.render, 99) * 1000.0:.1f}ms " \
+                    f"{self.bytes[-1]}B {self.cells[-1]} cells"
+        return text
+
+    def get_summary(self, samples, count : int):
+        return {'count': count,
+                'p50_ms': get_percentile(samples, 50) * 1000.0,
+                'p90_ms': get_percentile(samples, 90) * 1000.0,
+                'p99_ms': get_percentile(samples, 99) * 1000.0,
+                'max_ms': max(samples, default=0.0) * 1000.0,
+                'histogram_ms': get_histogram(samples)}
+
+    def save(self, path : pathlib.Path):
+        stats = {'window': self.window,
+                 'actions': {name: self.get_summary(samples, self.counts[name])
+                             for name, samples in sorted(self.actions.items())},
+                 'render': self.get_summary(self.render, self.frames),
+                 'bytes': {'p50': get_percentile(self.bytes, 50),
+                           'p99': get_percentile(self.bytes, 99),
+                           'total': self.total_bytes},
+                 'cells': {'p50': get_percentile(self.cells, 50),
+                           'p99': get_percentile(self.cells, 99),
+                           'total': self.total_cells}}
+        with open(path, 'w') as outfile:
+            json.dump(stats, outfile, indent=1)
+
+def get_frame_stats_path(filename : str):
+    if len(filename) == 0:
+        return pathlib.Path(AUTOSAVE_UNTITLED + FRAME_STATS_SUFFIX)
+    return pathlib.Path(filename + FRAME_STATS_SUFFIX)
+
+def get_profile_path(filename : str):
+    if len(filename) == 0:
+        return pathlib.Path(AUTOSAVE_UNTITLED + PROFILE_SUFFIX)
+    return pathlib.Path(filename + PROFILE_SUFFIX)
+
+def union_rect(a : None | tuple[int, int, int, int],
+               b : tuple[int, int, int, int]):
+    # smallest x, y, w, h covering both
+    if a is None:
+        return b
+    x1 : int = min(a[0], b[0])
+    y1 : int = min(a[1], b[1])
+    x2 : int = max(a[0] + a[2], b[0] + b[2])
+    y2 : int = max(a[1] + a[3], b[1] + b[3])
+    return x1, y1, x2 - x1, y2 - y1
+
+class Macro():
+    # keys as inkey_numeric gives them, so keys typed in to prompts are
+    # recorded and played back too
+    def __init__(self):
+        self.recording : bool = False
+        self.keys : list[tuple[bool, int]] = []
+        # how far the cursor moved while recording
+        self.step_x : int = 0
+        self.step_y : int = 0
+        self.playing : None | list[tuple[bool, int]] = None
+        self.pos : int = 0
+
+    def start_recording(self):
+        self.recording = True
+        self.keys = []
+
+    def drop_last(self):
+        if len(self.keys) > 0:
+            self.keys.pop(-1)
+
+    def stop_recording(self, step_x : int, step_y : int):
+        self.recording = False
+        # the key which stopped it
+        self.drop_last()
+        self.step_x = step_x
+        self.step_y = step_y
+
+    def record(self, is_text : bool, key : int):
+        if self.recording:
+            self.keys.append((is_text, key))
+
+    def play(self):
+        self.playing = self.keys
+        self.pos = 0
+
+    def is_playing(self):
+        return self.playing is not None and self.pos < len(self.playing)
+
+    def next_key(self):
+        if not self.is_playing():
+            self.playing = None
+            return None
+        key = self.playing[self.pos]
+        self.pos += 1
+        return key
+
+def inkey_numeric(t : blessed.Terminal, idle : tuple = ()):
     global interrupted
 
+    if macro is not None:
+        played = macro.next_key()
+        if played is not None:
+            return played
+
     key = ""
     while len(key) == 0:
         key = t.inkey(0.5)
         if interrupted:
             return False, None
-
+        if len(key) == 0:
+            # things to do while waiting, which can return True to stop
+            # waiting without a key
+            for func in idle:
+                if func():
+                    return False, None
+
+    is_text : bool = False
     try:
-        return False, t._keymap[key]
+        key = t._keymap[key]
     except KeyError:
-        pass
+        is_text = True
+        key = ord(key)
 
-    return True, ord(key)
+    if macro is not None:
+        macro.record(is_text, key)
+    return is_text, key
 
 def print_status(term : Term, text : str, row : int = 0):
     global interrupted
@@ -1640,6 +2545,162 @@ def new_color_data(color_mode : ColorMode, width : int, height : int):
 
     return colordata_fg_r, colordata_fg_g, colordata_fg_b, colordata_bg_r, colordata_bg_g, colordata_bg_b
 
+def open_text(path : pathlib.Path, mode : str):
+    # open a text file which may be compressed.  reads go through the
+    # decompressor a bit at a time.
+    module = COMPRESSION_SUFFIXES.get(path.suffix.lower())
+    if mode == 'r':
+        with path.open('rb') as infile:
+            magic = infile.read(6)
+        for prefix, magic_module in COMPRESSION_MAGIC:
+            if magic.startswith(prefix):
+                module = magic_module
+                break
+        else:
+            # a plain file which happens to have the extension
+            module = None
+
+    if module is None:
+        return path.open(mode)
+    return module.open(path, mode + 't')
+
+def save_row(t : blessed.Terminal,
+             out,
+             iy : int,
+             color : bool,
+             data : array, dw : int,
+             color_mode : ColorMode,
+             colordata_fg_r : array,
+             colordata_fg_g : array,
+             colordata_fg_b : array,
+             colordata_bg_r : array,
+             colordata_bg_g : array,
+             colordata_bg_b : array,
+             minimize : bool,
+             blank_skip : BlankSkip,
+             lengths : dict,
+             chars : array = CHARS4,
+             invert : bool = True):
+    # write out a row of cells as a line of text
+    # get width in cells for colordata lookup
+    cw = dw // 2
+
+    runs = get_blank_runs(t, data, dw, iy, 0, cw, colordata_bg_r, blank_skip, False)
+    if iy == 0:
+        # keep the first line whole so the width is the same when loaded
+        runs = {start: end for start, end in runs.items() if end < cw}
+    skip_end : int = 0
+
+    if color and minimize:
+        # nothing is set at the start of a line when loading
+        cells = get_row_cells(data, dw, iy, 0, cw,
+                              colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                              colordata_bg_r, colordata_bg_g, colordata_bg_b)
+        for ix, (char, ops) in enumerate(plan_row_sgr(t, lengths, (SGR_UNSET, SGR_UNSET), cells, chars, invert)):
+            for op in ops:
+                out.write(get_sgr_string(t, *op))
+            if ix < skip_end:
+                continue
+            if ix in runs:
+                skip_end = runs[ix]
+                if skip_end < cw:
+                    out.write(t.move_right(skip_end - ix))
+                continue
+            out.write(char)
+        out.write(t.normal)
+        out.write('\n')
+        return
+
+    # print on every line, because it's normaled at the end of each line
+    if color:
+        if color_mode == ColorMode.DIRECT:
+            lastcolor_fg_r = colordata_fg_r[iy * cw]
+            lastcolor_fg_g = colordata_fg_g[iy * cw]
+            lastcolor_fg_b = colordata_fg_b[iy * cw]
+            lastcolor_bg_r = colordata_bg_r[iy * cw]
+            lastcolor_bg_g = colordata_bg_g[iy * cw]
+            lastcolor_bg_b = colordata_bg_b[iy * cw]
+            if lastcolor_bg_r < 0:
+                out.write(t.normal)
+            else:
+                out.write(t.on_color_rgb(lastcolor_bg_r, lastcolor_bg_g, lastcolor_bg_b))
+            out.write(t.color_rgb(lastcolor_fg_r, lastcolor_fg_g, lastcolor_fg_b))
+        else:
+            lastcolor_fg_r = colordata_fg_r[iy * cw]
+            lastcolor_bg_r = colordata_bg_r[iy * cw]
+            if lastcolor_bg_r < 0:
+                out.write(t.normal)
+            else:
+                out.write(t.on_color(lastcolor_bg_r))
+            out.write(t.color(lastcolor_fg_r))
+
+    for ix in range(dw // 2):
+        if ix < skip_end:
+            continue
+        if ix in runs:
+            skip_end = runs[ix]
+            if skip_end == cw:
+                # the rest is blank
+                break
+            if color and lastcolor_bg_r >= 0:
+                # the loader takes skipped cells as transparent
+                out.write(t.normal)
+                lastcolor_fg_r = -1
+                lastcolor_bg_r = -1
+                lastcolor_bg_g = -1
+                lastcolor_bg_b = -1
+            out.write(t.move_right(skip_end - ix))
+            continue
+
+        if color:
+            if color_mode == ColorMode.DIRECT:
+                color_fg_r = colordata_fg_r[iy * cw + ix]
+                color_fg_g = colordata_fg_g[iy * cw + ix]
+                color_fg_b = colordata_fg_b[iy * cw + ix]
+                color_bg_r = colordata_bg_r[iy * cw + ix]
+                color_bg_g = colordata_bg_g[iy * cw + ix]
+                color_bg_b = colordata_bg_b[iy * cw + ix]
+                if color_bg_r != lastcolor_bg_r or \
+                   color_bg_g != lastcolor_bg_g or \
+                   color_bg_b != lastcolor_bg_b:
+                    if color_bg_r < 0:
+                        out.write(t.normal)
+                        # fg color gets unset, so assure it'll always
+                        # think it's changed and needs to be retransmitted
+                        lastcolor_fg_r = -1
+                    else:
+                        out.write(t.on_color_rgb(color_bg_r, color_bg_g, color_bg_b))
+                    lastcolor_bg_r = color_bg_r
+                    lastcolor_bg_g = color_bg_g
+                    lastcolor_bg_b = color_bg_b
+                if color_fg_r != lastcolor_fg_r or \
+                   color_fg_g != lastcolor_fg_g or \
+                   color_fg_b != lastcolor_fg_b:
+                    out.write(t.color_rgb(color_fg_r, color_fg_g, color_fg_b))
+                    lastcolor_fg_r = color_fg_r
+                    lastcolor_fg_g = color_fg_g
+                    lastcolor_fg_b = color_fg_b
+            else:
+                # paletted modes use the R channel for color value
+                color_fg_r = colordata_fg_r[iy * cw + ix]
+                color_bg_r = colordata_bg_r[iy * cw + ix]
+                if color_bg_r != lastcolor_bg_r:
+                    if color_bg_r < 0:
+                        out.write(t.normal)
+                        lastcolor_fg_r = -1
+                    else:
+                        out.write(t.on_color(color_bg_r))
+                    lastcolor_bg_r = color_bg_r
+                if color_fg_r != lastcolor_fg_r:
+                    out.write(t.color(color_fg_r))
+                    lastcolor_fg_r = color_fg_r
+
+        cell = make_cell(data, ix * 2, iy * 4, dw)
+        out.write(chars[cell])
+    if color:
+        out.write(t.normal)
+    out.write('\n')
+
 def save_file(t : blessed.Terminal,
               path : pathlib.Path,
               color : bool,
@@ -1650,87 +2711,719 @@ def save_file(t : blessed.Terminal,
               colordata_fg_b : array,
               colordata_bg_r : array,
               colordata_bg_g : array,
-              colordata_bg_b : array):
+              colordata_bg_b : array,
+              minimize : bool = False,
+              blank_skip : BlankSkip = BlankSkip.NONE,
+              glyphs : Glyphs = Glyphs.OCTANT):
     # TODO: unify terminal output and save functions
 
     # very similar to display_matrix
-    with path.open('w') as out:
-        # get width in cells for colordata lookup
-        cw = dw // 2
-
+    with open_text(path, 'w') as out:
+        lengths = {}
         for iy in range(len(data) // dw // 4):
-            # print on every line, because it's normaled at the end of each line
-            if color:
-                if color_mode == ColorMode.DIRECT:
-                    lastcolor_fg_r = colordata_fg_r[iy * cw]
-                    lastcolor_fg_g = colordata_fg_g[iy * cw]
-                    lastcolor_fg_b = colordata_fg_b[iy * cw]
-                    lastcolor_bg_r = colordata_bg_r[iy * cw]
-                    lastcolor_bg_g = colordata_bg_g[iy * cw]
-                    lastcolor_bg_b = colordata_bg_b[iy * cw]
-                    if lastcolor_bg_r < 0:
-                        out.write(t.normal)
-                    else:
-                        out.write(t.on_color_rgb(lastcolor_bg_r, lastcolor_bg_g, lastcolor_bg_b))
-                    out.write(t.color_rgb(lastcolor_fg_r, lastcolor_fg_g, lastcolor_fg_b))
+            save_row(t, out, iy, color, data, dw, color_mode,
+                     colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                     colordata_bg_r, colordata_bg_g, colordata_bg_b,
+                     minimize, blank_skip, lengths, GLYPHS_CHARS[glyphs],
+                     glyphs in GLYPHS_INVERTIBLE)
+
+class Autosaver():
+    # the input loop calls poll while waiting for keys, which copies only the
+    # rows that changed since the last autosave.  the thread turns those in
+    # to lines, keeping the lines of the rest from before, and writes them to
+    # a temporary file which then replaces the autosave file.  once the file
+    # is saved or the editor quits, the autosave file is removed.
+    def __init__(self, t : blessed.Terminal,
+                       interval : float = AUTOSAVE_INTERVAL,
+                       budget : int = AUTOSAVE_BUDGET):
+        self.t : blessed.Terminal = t
+        self.interval : float = interval
+        self.budget : int = budget
+        self.filename : str = ""
+        self.canvas : None | tuple = None
+        # copy of the canvas as of the last autosave, to find changed rows
+        self.saved : None | tuple = None
+        self.full : bool = True
+        self.last_save : float = time.monotonic()
+        self.busy : bool = False
+        self.error : None | str = None
+        # only touched by the thread
+        self.lines : list[bytes] = []
+        self.jobs : queue.Queue = queue.Queue()
+        self.thread : threading.Thread = threading.Thread(target=self.run, daemon=True)
+        if self.interval > 0:
+            self.thread.start()
+
+    def get_path(self):
+        if len(self.filename) == 0:
+            return pathlib.Path(AUTOSAVE_UNTITLED + AUTOSAVE_SUFFIX)
+        return pathlib.Path(self.filename + AUTOSAVE_SUFFIX)
+
+    def set_canvas(self, filename : str,
+                   dw : int, color_mode : ColorMode, data : array,
+                   colordata_fg_r : array,
+                   colordata_fg_g : array,
+                   colordata_fg_b : array,
+                   colordata_bg_r : array,
+                   colordata_bg_g : array,
+                   colordata_bg_b : array):
+        # just keep references to what poll should look at
+        self.filename = filename
+        self.canvas = (dw, color_mode, data,
+                       colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                       colordata_bg_r, colordata_bg_g, colordata_bg_b)
+        if self.saved is None:
+            # nothing has changed yet
+            self.saved = (dw, color_mode, *(array('i', plane) for plane in self.canvas[2:]))
+
+    def poll(self):
+        if self.interval <= 0 or self.canvas is None or self.busy:
+            return
+        now : float = time.monotonic()
+        if now - self.last_save < self.interval:
+            return
+        self.last_save = now
+
+        dw, color_mode, *planes = self.canvas
+        saved_dw, saved_color_mode, *saved_planes = self.saved
+        cw : int = dw // 2
+        rows : int = len(planes[0]) // dw // 4
+        # the pixel data has 8 entries for each color entry
+        strides = [dw * 4] + [cw] * 6
+
+        if dw != saved_dw or color_mode != saved_color_mode or \
+           len(planes[0]) != len(saved_planes[0]):
+            self.full = True
+            self.saved = (dw, color_mode, *(array('i', plane) for plane in planes))
+        elif all(plane == saved for plane, saved in zip(planes, saved_planes)):
+            return
+
+        if self.full:
+            dirty = range(rows)
+        else:
+            dirty = [iy for iy in range(rows)
+                     if any(plane[iy * stride:(iy + 1) * stride] != saved[iy * stride:(iy + 1) * stride]
+                            for plane, saved, stride in zip(planes, saved_planes, strides))]
+        self.full = False
+
+        snapshot = {}
+        for iy in dirty:
+            row = tuple(plane[iy * stride:(iy + 1) * stride] for plane, stride in zip(planes, strides))
+            snapshot[iy] = row
+            for saved, stride, part in zip(self.saved[2:], strides, row):
+                saved[iy * stride:(iy + 1) * stride] = part
+
+        self.busy = True
+        self.jobs.put((self.get_path(), dw, color_mode, rows, snapshot))
+
+    def discard(self, filename : str):
+        # the canvas was saved as filename, so there's nothing to recover
+        # until it changes again
+        if self.interval <= 0 or self.canvas is None:
+            return
+        self.jobs.put(self.get_path())
+        self.filename = filename
+        self.jobs.put(self.get_path())
+        dw, color_mode, *planes = self.canvas
+        self.saved = (dw, color_mode, *(array('i', plane) for plane in planes))
+        # the thread's lines are for the file that's gone
+        self.full = True
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            try:
+                if isinstance(job, pathlib.Path):
+                    # removing one, done here so it's after any writes to it
+                    job.unlink(missing_ok=True)
+                    job.with_name(job.name + '.tmp').unlink(missing_ok=True)
                 else:
-                    lastcolor_fg_r = colordata_fg_r[iy * cw]
-                    lastcolor_bg_r = colordata_bg_r[iy * cw]
-                    if lastcolor_bg_r < 0:
-                        out.write(t.normal)
-                    else:
-                        out.write(t.on_color(lastcolor_bg_r))
-                    out.write(t.color(lastcolor_fg_r))
+                    self.write(*job)
+            except Exception as e:
+                # keep going, it might work next time
+                self.error = str(e) or type(e).__name__
+            self.busy = False
+
+    def write(self, path : pathlib.Path, dw : int, color_mode : ColorMode, rows : int, snapshot : dict):
+        del self.lines[rows:]
+        self.lines.extend(itertools.repeat(b'', rows - len(self.lines)))
+        lengths = {}
+        for iy, (data, *planes) in snapshot.items():
+            out = io.StringIO()
+            save_row(self.t, out, 0, True, data, dw, color_mode, *planes,
+                     False, BlankSkip.NONE, lengths)
+            self.lines[iy] = out.getvalue().encode()
+
+        temp = path.with_name(path.name + '.tmp')
+        start : float = time.monotonic()
+        written : int = 0
+        with temp.open('wb') as out:
+            for line in self.lines:
+                out.write(line)
+                written += len(line)
+                if self.budget > 0:
+                    # stay under the budget
+                    ahead : float = (written / self.budget) - (time.monotonic() - start)
+                    if ahead > 0:
+                        out.flush()
+                        time.sleep(ahead)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(temp, path)
+
+    def stop(self):
+        if self.thread.is_alive():
+            self.jobs.put(self.get_path())
+            self.jobs.put(None)
+            self.thread.join(AUTOSAVE_STOP_TIMEOUT)
+
+def get_cell_rgb(color_mode : ColorMode, cell : int,
+                 colordata_r : array,
+                 colordata_g : array,
+                 colordata_b : array):
+    # (R, G, B) of a color plane entry, or None for transparent
+    if colordata_r[cell] < 0:
+        return None
+    if color_mode == ColorMode.DIRECT:
+        return colordata_r[cell], colordata_g[cell], colordata_b[cell]
+    return XTERM_PALETTE[colordata_r[cell]]
+
+def export_rows(data : array, dw : int,
+                color_mode : ColorMode,
+                colordata_fg_r : array,
+                colordata_fg_g : array,
+                colordata_fg_b : array,
+                colordata_bg_r : array,
+                colordata_bg_g : array,
+                colordata_bg_b : array,
+                pw : int, ph : int,
+                alpha : bool):
+    # generate the rendered image 1 output row at a time, each pixel scaled up
+    # to pw by ph.  rows are RGB or RGBA bytes.
+    cw : int = dw // 2
+    for cy in range(len(data) // dw // 4):
+        # the scaled up pixels for each cell's colors only need building once
+        # per row of cells
+        fgs = []
+        bgs = []
+        for cx in range(cw):
+            cell : int = cy * cw + cx
+            fg = get_cell_rgb(color_mode, cell, colordata_fg_r, colordata_fg_g, colordata_fg_b)
+            bg = get_cell_rgb(color_mode, cell, colordata_bg_r, colordata_bg_g, colordata_bg_b)
+            if alpha:
+                fg = (*fg, 255)
+                if bg is None:
+                    bg = (0, 0, 0, 0)
+                else:
+                    bg = (*bg, 255)
+            elif bg is None:
+                bg = EXPORT_TRANSPARENT
+            fgs.append(bytes(fg) * pw)
+            bgs.append(bytes(bg) * pw)
+
+        for py in range(cy * 4, cy * 4 + 4):
+            row = b''.join(fgs[px // 2] if data[py * dw + px] else bgs[px // 2] for px in range(dw))
+            for _ in range(ph):
+                yield row
+
+def write_png_chunk(outfile, chunk_type : bytes, chunk : bytes):
+    outfile.write(struct.pack('>I4s', len(chunk), chunk_type))
+    outfile.write(chunk)
+    outfile.write(struct.pack('>I', zlib.crc32(chunk, zlib.crc32(chunk_type))))
+
+def export_image(path : pathlib.Path,
+                 data : array, dw : int,
+                 color_mode : ColorMode,
+                 colordata_fg_r : array,
+                 colordata_fg_g : array,
+                 colordata_fg_b : array,
+                 colordata_bg_r : array,
+                 colordata_bg_g : array,
+                 colordata_bg_b : array,
+                 pw : int = EXPORT_PIXEL_SIZE[0],
+                 ph : int = EXPORT_PIXEL_SIZE[1]):
+    # write out a PNG, or a PPM if the name ends with .ppm.  rows are rendered
+    # and written as they go so the whole image is never in memory.
+    width : int = dw * pw
+    height : int = len(data) // dw * ph
+    png : bool = path.suffix.lower() != '.ppm'
+    rows = export_rows(data, dw, color_mode,
+                       colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                       colordata_bg_r, colordata_bg_g, colordata_bg_b,
+                       pw, ph, png)
+
+    with path.open('wb') as out:
+        if not png:
+            out.write(f"P6\n{width} {height}\n255\n".encode('ascii'))
+            for row in rows:
+                out.write(row)
+            return
+
+        out.write(PNG_SIGNATURE)
+        # 8 bit RGBA
+        write_png_chunk(out, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+        compressor = zlib.compressobj()
+        pending = []
+        pending_len : int = 0
+        for row in rows:
+            # filter type 0, none, consecutive rows repeat a lot anyway
+            compressed = compressor.compress(b'\x00' + row)
+            if len(compressed) > 0:
+                pending.append(compressed)
+                pending_len += len(compressed)
+                if pending_len >= EXPORT_CHUNK_SIZE:
+                    write_png_chunk(out, b'IDAT', b''.join(pending))
+                    pending = []
+                    pending_len = 0
+        pending.append(compressor.flush())
+        write_png_chunk(out, b'IDAT', b''.join(pending))
+        write_png_chunk(out, b'IEND', b'')
+
+def rgb_to_hex(color : tuple[int, int, int]):
+    return f"#{color[0]:02x}{color[1]:02x}{color[2]:02x}"
+
+def export_html(path : pathlib.Path,
+                data : array, dw : int,
+                color_mode : ColorMode,
+                colordata_fg_r : array,
+                colordata_fg_g : array,
+                colordata_fg_b : array,
+                colordata_bg_r : array,
+                colordata_bg_g : array,
+                colordata_bg_b : array):
+    # a <pre> block with a span per run of cells which can share colors.  a
+    # color a cell doesn't show (foreground of an empty cell, background of a
+    # full one) doesn't matter, so it won't break up a run.
+    cw : int = dw // 2
 
-            for ix in range(dw // 2):
-                if color:
-                    if color_mode == ColorMode.DIRECT:
-                        color_fg_r = colordata_fg_r[iy * cw + ix]
-                        color_fg_g = colordata_fg_g[iy * cw + ix]
-                        color_fg_b = colordata_fg_b[iy * cw + ix]
-                        color_bg_r = colordata_bg_r[iy * cw + ix]
-                        color_bg_g = colordata_bg_g[iy * cw + ix]
-                        color_bg_b = colordata_bg_b[iy * cw + ix]
-                        if color_bg_r != lastcolor_bg_r or \
-                           color_bg_g != lastcolor_bg_g or \
-                           color_bg_b != lastcolor_bg_b:
-                            if color_bg_r < 0:
-                                out.write(t.normal)
-                                # fg color gets unset, so assure it'll always
-                                # think it's changed and needs to be retransmitted
-                                lastcolor_fg_r = -1
-                            else:
-                                out.write(t.on_color_rgb(color_bg_r, color_bg_g, color_bg_b))
-                            lastcolor_bg_r = color_bg_r
-                            lastcolor_bg_g = color_bg_g
-                            lastcolor_bg_b = color_bg_b
-                        if color_fg_r != lastcolor_fg_r or \
-                           color_fg_g != lastcolor_fg_g or \
-                           color_fg_b != lastcolor_fg_b:
-                            out.write(t.color_rgb(color_fg_r, color_fg_g, color_fg_b))
-                            lastcolor_fg_r = color_fg_r
-                            lastcolor_fg_g = color_fg_g
-                            lastcolor_fg_b = color_fg_b
-                    else:
-                        # paletted modes use the R channel for color value
-                        color_fg_r = colordata_fg_r[iy * cw + ix]
-                        color_bg_r = colordata_bg_r[iy * cw + ix]
-                        if color_bg_r != lastcolor_bg_r:
-                            if color_bg_r < 0:
-                                out.write(t.normal)
-                                lastcolor_fg_r = -1
-                            else:
-                                out.write(t.on_color(color_bg_r))
-                            lastcolor_bg_r = color_bg_r
-                        if color_fg_r != lastcolor_fg_r:
-                            out.write(t.color(color_fg_r))
-                            lastcolor_fg_r = color_fg_r
-
-                cell = make_cell(data, ix * 2, iy * 4, dw)
-                out.write(CHARS4[cell])
-            if color:
-                out.write(t.normal)
+    def write_run(out, run : list[str], fg, bg):
+        style = []
+        if fg is not None:
+            style.append(f"color:{rgb_to_hex(fg)}")
+        if bg is not None and bg != EXPORT_TRANSPARENT_HTML:
+            style.append(f"background-color:{rgb_to_hex(bg)}")
+        if len(style) > 0:
+            out.write(f"<span style=\"{';'.join(style)}\">{''.join(run)}</span>")
+        else:
+            out.write(''.join(run))
+
+    # browsers don't assume UTF-8 for a local file without being told
+    with path.open('w', encoding='utf-8') as out:
+        out.write("<!DOCTYPE html>\n<meta charset=\"utf-8\">\n")
+        out.write("<pre style=\"line-height:1\">")
+        for cy in range(len(data) // dw // 4):
+            run = []
+            run_fg = None
+            run_bg = None
+            for cx in range(cw):
+                cellnum : int = cy * cw + cx
+                cell : int = make_cell(data, cx * 2, cy * 4, dw)
+                fg = None
+                if cell != 0:
+                    fg = get_cell_rgb(color_mode, cellnum, colordata_fg_r, colordata_fg_g, colordata_fg_b)
+                bg = None
+                if cell != 0xFF:
+                    bg = get_cell_rgb(color_mode, cellnum, colordata_bg_r, colordata_bg_g, colordata_bg_b)
+                    if bg is None:
+                        bg = EXPORT_TRANSPARENT_HTML
+                if (fg is not None and run_fg is not None and fg != run_fg) or \
+                   (bg is not None and run_bg is not None and bg != run_bg):
+                    write_run(out, run, run_fg, run_bg)
+                    run = []
+                    run_fg = None
+                    run_bg = None
+                if fg is not None:
+                    run_fg = fg
+                if bg is not None:
+                    run_bg = bg
+                run.append(CHARS4[cell])
+            write_run(out, run, run_fg, run_bg)
             out.write('\n')
+        out.write("</pre>\n")
+
+def export_svg(path : pathlib.Path,
+               data : array, dw : int,
+               color_mode : ColorMode,
+               colordata_fg_r : array,
+               colordata_fg_g : array,
+               colordata_fg_b : array,
+               colordata_bg_r : array,
+               colordata_bg_g : array,
+               colordata_bg_b : array,
+               pw : int = EXPORT_PIXEL_SIZE[0],
+               ph : int = EXPORT_PIXEL_SIZE[1]):
+    # backgrounds as a rect per run of cells with the same background color,
+    # then a rect per run of set pixels with the same foreground color.  one
+    # unit is one pixel, scaled up to pw by ph.
+    cw : int = dw // 2
+    dh : int = len(data) // dw
+
+    with path.open('w') as out:
+        out.write(f"<svg xmlns=\"http://www.w3.org/2000/svg\" width=\"{dw * pw}\" height=\"{dh * ph}\" "
+                  f"viewBox=\"0 0 {dw} {dh}\" preserveAspectRatio=\"none\" shape-rendering=\"crispEdges\">\n")
+        for cy in range(dh // 4):
+            start : int = 0
+            last = None
+            for cx in range(cw + 1):
+                bg = None
+                if cx < cw:
+                    bg = get_cell_rgb(color_mode, cy * cw + cx, colordata_bg_r, colordata_bg_g, colordata_bg_b)
+                if bg != last or cx == cw:
+                    if last is not None:
+                        out.write(f"<rect x=\"{start * 2}\" y=\"{cy * 4}\" width=\"{(cx - start) * 2}\" height=\"4\" fill=\"{rgb_to_hex(last)}\"/>\n")
+                    start = cx
+                    last = bg
+
+            fgs = [get_cell_rgb(color_mode, cy * cw + cx, colordata_fg_r, colordata_fg_g, colordata_fg_b) for cx in range(cw)]
+            for py in range(cy * 4, cy * 4 + 4):
+                start = 0
+                last = None
+                for px in range(dw + 1):
+                    fg = None
+                    if px < dw and data[py * dw + px]:
+                        fg = fgs[px // 2]
+                    if fg != last:
+                        if last is not None:
+                            out.write(f"<rect x=\"{start}\" y=\"{py}\" width=\"{px - start}\" height=\"1\" fill=\"{rgb_to_hex(last)}\"/>\n")
+                        start = px
+                        last = fg
+        out.write("</svg>\n")
+
+def make_delta(old : list[array], new : list[array]):
+    # the indices and new values of what changed in each plane.  compare
+    # chunks first since most of a frame is usually the same.
+    delta = []
+    for old_plane, new_plane in zip(old, new):
+        indices = array('i')
+        values = array('i')
+        for start in range(0, len(new_plane), DELTA_CHUNK):
+            end : int = start + DELTA_CHUNK
+            if old_plane[start:end] == new_plane[start:end]:
+                continue
+            for i in range(start, min(end, len(new_plane))):
+                if old_plane[i] != new_plane[i]:
+                    indices.append(i)
+                    values.append(new_plane[i])
+        delta.append((indices, values))
+
+    return delta
+
+def apply_delta(planes : list[array], delta : list[tuple[array, array]]):
+    for plane, (indices, values) in zip(planes, delta):
+        for i, value in zip(indices, values):
+            plane[i] = value
+
+class Animation():
+    # the first frame is kept whole, the rest as only what changed from the
+    # frame before.  planes are the pixel data then the 6 color planes.  each
+    # frame has its own undo and redo lists.
+    def __init__(self, dw : int, color_mode : ColorMode, planes : list[array]):
+        self.dw : int = dw
+        self.color_mode : ColorMode = color_mode
+        self.first : list[array] = [array('i', plane) for plane in planes]
+        self.deltas : list[list[tuple[array, array]]] = []
+        self.undos : list[tuple[list, list]] = [([], [])]
+
+    def __len__(self):
+        return len(self.deltas) + 1
+
+    def fits(self, dw : int, color_mode : ColorMode, data : array):
+        return dw == self.dw and color_mode == self.color_mode and len(data) == len(self.first[0])
+
+    def get_frame(self, index : int):
+        planes = [array('i', plane) for plane in self.first]
+        for delta in self.deltas[:index]:
+            apply_delta(planes, delta)
+
+        return planes
+
+    def set_frame(self, index : int, planes : list[array]):
+        # the frame after is stored against this one, so redo it too
+        after = None
+        if index + 1 < len(self):
+            after = self.get_frame(index + 1)
+        if index == 0:
+            self.first = [array('i', plane) for plane in planes]
+        else:
+            self.deltas[index - 1] = make_delta(self.get_frame(index - 1), planes)
+        if after is not None:
+            self.deltas[index] = make_delta(planes, after)
+
+    def insert_frame(self, index : int):
+        # a copy of a frame after it.  the one after that doesn't change
+        # against it, so nothing else needs redoing.
+        self.deltas.insert(index, [(array('i'), array('i')) for _ in self.first])
+        self.undos.insert(index + 1, ([], []))
+
+    def delete_frame(self, index : int):
+        if index == 0:
+            self.first = self.get_frame(1)
+            del self.deltas[0]
+        else:
+            if index + 1 < len(self):
+                self.deltas[index] = make_delta(self.get_frame(index - 1), self.get_frame(index + 1))
+            del self.deltas[index - 1]
+        del self.undos[index]
+
+def get_animation_output(t : blessed.Terminal,
+                         animation : Animation,
+                         x : int, y : int,
+                         loop : bool = False):
+    # generate the output for each frame.  the first frame is drawn whole,
+    # after that only cells which changed are drawn, positioning the cursor
+    # when they're not next to each other.
+    dw : int = animation.dw
+    cw : int = dw // 2
+    lengths = {}
+    state = (SGR_UNSET, SGR_UNSET)
+    planes = [array('i', plane) for plane in animation.first]
+    deltas = animation.deltas
+    if loop:
+        deltas = deltas + [make_delta(animation.get_frame(len(animation) - 1), animation.first)]
+    cells = range(len(planes[1]))
+    index : int = 0
+
+    while True:
+        out = []
+        last : int = -2
+        for cell in cells:
+            cx : int = cell % cw
+            cy : int = cell // cw
+            if cell != last + 1 or cx == 0:
+                out.append(t.move_xy(x + cx, y + cy))
+            last = cell
+            fg = (planes[1][cell], planes[2][cell], planes[3][cell])
+            bg = SGR_DEFAULT
+            if planes[4][cell] >= 0:
+                bg = (planes[4][cell], planes[5][cell], planes[6][cell])
+            c : int = make_cell(planes[0], cx * 2, cy * 4, dw)
+            _, state, ops = get_sgr_transition(t, lengths, state[0], state[1], fg, bg, c != 0, c != 255)
+            out.extend(get_sgr_string(t, *op) for op in ops)
+            out.append(CHARS4[c])
+        yield ''.join(out)
+
+        if index == len(deltas):
+            if not loop or len(deltas) == 0:
+                break
+            # the last delta went back to the first frame
+            index = 0
+        delta = deltas[index]
+        index += 1
+        apply_delta(planes, delta)
+        changed = set(((i // dw // 4) * cw) + ((i % dw) // 2) for i in delta[0][0])
+        for indices, _ in delta[1:]:
+            changed.update(indices)
+        cells = sorted(changed)
+
+def play_animation(term : Term, animation : Animation, fps : float, x : int, y : int):
+    # play in a loop until a key is pressed
+    term.reset()
+    next_time : float = time.monotonic()
+    for frame in get_animation_output(term.t, animation, x, y, True):
+        print(frame, end='')
+        sys.stdout.flush()
+        next_time += 1.0 / fps
+        if len(term.t.inkey(max(0.0, next_time - time.monotonic()))) > 0:
+            break
+    term.reset()
+
+def export_asciicast(path : pathlib.Path,
+                     t : blessed.Terminal,
+                     animation : Animation,
+                     fps : float):
+    # asciicast v2, a JSON header line then a line per frame of output
+    with path.open('w') as out:
+        out.write(json.dumps({'version': 2,
+                              'width': animation.dw // 2,
+                              'height': len(animation.first[1]) // (animation.dw // 2)}))
+        out.write('\n')
+        for num, frame in enumerate(get_animation_output(t, animation, 0, 0)):
+            if num == 0:
+                frame = t.clear + frame
+            out.write(json.dumps([num / fps, 'o', frame]))
+            out.write('\n')
+
+def get_load_patterns(t : blessed.Terminal):
+    # make these parseable
+    color_rgb_re = re.compile(t.caps['color_rgb'].re_compiled.pattern.replace("\\d+", "(\\d+)"))
+    on_color_rgb_re = re.compile(t.caps['on_color_rgb'].re_compiled.pattern.replace("\\d+", "(\\d+)"))
+    color256_re = re.compile(t.caps['color256'].re_compiled.pattern.replace("\\d+", "(\\d+)"))
+    on_color256_re = re.compile(t.caps['on_color256'].re_compiled.pattern.replace("\\d+", "(\\d+)"))
+    set_a_attributes1_re = re.compile(t.caps['set_a_attributes1'].re_compiled.pattern.replace("\\d+", "(\\d+)"))
+    parm_right_cursor_re = re.compile(t.caps['parm_right_cursor'].re_compiled.pattern.replace("\\d+", "(\\d+)"))
+
+    return color_rgb_re, on_color_rgb_re, color256_re, on_color256_re, \
+           set_a_attributes1_re, parm_right_cursor_re
+
+def load_line(t : blessed.Terminal,
+              patterns : tuple,
+              line : str,
+              color_mode : ColorMode | None,
+              max_color : int):
+    # parse a line of text in to a row of cells.  returns the color mode and
+    # highest palette color so far, the 4 rows of pixels and the 6 rows of
+    # color data.
+    color_rgb_re, on_color_rgb_re, color256_re, on_color256_re, \
+        set_a_attributes1_re, parm_right_cursor_re = patterns
+
+    fg_r = None
+    fg_g = None
+    fg_b = None
+    bg_r = None
+    bg_g = None
+    bg_b = None
+
+    # 4 rows at a time
+    rows = [array('i'), array('i'), array('i'), array('i')]
+    colordata_fg_r_rows = [array('i')]
+    colordata_fg_g_rows = [array('i')]
+    colordata_fg_b_rows = [array('i')]
+    colordata_bg_r_rows = [array('i')]
+    colordata_bg_g_rows = [array('i')]
+    colordata_bg_b_rows = [array('i')]
+
+    pos = 0
+    while True:
+        if pos == len(line):
+            break
+
+        # find color code
+        match = t._caps_compiled_any.match(line[pos:])
+        groupdict = match.groupdict()
+        # skipped over blank cells on transparent backgrounds
+        skip : int = 0
+        if groupdict['parm_right_cursor'] is not None:
+            # the pattern may already have its own group
+            skip = int(parm_right_cursor_re.match(line[pos:pos+match.span()[1]]).group(1))
+        elif groupdict['cursor_right'] is not None:
+            skip = 1
+
+        if groupdict['MISMATCH'] is not None or skip > 0:
+            if color_mode is None:
+                if fg_r is None or bg_r is None:
+                    # assume an image with no color codes
+                    color_mode = ColorMode.NONE
+            if fg_g is None:
+                # make sure the arrays have sensible numerical values
+                if color_mode == ColorMode.NONE:
+                    fg_r, fg_g, fg_b, bg_r, bg_g, bg_b = get_default_colors(color_mode)
+                else:
+                    _, fg_g, fg_b, _, bg_g, bg_b = get_default_colors(color_mode)
+
+            if skip > 0:
+                colordata_fg_r_rows[-1].extend(itertools.repeat(fg_r, skip))
+                colordata_fg_g_rows[-1].extend(itertools.repeat(fg_g, skip))
+                colordata_fg_b_rows[-1].extend(itertools.repeat(fg_b, skip))
+                colordata_bg_r_rows[-1].extend(itertools.repeat(-1, skip))
+                colordata_bg_g_rows[-1].extend(itertools.repeat(-1, skip))
+                colordata_bg_b_rows[-1].extend(itertools.repeat(-1, skip))
+                for row in rows[-4:]:
+                    row.extend(itertools.repeat(0, skip * 2))
+                pos += match.span()[1]
+                continue
+
+            colordata_fg_r_rows[-1].append(fg_r)
+            colordata_fg_g_rows[-1].append(fg_g)
+            colordata_fg_b_rows[-1].append(fg_b)
+            colordata_bg_r_rows[-1].append(bg_r)
+            colordata_bg_g_rows[-1].append(bg_g)
+            colordata_bg_b_rows[-1].append(bg_b)
+
+            if line[pos] not in CHAR_CELLS:
+                raise ValueError(f"Unknown character {line[pos]!r}.")
+            cell = CHAR_CELLS[line[pos]]
+            # offset LSB to RSB goes top left -> bottom left, top right -> bottom right
+            rows[-4].append(cell & 1)
+            rows[-3].append((cell & 2) >> 1)
+            rows[-2].append((cell & 4) >> 2)
+            rows[-1].append((cell & 8) >> 3)
+            rows[-4].append((cell & 16) >> 4)
+            rows[-3].append((cell & 32) >> 5)
+            rows[-2].append((cell & 64) >> 6)
+            rows[-1].append((cell & 128) >> 7)
+        elif groupdict['sgr0'] is not None:
+            # normal (transparent bg)
+            bg_r = -1
+            bg_g = -1
+            bg_b = -1
+            # also technically rewrites fg color
+            # but this doesn't support default terminal foreground color
+        elif groupdict['color_rgb'] is not None:
+            if color_mode is None:
+                color_mode = ColorMode.DIRECT
+            else:
+                if color_mode != ColorMode.DIRECT:
+                    raise ValueError("Conflicting color code types!")
+
+            r, g, b = color_rgb_re.match(line[pos:pos+match.span()[1]]).groups()
+            fg_r = int(r)
+            fg_g = int(g)
+            fg_b = int(b)
+        elif groupdict['on_color_rgb'] is not None:
+            if color_mode is None:
+                color_mode = ColorMode.DIRECT
+            else:
+                if color_mode != ColorMode.DIRECT:
+                    raise ValueError("Conflicting color code types!")
+
+            r, g, b = on_color_rgb_re.match(line[pos:pos+match.span()[1]]).groups()
+            bg_r = int(r)
+            bg_g = int(g)
+            bg_b = int(b)
+        elif groupdict['color256'] is not None:
+            if color_mode is None:
+                color_mode = ColorMode.C256
+            else:
+                if color_mode != ColorMode.C256:
+                    raise ValueError("Conflicting color code types!")
+
+            r, = color256_re.match(line[pos:pos+match.span()[1]]).groups()
+            fg_r = int(r)
+            max_color = max(max_color, fg_r)
+        elif groupdict['on_color256'] is not None:
+            if color_mode is None:
+                color_mode = ColorMode.C256
+            else:
+                if color_mode != ColorMode.C256:
+                    raise ValueError("Conflicting color code types!")
+
+            r, = on_color256_re.match(line[pos:pos+match.span()[1]]).groups()
+            bg_r = int(r)
+            max_color = max(max_color, bg_r)
+        elif groupdict['set_a_attributes1'] is not None:
+            attrib, = set_a_attributes1_re.match(line[pos:pos+match.span()[1]]).groups()
+            attrib = int(attrib)
+
+            if (attrib >= 30 and attrib <= 37) or \
+               (attrib >= 40 and attrib <= 47) or \
+               (attrib >= 90 and attrib <= 97) or \
+               (attrib >= 99 and attrib <= 107):
+                if color_mode is None:
+                    color_mode = ColorMode.C256
+                else:
+                    if color_mode != ColorMode.C256:
+                        raise ValueError("Conflicting color code types!")
+
+                if attrib >= 30 and attrib <= 37:
+                    fg_r = attrib - 30
+                    max_color = max(max_color, fg_r)
+                elif attrib >= 40 and attrib <= 47:
+                    bg_r = attrib - 40
+                    max_color = max(max_color, bg_r)
+                elif attrib >= 90 and attrib <= 97:
+                    fg_r = attrib - 90 + 8
+                    max_color = max(max_color, fg_r)
+                elif attrib >= 100 and attrib <= 107:
+                    bg_r = attrib - 100 + 8
+                    max_color = max(max_color, bg_r)
+
+        pos += match.span()[1]
+
+    return color_mode, max_color, rows, \
+        (colordata_fg_r_rows[0], colordata_fg_g_rows[0], colordata_fg_b_rows[0],
+         colordata_bg_r_rows[0], colordata_bg_g_rows[0], colordata_bg_b_rows[0])
 
 def load_file(t : blessed.Terminal,
               max_color_mode : ColorMode,
@@ -1746,148 +3439,17 @@ def load_file(t : blessed.Terminal,
     colordata_bg_g_rows = []
     colordata_bg_b_rows = []
 
-    # make these parseable
-    color_rgb_re = re.compile(t.caps['color_rgb'].re_compiled.pattern.replace("\\d+", "(\\d+)"))
-    on_color_rgb_re = re.compile(t.caps['on_color_rgb'].re_compiled.pattern.replace("\\d+", "(\\d+)"))
-    color256_re = re.compile(t.caps['color256'].re_compiled.pattern.replace("\\d+", "(\\d+)"))
-    on_color256_re = re.compile(t.caps['on_color256'].re_compiled.pattern.replace("\\d+", "(\\d+)"))
-    set_a_attributes1_re = re.compile(t.caps['set_a_attributes1'].re_compiled.pattern.replace("\\d+", "(\\d+)"))
-
-    with open(filename, 'r') as infile:
-        for line in infile.readlines():
-            fg_r = None
-            fg_g = None
-            fg_b = None
-            bg_r = None
-            bg_g = None
-            bg_b = None
-
-            # 4 rows at a time
-            rows.append(array('i'))
-            rows.append(array('i'))
-            rows.append(array('i'))
-            rows.append(array('i'))
-            colordata_fg_r_rows.append(array('i'))
-            colordata_fg_g_rows.append(array('i'))
-            colordata_fg_b_rows.append(array('i'))
-            colordata_bg_r_rows.append(array('i'))
-            colordata_bg_g_rows.append(array('i'))
-            colordata_bg_b_rows.append(array('i'))
-
-            pos = 0
-            while True:
-                if pos == len(line):
-                    break
-
-                # find color code
-                match = t._caps_compiled_any.match(line[pos:])
-                groupdict = match.groupdict()
-                if groupdict['MISMATCH'] is not None:
-                    if color_mode is None:
-                        if fg_r is None or bg_r is None:
-                            # assume an image with no color codes
-                            color_mode = ColorMode.NONE
-                    if fg_g is None:
-                        # make sure the arrays have sensible numerical values
-                        if color_mode == ColorMode.NONE:
-                            fg_r, fg_g, fg_b, bg_r, bg_g, bg_b = get_default_colors(color_mode)
-                        else:
-                            _, fg_g, fg_b, _, bg_g, bg_b = get_default_colors(color_mode)
-
-                    colordata_fg_r_rows[-1].append(fg_r)
-                    colordata_fg_g_rows[-1].append(fg_g)
-                    colordata_fg_b_rows[-1].append(fg_b)
-                    colordata_bg_r_rows[-1].append(bg_r)
-                    colordata_bg_g_rows[-1].append(bg_g)
-                    colordata_bg_b_rows[-1].append(bg_b)
-
-                    cell = CHARS4.index(line[pos])
-                    # offset LSB to RSB goes top left -> bottom left, top right -> bottom right
-                    rows[-4].append(cell & 1)
-                    rows[-3].append((cell & 2) >> 1)
-                    rows[-2].append((cell & 4) >> 2)
-                    rows[-1].append((cell & 8) >> 3)
-                    rows[-4].append((cell & 16) >> 4)
-                    rows[-3].append((cell & 32) >> 5)
-                    rows[-2].append((cell & 64) >> 6)
-                    rows[-1].append((cell & 128) >> 7)
-                elif groupdict['sgr0'] is not None:
-                    # normal (transparent bg)
-                    bg_r = -1
-                    bg_g = -1
-                    bg_b = -1
-                    # also technically rewrites fg color
-                    # but this doesn't support default terminal foreground color
-                elif groupdict['color_rgb'] is not None:
-                    if color_mode is None:
-                        color_mode = ColorMode.DIRECT
-                    else:
-                        if color_mode != ColorMode.DIRECT:
-                            raise ValueError("Conflicting color code types!")
-
-                    r, g, b = color_rgb_re.match(line[pos:pos+match.span()[1]]).groups()
-                    fg_r = int(r)
-                    fg_g = int(g)
-                    fg_b = int(b)
-                elif groupdict['on_color_rgb'] is not None:
-                    if color_mode is None:
-                        color_mode = ColorMode.DIRECT
-                    else:
-                        if color_mode != ColorMode.DIRECT:
-                            raise ValueError("Conflicting color code types!")
-
-                    r, g, b = on_color_rgb_re.match(line[pos:pos+match.span()[1]]).groups()
-                    bg_r = int(r)
-                    bg_g = int(g)
-                    bg_b = int(b)
-                elif groupdict['color256'] is not None:
-                    if color_mode is None:
-                        color_mode = ColorMode.C256
-                    else:
-                        if color_mode != ColorMode.C256:
-                            raise ValueError("Conflicting color code types!")
+    patterns = get_load_patterns(t)
 
-                    r = color256_re.match(line[pos:pos+match.span()[1]]).groups()
-                    fg_r = int(r)
-                    max_color = max(max_color, fg_r)
-                elif groupdict['on_color256'] is not None:
-                    if color_mode is None:
-                        color_mode = ColorMode.C256
-                    else:
-                        if color_mode != ColorMode.C256:
-                            raise ValueError("Conflicting color code types!")
-
-                    r = on_color256_re.match(line[pos:pos+match.span()[1]]).groups()
-                    bg_r = int(r)
-                    max_color = max(max_color, bg_r)
-                elif groupdict['set_a_attributes1'] is not None:
-                    attrib, = set_a_attributes1_re.match(line[pos:pos+match.span()[1]]).groups()
-                    attrib = int(attrib)
-
-                    if (attrib >= 30 and attrib <= 37) or \
-                       (attrib >= 40 and attrib <= 47) or \
-                       (attrib >= 90 and attrib <= 97) or \
-                       (attrib >= 99 and attrib <= 107):
-                        if color_mode is None:
-                            color_mode = ColorMode.C256
-                        else:
-                            if color_mode != ColorMode.C256:
-                                raise ValueError("Conflicting color code types!")
-
-                        if attrib >= 30 and attrib <= 37:
-                            fg_r = attrib - 30
-                            max_color = max(max_color, fg_r)
-                        elif attrib >= 40 and attrib <= 47:
-                            bg_r = attrib - 40
-                            max_color = max(max_color, bg_r)
-                        elif attrib >= 90 and attrib <= 97:
-                            fg_r = attrib - 90 + 8
-                            max_color = max(max_color, fg_r)
-                        elif attrib >= 100 and attrib <= 107:
-                            bg_r = attrib - 100 + 8
-                            max_color = max(max_color, bg_r)
-
-                pos += match.span()[1]
+    with open_text(pathlib.Path(filename), 'r') as infile:
+        for line in infile:
+            color_mode, max_color, line_rows, line_colordata = \
+                load_line(t, patterns, line, color_mode, max_color)
+            rows.extend(line_rows)
+            for colordata_rows, colordata in zip((colordata_fg_r_rows, colordata_fg_g_rows, colordata_fg_b_rows,
+                                                  colordata_bg_r_rows, colordata_bg_g_rows, colordata_bg_b_rows),
+                                                 line_colordata):
+                colordata_rows.append(colordata)
 
             max_row_len = max(max_row_len, len(colordata_fg_r_rows[-1]))
 
@@ -1897,7 +3459,7 @@ def load_file(t : blessed.Terminal,
 
     if color_mode == ColorMode.NONE:
         color_mode = ColorMode.C256
-        max_color = fg_r
+        max_color = get_default_colors(ColorMode.NONE)[0]
 
     if color_mode == ColorMode.C256 and max_color <= 15:
         color_mode = ColorMode.C16
@@ -1929,6 +3491,671 @@ def load_file(t : blessed.Terminal,
         colordata_fg_r, colordata_fg_g, colordata_fg_b, \
         colordata_bg_r, colordata_bg_g, colordata_bg_b
 
+class Watcher():
+    # keeps an index of how long each line (row of cells) of a file is and a
+    # hash of it, so when the file changes only the lines which differ need
+    # parsing again.
+    def __init__(self, filename : str, interval : float = WATCH_INTERVAL):
+        self.filename : str = filename
+        self.path : pathlib.Path = pathlib.Path(filename)
+        self.interval : float = interval
+        self.last_check : float = time.monotonic()
+        self.changed : bool = False
+        self.stat : None | tuple[int, int] = None
+        self.index : list[tuple[int, int]] = []
+        self.get_changes()
+
+    def get_stat(self):
+        try:
+            stat = self.path.stat()
+        except OSError:
+            # maybe in the middle of being replaced
+            return self.stat
+        return stat.st_mtime_ns, stat.st_size
+
+    def poll(self):
+        if self.changed:
+            return True
+        now : float = time.monotonic()
+        if now - self.last_check < self.interval:
+            return False
+        self.last_check = now
+
+        if self.get_stat() != self.stat:
+            self.changed = True
+        return self.changed
+
+    def get_changes(self):
+        # returns the number of lines and the lines which changed by line
+        # number
+        self.changed = False
+        stat = self.get_stat()
+        index = []
+        changes = {}
+        with open_text(self.path, 'r') as infile:
+            for num, line in enumerate(infile):
+                entry = (len(line), hash(line))
+                if num >= len(self.index) or self.index[num] != entry:
+                    changes[num] = line
+                index.append(entry)
+        # only once it's all been read, so a failure gets tried again
+        self.stat = stat
+        self.index = index
+
+        return len(index), changes
+
+    def saved(self, filename : str):
+        # the file was written by the editor, maybe under a new name, so take
+        # it as it is now rather than reloading it as a change
+        self.filename = filename
+        self.path = pathlib.Path(filename)
+        try:
+            self.get_changes()
+        except OSError:
+            # it'll be picked up as a change and tried again
+            pass
+
+def load_changes(t : blessed.Terminal,
+                 patterns : tuple,
+                 changes : dict[int, str],
+                 dw : int,
+                 color_mode : ColorMode):
+    # parse changed lines for put_line.  returns None if they don't fit in the
+    # canvas as it is.
+    parsed = {}
+    for iy, line in changes.items():
+        line_color_mode, max_color, line_rows, line_colordata = \
+            load_line(t, patterns, line, None, 0)
+        if len(line_colordata[0]) > dw // 2:
+            return None
+        match line_color_mode:
+            case None:
+                pass
+            case ColorMode.NONE:
+                if color_mode == ColorMode.DIRECT:
+                    return None
+            case ColorMode.C256:
+                if color_mode == ColorMode.DIRECT or \
+                   (color_mode == ColorMode.C16 and max_color > 15):
+                    return None
+            case _:
+                if line_color_mode != color_mode:
+                    return None
+        parsed[iy] = (line_rows, line_colordata)
+
+    return parsed
+
+def put_line(iy : int,
+             line_rows : list[array],
+             line_colordata : tuple[array],
+             dw : int,
+             color_mode : ColorMode,
+             data : array,
+             colordata_fg_r : array,
+             colordata_fg_g : array,
+             colordata_fg_b : array,
+             colordata_bg_r : array,
+             colordata_bg_g : array,
+             colordata_bg_b : array):
+    # replace a row of cells with a loaded line, padded out like load_file does
+    cw : int = dw // 2
+    defaults = get_default_colors(color_mode)
+    for i, row in enumerate(line_rows):
+        start : int = ((iy * 4) + i) * dw
+        data[start:start + dw] = row + array('i', itertools.repeat(0, dw - len(row)))
+    for colordata, row, default in zip((colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                        colordata_bg_r, colordata_bg_g, colordata_bg_b),
+                                       line_colordata, defaults):
+        colordata[iy * cw:(iy + 1) * cw] = row + array('i', itertools.repeat(default, cw - len(row)))
+
+def nearest_palette_color(color_mode : ColorMode, r : int, g : int, b : int):
+    count : int = 16
+    if color_mode == ColorMode.C256:
+        count = 256
+
+    best : int = 0
+    best_dist : int = -1
+    for i in range(count):
+        pr, pg, pb = XTERM_PALETTE[i]
+        dist = ((pr - r) * (pr - r)) + ((pg - g) * (pg - g)) + ((pb - b) * (pb - b))
+        if best_dist < 0 or dist < best_dist:
+            best = i
+            best_dist = dist
+
+    return best
+
+def read_netpbm(infile):
+    # P2/P3 (ascii) and P5/P6 (binary) gray or RGB
+    tokens = []
+    while len(tokens) < 4:
+        line = infile.readline()
+        if len(line) == 0:
+            raise ValueError("Truncated image header.")
+        tokens.extend(line.split(b'#')[0].split())
+    magic = tokens[0]
+    width, height, maxval = int(tokens[1]), int(tokens[2]), int(tokens[3])
+    channels : int = 3
+    if magic in (b'P2', b'P5'):
+        channels = 1
+    elif magic not in (b'P3', b'P6'):
+        raise ValueError("Unsupported netpbm type.")
+
+    values = None
+    if magic in (b'P2', b'P3'):
+        values = iter(int(v) for v in infile.read().split())
+    sample_size : int = 1
+    if maxval > 255:
+        sample_size = 2
+    scale = None
+    if maxval != 255:
+        scale = bytes(min(255, (v * 255) // maxval) for v in range(min(256, maxval + 1)))
+    opaque = bytes(itertools.repeat(255, width))
+
+    def rows():
+        for _ in range(height):
+            if values is not None:
+                row = bytes(min(255, (v * 255) // maxval) for v in itertools.islice(values, width * channels))
+            else:
+                row = infile.read(width * channels * sample_size)
+                if len(row) < width * channels * sample_size:
+                    raise ValueError("Truncated image data.")
+                if sample_size == 2:
+                    row = bytes(min(255, (((hi << 8) | lo) * 255) // maxval) for hi, lo in zip(row[0::2], row[1::2]))
+                elif scale is not None:
+                    row = row.translate(scale + bytes(256 - len(scale)))
+
+            if channels == 1:
+                yield row, row, row, opaque
+            else:
+                yield row[0::3], row[1::3], row[2::3], opaque
+
+    return width, height, rows()
+
+def unfilter_png_row(filter_type : int, row : bytearray, prev : bytes, bpp : int):
+    match filter_type:
+        case 0:
+            pass
+        case 1: # sub
+            for i in range(bpp, len(row)):
+                row[i] = (row[i] + row[i - bpp]) & 0xFF
+        case 2: # up
+            row[:] = bytes(map(lambda a, b: (a + b) & 0xFF, row, prev))
+        case 3: # average
+            for i in range(len(row)):
+                left = row[i - bpp] if i >= bpp else 0
+                row[i] = (row[i] + ((left + prev[i]) >> 1)) & 0xFF
+        case 4: # paeth
+            for i in range(len(row)):
+                a = row[i - bpp] if i >= bpp else 0
+                b = prev[i]
+                c = prev[i - bpp] if i >= bpp else 0
+                p = a + b - c
+                pa = abs(p - a)
+                pb = abs(p - b)
+                pc = abs(p - c)
+                if pa <= pb and pa <= pc:
+                    row[i] = (row[i] + a) & 0xFF
+                elif pb <= pc:
+                    row[i] = (row[i] + b) & 0xFF
+                else:
+                    row[i] = (row[i] + c) & 0xFF
+        case _:
+            raise ValueError("Bad PNG filter type.")
+
+def read_png_chunk(infile):
+    header = infile.read(8)
+    if len(header) < 8:
+        raise ValueError("Truncated PNG file.")
+    length, chunk_type = struct.unpack('>I4s', header)
+    chunk = infile.read(length)
+    infile.read(4) # CRC
+
+    return chunk_type, chunk
+
+def read_png(infile):
+    # non-interlaced PNG of any color type and bit depth
+    if infile.read(8) != PNG_SIGNATURE:
+        raise ValueError("Not a PNG file.")
+    chunk_type, chunk = read_png_chunk(infile)
+    if chunk_type != b'IHDR':
+        raise ValueError("PNG file doesn't start with a header.")
+
+    width, height, bit_depth, color_type, _, _, interlace = struct.unpack('>IIBBBBB', chunk)
+    if interlace != 0:
+        raise ValueError("Interlaced PNGs aren't supported.")
+    channels : int = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}[color_type]
+    bpp : int = max(1, (channels * bit_depth) // 8)
+    stride : int = ((width * channels * bit_depth) + 7) // 8
+    opaque = bytes(itertools.repeat(255, width))
+
+    def rows():
+        palette = None
+        palette_alpha = None
+        decomp = zlib.decompressobj()
+        buf = bytearray()
+        prev = bytes(stride)
+        y : int = 0
+
+        while y < height:
+            chunk_type, chunk = read_png_chunk(infile)
+            if chunk_type == b'PLTE':
+                palette = chunk
+            elif chunk_type == b'tRNS' and color_type == 3:
+                palette_alpha = chunk + bytes(itertools.repeat(255, 256 - len(chunk)))
+            elif chunk_type == b'IDAT':
+                buf.extend(decomp.decompress(chunk))
+                # decode whole rows as they become available
+                while y < height and len(buf) >= stride + 1:
+                    row = bytearray(buf[1:stride + 1])
+                    unfilter_png_row(buf[0], row, prev, bpp)
+                    del buf[:stride + 1]
+                    prev = bytes(row)
+                    y += 1
+
+                    if bit_depth == 16:
+                        # just take the high bytes
+                        row = row[0::2]
+                    elif bit_depth < 8:
+                        # unpack to 1 byte per sample
+                        per_byte = 8 // bit_depth
+                        sample_mask = (1 << bit_depth) - 1
+                        row = bytes((row[i // per_byte] >> (8 - bit_depth - ((i % per_byte) * bit_depth))) & sample_mask
+                                    for i in range(width))
+                        if color_type == 0:
+                            row = bytes((v * 255) // sample_mask for v in row)
+                    row = bytes(row)
+
+                    match color_type:
+                        case 0:
+                            yield row, row, row, opaque
+                        case 2:
+                            yield row[0::3], row[1::3], row[2::3], opaque
+                        case 3:
+                            rgb = bytes(itertools.chain.from_iterable(palette[i * 3:i * 3 + 3] for i in row))
+                            alpha = opaque
+                            if palette_alpha is not None:
+                                alpha = row.translate(palette_alpha)
+                            yield rgb[0::3], rgb[1::3], rgb[2::3], alpha
+                        case 4:
+                            yield row[0::2], row[0::2], row[0::2], row[1::2]
+                        case 6:
+                            yield row[0::4], row[1::4], row[2::4], row[3::4]
+            elif chunk_type == b'IEND':
+                raise ValueError("Truncated PNG image data.")
+
+    return width, height, rows()
+
+def is_image_file(filename : str):
+    with open(filename, 'rb') as infile:
+        magic = infile.read(8)
+
+    return magic == PNG_SIGNATURE or magic[:2] in (b'P2', b'P3', b'P5', b'P6')
+
+def read_image(infile):
+    # returns the dimensions and a generator of rows of R, G, B, A bytes
+    if infile.peek(8)[:8] == PNG_SIGNATURE:
+        return read_png(infile)
+
+    return read_netpbm(infile)
+
+def load_image(color_mode : ColorMode,
+               filename : str,
+               dither : bool = IMPORT_DITHER):
+    with open(filename, 'rb') as infile:
+        iw, ih, rows = read_image(infile)
+        width : int = (iw + 1) // 2 * 2
+        height : int = (ih + 3) // 4 * 4
+        cw : int = width // 2
+        data = array('i', itertools.repeat(0, width * height))
+        colordata_fg_r, colordata_fg_g, colordata_fg_b, \
+            colordata_bg_r, colordata_bg_g, colordata_bg_b = \
+            new_color_data(color_mode, width, height)
+        def_fg_r, def_fg_g, def_fg_b, _, _, _ = get_default_colors(color_mode)
+
+        # a row of cells at a time
+        for cy in range(height // 4):
+            band = list(itertools.islice(rows, 4))
+            bits = []
+            for i, (r, g, b, a) in enumerate(band):
+                y : int = cy * 4 + i
+                lum = bytes(map(lambda r, g, b: ((r * 299) + (g * 587) + (b * 114)) // 1000, r, g, b))
+                if dither:
+                    row = bytearray(iw)
+                    for p in range(4):
+                        row[p::4] = lum[p::4].translate(DITHER_TABLES[y % 4][p])
+                else:
+                    row = lum.translate(THRESHOLD_TABLE)
+                # transparent pixels are never set
+                row = bytes(map(operator.and_, row, a.translate(ALPHA_TABLE)))
+                data[y * width:y * width + iw] = array('i', iter(row))
+                bits.append(row)
+
+            for cx in range(cw):
+                fg = [0, 0, 0, 0]
+                bg = [0, 0, 0, 0]
+                transparent : bool = False
+                for i, (r, g, b, a) in enumerate(band):
+                    for px in range(cx * 2, min(iw, cx * 2 + 2)):
+                        if a[px] < 128:
+                            transparent = True
+                            continue
+                        if bits[i][px]:
+                            sums = fg
+                        else:
+                            sums = bg
+                        sums[0] += r[px]
+                        sums[1] += g[px]
+                        sums[2] += b[px]
+                        sums[3] += 1
+
+                fg_r, fg_g, fg_b = def_fg_r, def_fg_g, def_fg_b
+                if fg[3] > 0:
+                    fg_r, fg_g, fg_b = fg[0] // fg[3], fg[1] // fg[3], fg[2] // fg[3]
+                if bg[3] > 0:
+                    bg_r, bg_g, bg_b = bg[0] // bg[3], bg[1] // bg[3], bg[2] // bg[3]
+                elif transparent or fg[3] == 0:
+                    bg_r, bg_g, bg_b = -1, -1, -1
+                else:
+                    # all pixels are set so the background won't be seen
+                    bg_r, bg_g, bg_b = fg_r, fg_g, fg_b
+                if fg[3] == 0 and bg[3] > 0:
+                    fg_r, fg_g, fg_b = bg_r, bg_g, bg_b
+
+                if color_mode == ColorMode.DIRECT:
+                    colordata_fg_r[cy * cw + cx] = fg_r
+                    colordata_fg_g[cy * cw + cx] = fg_g
+                    colordata_fg_b[cy * cw + cx] = fg_b
+                    colordata_bg_r[cy * cw + cx] = bg_r
+                    colordata_bg_g[cy * cw + cx] = bg_g
+                    colordata_bg_b[cy * cw + cx] = bg_b
+                else:
+                    if fg[3] > 0 or bg[3] > 0:
+                        fg_r = nearest_palette_color(color_mode, fg_r, fg_g, fg_b)
+                    colordata_fg_r[cy * cw + cx] = fg_r
+                    if bg_r >= 0:
+                        bg_r = nearest_palette_color(color_mode, bg_r, bg_g, bg_b)
+                    colordata_bg_r[cy * cw + cx] = bg_r
+
+    return width, height, color_mode, data, \
+        colordata_fg_r, colordata_fg_g, colordata_fg_b, \
+        colordata_bg_r, colordata_bg_g, colordata_bg_b
+
+def split_cell_kmeans(samples : list):
+    # 2-means over the samples of a cell, starting from the darkest and
+    # brightest.  returns the mask of samples closest to the second center.
+    lums = [(r * 299) + (g * 587) + (b * 114) for r, g, b in samples]
+    centers = [samples[lums.index(min(lums))], samples[lums.index(max(lums))]]
+    mask : int = -1
+    for _ in range(CLASH_KMEANS_ITERATIONS):
+        new_mask : int = 0
+        for i, (r, g, b) in enumerate(samples):
+            d0 = ((r - centers[0][0]) ** 2) + ((g - centers[0][1]) ** 2) + ((b - centers[0][2]) ** 2)
+            d1 = ((r - centers[1][0]) ** 2) + ((g - centers[1][1]) ** 2) + ((b - centers[1][2]) ** 2)
+            if d1 < d0:
+                new_mask |= 1 << i
+        if new_mask == mask:
+            break
+        mask = new_mask
+        for group in range(2):
+            members = [s for i, s in enumerate(samples) if bool(mask & (1 << i)) == bool(group)]
+            if len(members) > 0:
+                centers[group] = tuple(sum(c) // len(members) for c in zip(*members))
+
+    return mask
+
+def split_cell_exhaustive(samples : list):
+    # try every way of splitting the samples in 2 and keep the one with the
+    # least squared error.  the error of a group is sum(c^2) - sum(c)^2 / n
+    # so only the sum(c)^2 / n terms need comparing, and the sums of every
+    # subset are built up from smaller subsets.
+    count : int = len(samples)
+    total = [sum(c) for c in zip(*samples)]
+    sums = [(0, 0, 0)] * (1 << count)
+    best_mask : int = 0
+    best_score : float = -1.0
+    for mask in range(1, 1 << count):
+        low = mask & -mask
+        prev = sums[mask ^ low]
+        sample = samples[low.bit_length() - 1]
+        sums[mask] = (prev[0] + sample[0], prev[1] + sample[1], prev[2] + sample[2])
+        if mask & 1:
+            # the complement was already tried
+            continue
+        n = mask.bit_count()
+        s = sums[mask]
+        score = ((s[0] * s[0]) + (s[1] * s[1]) + (s[2] * s[2])) / n
+        if n < count:
+            o = (total[0] - s[0], total[1] - s[1], total[2] - s[2])
+            score += ((o[0] * o[0]) + (o[1] * o[1]) + (o[2] * o[2])) / (count - n)
+        if score > best_score:
+            best_score = score
+            best_mask = mask
+
+    return best_mask
+
+def optimize_cell_rows(job : tuple):
+    # job is (color mode, exhaustive, rows) where rows is a list of 4 pixel
+    # row (R, G, B) bytes per row of cells.  returns per row of cells, the
+    # cell masks, foreground and background colors and squared errors.
+    # kept to plain types so it can be sent to worker processes.
+    color_mode, exhaustive, cell_rows = job
+    results = []
+    for band in cell_rows:
+        iw = len(band[0][0])
+        masks = []
+        fgs = []
+        bgs = []
+        errors = []
+        for cx in range((iw + 1) // 2):
+            # sample order matches the cell bit order
+            positions = [(i, px) for px in range(cx * 2, min(iw, cx * 2 + 2)) for i in range(len(band))]
+            samples = [(band[i][0][px], band[i][1][px], band[i][2][px]) for i, px in positions]
+            if exhaustive:
+                mask = split_cell_exhaustive(samples)
+            else:
+                mask = split_cell_kmeans(samples)
+
+            colors = []
+            for group in range(2):
+                members = [s for i, s in enumerate(samples) if bool(mask & (1 << i)) == bool(group)]
+                if len(members) == 0:
+                    colors.append(None)
+                    continue
+                color = tuple(sum(c) // len(members) for c in zip(*members))
+                if color_mode != ColorMode.DIRECT:
+                    color = XTERM_PALETTE[nearest_palette_color(color_mode, *color)]
+                colors.append(color)
+            if colors[0] is None:
+                colors[0] = colors[1]
+            elif colors[1] is None:
+                colors[1] = colors[0]
+
+            # the brighter group goes in the foreground like with dithering
+            if sum(colors[0]) > sum(colors[1]):
+                colors.reverse()
+
+            # reassign against the final (maybe quantized) colors and
+            # measure what's left over
+            mask = 0
+            error : int = 0
+            for i, (r, g, b) in enumerate(samples):
+                d0 = ((r - colors[0][0]) ** 2) + ((g - colors[0][1]) ** 2) + ((b - colors[0][2]) ** 2)
+                d1 = ((r - colors[1][0]) ** 2) + ((g - colors[1][1]) ** 2) + ((b - colors[1][2]) ** 2)
+                if d1 < d0:
+                    mask |= 1 << positions[i][0] << ((positions[i][1] % 2) * 4)
+                    error += d1
+                else:
+                    error += d0
+
+            masks.append(mask)
+            bgs.append(colors[0])
+            fgs.append(colors[1])
+            errors.append(error)
+        results.append((masks, fgs, bgs, errors))
+
+    return results
+
+def optimize_image(color_mode : ColorMode,
+                   filename : str,
+                   exhaustive : bool = False,
+                   workers : int | None = None):
+    # like load_image, but choose each cell's 2 colors and which pixels use
+    # them to best match the source.  also returns a per cell error map
+    # scaled 0 to 255.
+    with open(filename, 'rb') as infile:
+        iw, ih, rows = read_image(infile)
+        bands = []
+        while True:
+            band = [row[:3] for row in itertools.islice(rows, 4)]
+            if len(band) == 0:
+                break
+            bands.append(band)
+
+    width : int = (iw + 1) // 2 * 2
+    height : int = len(bands) * 4
+    cw : int = width // 2
+    data = array('i', itertools.repeat(0, width * height))
+    colordata_fg_r, colordata_fg_g, colordata_fg_b, \
+        colordata_bg_r, colordata_bg_g, colordata_bg_b = \
+        new_color_data(color_mode, width, height)
+
+    # split the rows of cells up between processes
+    if workers is None:
+        workers = os.cpu_count() or 1
+    chunk : int = max(1, len(bands) // (workers * 4))
+    jobs = [(color_mode, exhaustive, bands[i:i + chunk]) for i in range(0, len(bands), chunk)]
+    if workers > 1 and len(jobs) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            results = itertools.chain.from_iterable(executor.map(optimize_cell_rows, jobs))
+            results = list(results)
+    else:
+        results = list(itertools.chain.from_iterable(map(optimize_cell_rows, jobs)))
+
+    errors = array('i', itertools.repeat(0, cw * (height // 4)))
+    for cy, (masks, fgs, bgs, row_errors) in enumerate(results):
+        for cx, mask in enumerate(masks):
+            for i in range(8):
+                if mask & (1 << i):
+                    data[((cy * 4) + (i % 4)) * width + (cx * 2) + (i // 4)] = 1
+            if color_mode == ColorMode.DIRECT:
+                colordata_fg_r[cy * cw + cx], colordata_fg_g[cy * cw + cx], colordata_fg_b[cy * cw + cx] = fgs[cx]
+                colordata_bg_r[cy * cw + cx], colordata_bg_g[cy * cw + cx], colordata_bg_b[cy * cw + cx] = bgs[cx]
+            else:
+                colordata_fg_r[cy * cw + cx] = XTERM_PALETTE.index(fgs[cx])
+                colordata_bg_r[cy * cw + cx] = XTERM_PALETTE.index(bgs[cx])
+        errors[cy * cw:cy * cw + len(row_errors)] = array('i', row_errors)
+
+    max_error : int = max(errors) if len(errors) > 0 else 0
+    if max_error > 0:
+        errors = array('i', ((e * 255) // max_error for e in errors))
+
+    return width, height, color_mode, data, \
+        colordata_fg_r, colordata_fg_g, colordata_fg_b, \
+        colordata_bg_r, colordata_bg_g, colordata_bg_b, \
+        errors
+
+class SparseUndo:
+    # a group of small edits made one after another, stored as the index and
+    # old value of each pixel and the old 6 color values of each cell changed.
+    # it has the same things as a DataRect that undo and redo use.
+    def __init__(self, kind : KeyActions, color_mode : ColorMode):
+        self.kind : KeyActions = kind
+        self.color_mode : ColorMode = color_mode
+        self.whole_buffer : bool = False
+        self.pixel_indices : array = array('i')
+        self.pixel_values : array = array('i')
+        self.cell_indices : array = array('i')
+        self.cell_values : array = array('i')
+        # bounds in cells
+        self.x : int = -1
+        self.y : int = -1
+        self.x2 : int = -1
+        self.y2 : int = -1
+        # where and when the last change was made, for grouping
+        self.open : bool = True
+        self.time : float = time.monotonic()
+        self.last_x : int = 0
+        self.last_y : int = 0
+
+    def __len__(self):
+        return len(self.pixel_indices) + len(self.cell_indices)
+
+    def get_dims(self):
+        return self.x2 - self.x, self.y2 - self.y
+
+    def grow(self, cx : int, cy : int):
+        if self.x < 0:
+            self.x = cx
+            self.y = cy
+            self.x2 = cx + 1
+            self.y2 = cy + 1
+        else:
+            self.x = min(self.x, cx)
+            self.y = min(self.y, cy)
+            self.x2 = max(self.x2, cx + 1)
+            self.y2 = max(self.y2, cy + 1)
+
+    def add_pixel(self, x : int, y : int, dw : int, data : array):
+        index : int = dw * y + x
+        # only the first old value is needed
+        if index not in self.pixel_indices:
+            self.pixel_indices.append(index)
+            self.pixel_values.append(data[index])
+            self.grow(x // 2, y // 4)
+
+    def add_cell(self, x : int, y : int, dw : int, colordata : tuple[array]):
+        index : int = (dw // 2) * (y // 4) + (x // 2)
+        if index not in self.cell_indices:
+            self.cell_indices.append(index)
+            self.cell_values.extend(plane[index] for plane in colordata)
+            self.grow(x // 2, y // 4)
+
+    def extend(self, other):
+        # add the changes from another group, used when replaying.  like
+        # add_pixel and add_cell, only the first old value is kept.
+        for index, value in zip(other.pixel_indices, other.pixel_values):
+            if index not in self.pixel_indices:
+                self.pixel_indices.append(index)
+                self.pixel_values.append(value)
+        for num, index in enumerate(other.cell_indices):
+            if index not in self.cell_indices:
+                self.cell_indices.append(index)
+                self.cell_values.extend(other.cell_values[num * 6:num * 6 + 6])
+        self.grow(other.x, other.y)
+        self.grow(other.x2 - 1, other.y2 - 1)
+
+    def copy_current(self, data : array, colordata : tuple[array]):
+        # the same pixels and cells as they are now, to undo this undo
+        new = SparseUndo(self.kind, self.color_mode)
+        new.open = False
+        new.pixel_indices = array('i', self.pixel_indices)
+        new.pixel_values = array('i', (data[index] for index in self.pixel_indices))
+        new.cell_indices = array('i', self.cell_indices)
+        new.cell_values = array('i', (plane[index] for index in self.cell_indices for plane in colordata))
+        new.x, new.y, new.x2, new.y2 = self.x, self.y, self.x2, self.y2
+        return new
+
+    def apply(self,
+              dw : int, data : array,
+              colordata_fg_r : array,
+              colordata_fg_g : array,
+              colordata_fg_b : array,
+              colordata_bg_r : array,
+              colordata_bg_g : array,
+              colordata_bg_b : array):
+        # indices are already in to the whole canvas.  replayed groups may
+        # have the same one more than once, so go backwards so the oldest
+        # value is what's left.
+        for index, value in zip(reversed(self.pixel_indices), reversed(self.pixel_values)):
+            data[index] = value
+        colordata = (colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                     colordata_bg_r, colordata_bg_g, colordata_bg_b)
+        for num in reversed(range(len(self.cell_indices))):
+            for plane, value in zip(colordata, self.cell_values[num * 6:num * 6 + 6]):
+                plane[self.cell_indices[num]] = value
+
+        return None, None, None, None, None, None, None, None, None, None
+
 def make_copy(x : int, y : int, w : int, h : int,
               dw : int, data : array,
               color_mode : ColorMode,
@@ -1937,13 +4164,205 @@ def make_copy(x : int, y : int, w : int, h : int,
               colordata_fg_b : array,
               colordata_bg_r : array,
               colordata_bg_g : array,
-              colordata_bg_b : array):
+              colordata_bg_b : array,
+              layers : PasteLayers = PasteLayers.BOTH):
     cw, ch = pixels_to_occupied_wh(x, y, w, h)
 
     return DataRect(x // 2, y // 4, cw, ch,
                     dw // 2, data, color_mode,
                     colordata_fg_r, colordata_fg_g, colordata_fg_b,
-                    colordata_bg_r, colordata_bg_g, colordata_bg_b)
+                    colordata_bg_r, colordata_bg_g, colordata_bg_b,
+                    layers)
+
+def get_planes_size(planes):
+    # bytes taken up by the arrays, None for ones not there
+    return sum(len(plane) * plane.itemsize for plane in planes if plane is not None)
+
+def get_rect_size(rect : DataRect):
+    # bytes taken up by the arrays a copy holds
+    return get_planes_size(getattr(rect, name, None) for name in
+                           ('data',
+                            'colordata_fg_r', 'colordata_fg_g', 'colordata_fg_b',
+                            'colordata_bg_r', 'colordata_bg_g', 'colordata_bg_b'))
+
+def get_undo_size(undo : None | DataRect | SparseUndo):
+    if undo is None:
+        return 0
+    if isinstance(undo, SparseUndo):
+        return get_planes_size((undo.pixel_indices, undo.pixel_values,
+                                undo.cell_indices, undo.cell_values))
+    return get_rect_size(undo)
+
+def get_history_size(history : list[None | DataRect | SparseUndo]):
+    return sum(get_undo_size(undo) for undo in history)
+
+def trim_undos(undos : list[None | DataRect | SparseUndo]):
+    # make room for another undo, dropping the oldest past the most levels or
+    # once they hold more than the soft limit, always keeping the newest
+    if len(undos) >= UNDO_LEVELS:
+        del undos[0]
+    if undo_memory > 0:
+        size : int = get_history_size(undos)
+        while len(undos) > 1 and size > undo_memory:
+            size -= get_undo_size(undos[0])
+            del undos[0]
+
+def format_size(size : int):
+    if size < 1024:
+        return f"{size}B"
+    for unit in ('KiB', 'MiB'):
+        size /= 1024
+        if size < 1024:
+            return f"{size:.1f}{unit}"
+    return f"{size / 1024:.1f}GiB"
+
+def get_memory_usage(planes : list[array],
+                     undos : list[None | DataRect | SparseUndo],
+                     redos : list[None | DataRect | SparseUndo],
+                     palette : list,
+                     animation : None | Animation,
+                     others : list[None | array]):
+    # bytes held by each of the things which can grow, by name
+    usage : dict[str, int] = {'Canvas': get_planes_size(planes),
+                              'Undo': get_history_size(undos),
+                              'Redo': get_history_size(redos),
+                              'Clipboards': 0,
+                              'Palette': sys.getsizeof(palette) +
+                                         sum(sys.getsizeof(color) for color in palette),
+                              'Frames': 0,
+                              'Other': get_planes_size(others)}
+    if clipboards is not None:
+        usage['Clipboards'] = clipboards.get_size()
+    if animation is not None:
+        size : int = get_planes_size(animation.first)
+        for delta in animation.deltas:
+            for indices, values in delta:
+                size += get_planes_size((indices, values))
+        for frame_undos, frame_redos in animation.undos:
+            # the current frame's are already counted
+            if frame_undos is not undos:
+                size += get_history_size(frame_undos) + get_history_size(frame_redos)
+        usage['Frames'] = size
+    return usage
+
+class ClipboardSlot():
+    # a named clipboard.  it starts out just pointing at where it was copied
+    # from in the canvas and is only really copied once that's about to
+    # change, so large copies which are never changed after cost nothing.
+    def __init__(self, x : int, y : int, w : int, h : int,
+                 dw : int, data : array,
+                 color_mode : ColorMode,
+                 colordata : tuple[array],
+                 layers : PasteLayers):
+        # in character cells
+        self.x : int = x
+        self.y : int = y
+        self.w : int = w
+        self.h : int = h
+        self.dw : int = dw
+        self.data : None | array = data
+        self.color_mode : ColorMode = color_mode
+        self.colordata : None | tuple[array] = colordata
+        self.layers : PasteLayers = layers
+        self.rect : None | DataRect = None
+
+    def is_shared(self):
+        return self.rect is None
+
+    def overlaps(self, x : int, y : int, w : int, h : int):
+        return x < self.x + self.w and self.x < x + w and \
+               y < self.y + self.h and self.y < y + h
+
+    def get_rect(self):
+        if self.rect is not None:
+            return self.rect
+        # a throwaway copy, so it's still shared after
+        return DataRect(self.x, self.y, self.w, self.h,
+                        self.dw, self.data, self.color_mode,
+                        *self.colordata, self.layers)
+
+    def separate(self):
+        # take a copy of its own and let go of the canvas
+        if self.rect is None:
+            self.rect = self.get_rect()
+            self.data = None
+            self.colordata = None
+
+    def get_size(self):
+        if self.rect is None:
+            return 0
+        return get_rect_size(self.rect)
+
+class Clipboards():
+    def __init__(self,
+                 max_slots : int = CLIPBOARD_SLOTS,
+                 max_memory : int = CLIPBOARD_MEMORY):
+        self.max_slots : int = max_slots
+        self.max_memory : int = max_memory
+        # oldest used first
+        self.slots : dict[str, ClipboardSlot] = {}
+
+    def __len__(self):
+        return len(self.slots)
+
+    def get_names(self):
+        return list(self.slots.keys())
+
+    def get_size(self):
+        return sum(slot.get_size() for slot in self.slots.values())
+
+    def evict(self, keep : str):
+        # drop the least recently used until it's all within the limits,
+        # but always keep the one just used
+        for name in list(self.slots.keys()):
+            if len(self.slots) <= self.max_slots and \
+               (self.max_memory <= 0 or self.get_size() <= self.max_memory):
+                break
+            if name != keep:
+                del self.slots[name]
+
+    def copy(self, name : str,
+             x : int, y : int, w : int, h : int,
+             dw : int, data : array,
+             color_mode : ColorMode,
+             colordata_fg_r : array,
+             colordata_fg_g : array,
+             colordata_fg_b : array,
+             colordata_bg_r : array,
+             colordata_bg_g : array,
+             colordata_bg_b : array,
+             layers : PasteLayers = PasteLayers.BOTH):
+        # same arguments as make_copy, in pixels
+        cw, ch = pixels_to_occupied_wh(x, y, w, h)
+        if name in self.slots:
+            del self.slots[name]
+        self.slots[name] = ClipboardSlot(x // 2, y // 4, cw, ch,
+                                         dw // 2, data, color_mode,
+                                         (colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                          colordata_bg_r, colordata_bg_g, colordata_bg_b),
+                                         layers)
+        self.evict(name)
+
+    def get(self, name : str):
+        if name not in self.slots:
+            return None
+        # move it to the end as the most recently used
+        slot = self.slots.pop(name)
+        self.slots[name] = slot
+        return slot.get_rect()
+
+    def changing(self, data : array, x : int, y : int, w : int, h : int,
+                 whole_buffer : bool = False):
+        # called before the area in character cells of the canvas with this
+        # data is changed, anything copied from there gets its own copy first
+        separated : bool = False
+        for slot in self.slots.values():
+            if slot.is_shared() and slot.data is data and \
+               (whole_buffer or slot.overlaps(x, y, w, h)):
+                slot.separate()
+                separated = True
+        if separated:
+            self.evict(next(reversed(self.slots)))
 
 def make_undo(undos : list[None | DataRect],
               redos : list[None | DataRect],
@@ -1955,14 +4374,82 @@ def make_undo(undos : list[None | DataRect],
               colordata_fg_b : array,
               colordata_bg_r : array,
               colordata_bg_g : array,
-              colordata_bg_b : array):
-    if len(undos) >= UNDO_LEVELS:
-        del undos[0]
+              colordata_bg_b : array,
+              layers : PasteLayers = PasteLayers.BOTH):
+    # layers are which of the pixels and colors are going to be changed
+    trim_undos(undos)
 
     redos.clear()
     undos.append(make_copy(x, y, w, h, dw, data, color_mode,
                            colordata_fg_r, colordata_fg_g, colordata_fg_b,
-                           colordata_bg_r, colordata_bg_g, colordata_bg_b))
+                           colordata_bg_r, colordata_bg_g, colordata_bg_b,
+                           layers))
+    if clipboards is not None:
+        cw, ch = undos[-1].get_dims()
+        clipboards.changing(data, undos[-1].x, undos[-1].y, cw, ch, undos[-1].whole_buffer)
+    if undo_journal is not None:
+        undo_journal.push_undo(undos[-1], dw, color_mode,
+                               (data,
+                                colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                colordata_bg_r, colordata_bg_g, colordata_bg_b))
+
+# which of the pixels or colors each kind of grouped edit changes
+SPARSE_UNDO_LAYERS = {
+    KeyActions.TOGGLE: PasteLayers.PIXELS,
+    KeyActions.PUT_COLOR: PasteLayers.COLORS
+}
+
+def make_sparse_undo(undos : list[None | DataRect | SparseUndo],
+                     redos : list[None | DataRect | SparseUndo],
+                     kind : KeyActions,
+                     x : int, y : int,
+                     dw : int, data : array,
+                     color_mode : ColorMode,
+                     colordata_fg_r : array,
+                     colordata_fg_g : array,
+                     colordata_fg_b : array,
+                     colordata_bg_r : array,
+                     colordata_bg_g : array,
+                     colordata_bg_b : array):
+    # like make_undo for a single pixel or its cell, but quick edits of the
+    # same kind near each other are added to the last undo
+    colordata = (colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                 colordata_bg_r, colordata_bg_g, colordata_bg_b)
+    layers : PasteLayers = SPARSE_UNDO_LAYERS.get(kind, PasteLayers.BOTH)
+    now : float = time.monotonic()
+    if clipboards is not None:
+        clipboards.changing(data, x // 2, y // 4, 1, 1)
+    undo = None
+    if len(undos) > 0 and len(redos) == 0 and isinstance(undos[-1], SparseUndo):
+        undo = undos[-1]
+        if not undo.open or undo.kind != kind or undo.color_mode != color_mode or \
+           now - undo.time > UNDO_GROUP_TIME or len(undo) >= UNDO_GROUP_MAX or \
+           max(abs(x - undo.last_x), abs(y - undo.last_y)) > UNDO_GROUP_DISTANCE:
+            undo = None
+
+    # just what's changed this time, to go in to the journal
+    change = SparseUndo(kind, color_mode)
+    if layers != PasteLayers.COLORS:
+        change.add_pixel(x, y, dw, data)
+    if layers != PasteLayers.PIXELS:
+        change.add_cell(x, y, dw, colordata)
+    if undo is None:
+        trim_undos(undos)
+        redos.clear()
+        undos.append(change)
+        if undo_journal is not None:
+            undo_journal.push_undo(change, dw, color_mode, (data, *colordata))
+        undo = change
+    else:
+        if layers != PasteLayers.COLORS:
+            undo.add_pixel(x, y, dw, data)
+        if layers != PasteLayers.PIXELS:
+            undo.add_cell(x, y, dw, colordata)
+        if undo_journal is not None:
+            undo_journal.push_undo(change, dw, color_mode, (data, *colordata), b'G')
+    undo.time = now
+    undo.last_x = x
+    undo.last_y = y
 
 def apply_undo(undos : list[None | DataRect],
                redos : list[None | DataRect],
@@ -1980,12 +4467,23 @@ def apply_undo(undos : list[None | DataRect],
                colordata_fg_r, colordata_fg_g, colordata_fg_b, \
                colordata_bg_r, colordata_bg_g, colordata_bg_b
 
+    if undo_journal is not None:
+        undo_journal.push_kind(b'Z', dw, color_mode,
+                               (data,
+                                colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                colordata_bg_r, colordata_bg_g, colordata_bg_b))
+
     # make redo
     if len(redos) >= UNDO_LEVELS:
         del redos[0]
     undo = undos.pop(-1)
     w, h = undo.get_dims()
-    if undo.whole_buffer:
+    if clipboards is not None:
+        clipboards.changing(data, undo.x, undo.y, w, h, undo.whole_buffer)
+    if isinstance(undo, SparseUndo):
+        redos.append(undo.copy_current(data, (colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                              colordata_bg_r, colordata_bg_g, colordata_bg_b)))
+    elif undo.whole_buffer:
         redos.append(make_copy(0, 0, dw, dh, dw, data, color_mode,
                                colordata_fg_r, colordata_fg_g, colordata_fg_b,
                                colordata_bg_r, colordata_bg_g, colordata_bg_b))
@@ -1994,7 +4492,8 @@ def apply_undo(undos : list[None | DataRect],
         redos.append(make_copy(undo.x * 2, undo.y * 4, w * 2, h * 4,
                                dw, data, color_mode,
                                colordata_fg_r, colordata_fg_g, colordata_fg_b,
-                               colordata_bg_r, colordata_bg_g, colordata_bg_b))
+                               colordata_bg_r, colordata_bg_g, colordata_bg_b,
+                               undo.layers))
 
     new_dw, new_dh, new_data, new_color_mode, \
         new_colordata_fg_r, new_colordata_fg_g, new_colordata_fg_b, \
@@ -2031,12 +4530,22 @@ def apply_redo(undos : list[None | DataRect],
                colordata_fg_r, colordata_fg_g, colordata_fg_b, \
                colordata_bg_r, colordata_bg_g, colordata_bg_b
 
+    if undo_journal is not None:
+        undo_journal.push_kind(b'Y', dw, color_mode,
+                               (data,
+                                colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                colordata_bg_r, colordata_bg_g, colordata_bg_b))
+
     # make undo
-    if len(undos) >= UNDO_LEVELS:
-        del undos[0]
+    trim_undos(undos)
     redo = redos.pop(-1)
     w, h = redo.get_dims()
-    if redo.whole_buffer:
+    if clipboards is not None:
+        clipboards.changing(data, redo.x, redo.y, w, h, redo.whole_buffer)
+    if isinstance(redo, SparseUndo):
+        undos.append(redo.copy_current(data, (colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                              colordata_bg_r, colordata_bg_g, colordata_bg_b)))
+    elif redo.whole_buffer:
         undos.append(make_copy(0, 0, dw, dh, dw, data, color_mode,
                                colordata_fg_r, colordata_fg_g, colordata_fg_b,
                                colordata_bg_r, colordata_bg_g, colordata_bg_b))
@@ -2045,7 +4554,8 @@ def apply_redo(undos : list[None | DataRect],
         undos.append(make_copy(redo.x * 2, redo.y * 4, w * 2, h * 4,
                                dw, data, color_mode,
                                colordata_fg_r, colordata_fg_g, colordata_fg_b,
-                               colordata_bg_r, colordata_bg_g, colordata_bg_b))
+                               colordata_bg_r, colordata_bg_g, colordata_bg_b,
+                               redo.layers))
 
     new_dw, new_dh, new_data, new_color_mode, \
         new_colordata_fg_r, new_colordata_fg_g, new_colordata_fg_b, \
@@ -2066,6 +4576,293 @@ def apply_redo(undos : list[None | DataRect],
            colordata_fg_r, colordata_fg_g, colordata_fg_b, \
            colordata_bg_r, colordata_bg_g, colordata_bg_b
 
+def pack_rect(rect : DataRect):
+    w, h = rect.get_dims()
+    planes = []
+    if rect.layers != PasteLayers.COLORS:
+        planes.append(rect.data)
+    if rect.layers != PasteLayers.PIXELS:
+        planes.extend((rect.colordata_fg_r, rect.colordata_bg_r))
+        if rect.whole_buffer or rect.color_mode == ColorMode.DIRECT:
+            planes.extend((rect.colordata_fg_g, rect.colordata_fg_b,
+                           rect.colordata_bg_g, rect.colordata_bg_b))
+
+    return struct.pack(JOURNAL_RECT, rect.x, rect.y, w, h, rect.whole_buffer,
+                       rect.color_mode.value, rect.layers.value) + \
+           b''.join(plane.tobytes() for plane in planes)
+
+def pack_sparse(undo : SparseUndo):
+    return struct.pack(JOURNAL_SPARSE, undo.color_mode.value,
+                       undo.x, undo.y, undo.x2, undo.y2,
+                       len(undo.pixel_indices), len(undo.cell_indices)) + \
+           undo.pixel_indices.tobytes() + undo.pixel_values.tobytes() + \
+           undo.cell_indices.tobytes() + undo.cell_values.tobytes()
+
+def unpack_sparse(payload : bytes):
+    color_mode, x, y, x2, y2, pixels, cells = struct.unpack_from(JOURNAL_SPARSE, payload)
+    # the kind only matters for grouping, which replayed undos aren't
+    undo = SparseUndo(KeyActions.NONE, ColorMode(color_mode))
+    undo.open = False
+    undo.x, undo.y, undo.x2, undo.y2 = x, y, x2, y2
+    pos : int = struct.calcsize(JOURNAL_SPARSE)
+    for plane, size in ((undo.pixel_indices, pixels), (undo.pixel_values, pixels),
+                        (undo.cell_indices, cells), (undo.cell_values, cells * 6)):
+        plane.frombytes(payload[pos:pos + size * plane.itemsize])
+        if len(plane) != size:
+            raise ValueError("Journal record is too short.")
+        pos += size * plane.itemsize
+
+    return undo
+
+def pack_undo(undo : DataRect | SparseUndo):
+    if isinstance(undo, SparseUndo):
+        return b'S' + pack_sparse(undo)
+    return b'D' + pack_rect(undo)
+
+def unpack_undo(payload : bytes):
+    if payload[:1] == b'S':
+        return unpack_sparse(payload[1:])
+    return unpack_rect(payload[1:])
+
+def unpack_rect(payload : bytes):
+    x, y, w, h, whole_buffer, color_mode, layers = struct.unpack_from(JOURNAL_RECT, payload)
+    color_mode = ColorMode(color_mode)
+    layers = PasteLayers(layers)
+    sizes = []
+    if layers != PasteLayers.COLORS:
+        sizes.append(w * 2 * h * 4)
+    if layers != PasteLayers.PIXELS:
+        sizes.extend((w * h, w * h))
+        if whole_buffer or color_mode == ColorMode.DIRECT:
+            sizes.extend(itertools.repeat(w * h, 4))
+    planes = []
+    pos : int = struct.calcsize(JOURNAL_RECT)
+    for size in sizes:
+        plane = array('i')
+        plane.frombytes(payload[pos:pos + size * plane.itemsize])
+        if len(plane) != size:
+            raise ValueError("Journal record is too short.")
+        pos += size * plane.itemsize
+        planes.append(plane)
+    # stand ins for what wasn't kept
+    data = array('i', itertools.repeat(0, w * 2 * h * 4))
+    colordata = [array('i', itertools.repeat(-1, w * h))] * 6
+    if layers != PasteLayers.COLORS:
+        data = planes.pop(0)
+    if layers != PasteLayers.PIXELS:
+        colordata[0], colordata[3], *others = planes
+        if len(others) > 0:
+            colordata[1], colordata[2], colordata[4], colordata[5] = others
+
+    # it's all the buffer there is, so it's copied whole then placed back
+    rect = DataRect(0, 0, w, h, w, data, color_mode, *colordata)
+    rect.x = x
+    rect.y = y
+    rect.whole_buffer = bool(whole_buffer)
+    rect.layers = layers
+    if not rect.whole_buffer:
+        # drop the stand ins, keeping only what make_copy would have
+        if layers == PasteLayers.COLORS:
+            rect.data = None
+        if layers == PasteLayers.PIXELS:
+            rect.colordata_fg_r = None
+            rect.colordata_bg_r = None
+        if layers == PasteLayers.PIXELS or color_mode != ColorMode.DIRECT:
+            rect.colordata_fg_g = None
+            rect.colordata_fg_b = None
+            rect.colordata_bg_g = None
+            rect.colordata_bg_b = None
+    return rect
+
+class UndoJournal():
+    # records are appended to a buffer as they happen, and the buffer is
+    # written out and synced on a timer.  U is an undo being made, G is more
+    # changes added to the last undo, A is what an area became after it was
+    # changed, Z and Y are undo and redo.  R is a redo only written when
+    # compacting, which writes the whole canvas then each undo and redo.
+    def __init__(self, filename : str, interval : float = JOURNAL_INTERVAL):
+        self.filename : str = filename
+        self.interval : float = interval
+        self.buffer : bytearray = bytearray()
+        self.size : int = 0
+        self.compact_size : int = 0
+        self.last_sync : float = time.monotonic()
+        # areas changed since the last undo was made, whole canvas if None
+        self.pending : list[None | tuple[int, int, int, int]] = []
+        self.undos : None | list = None
+        self.redos : None | list = None
+        self.error : None | str = None
+
+    def get_path(self):
+        return get_journal_path(self.filename)
+
+    def append(self, kind : bytes, payload : bytes = b''):
+        header = struct.pack(JOURNAL_HEADER, kind, len(payload))
+        self.buffer.extend(header)
+        self.buffer.extend(payload)
+        self.buffer.extend(struct.pack('<I', zlib.crc32(payload, zlib.crc32(header))))
+
+    def capture(self, dw : int, color_mode : ColorMode, planes : tuple[array]):
+        # record what the areas changed since the last undo are now
+        for area in self.pending:
+            if area is None:
+                area = (0, 0, dw // 2, len(planes[1]) // (dw // 2))
+            self.append(b'A', pack_rect(DataRect(*area, dw // 2, planes[0], color_mode, *planes[1:])))
+        self.pending.clear()
+
+    def push_undo(self, rect : DataRect | SparseUndo,
+                  dw : int, color_mode : ColorMode, planes : tuple[array],
+                  kind : bytes = b'U'):
+        self.capture(dw, color_mode, planes)
+        self.append(kind, pack_undo(rect))
+        if rect.whole_buffer:
+            # the size or color mode may change
+            self.pending.append(None)
+        else:
+            self.pending.append((rect.x, rect.y, *rect.get_dims()))
+
+    def push_kind(self, kind : bytes, dw : int, color_mode : ColorMode, planes : tuple[array]):
+        self.capture(dw, color_mode, planes)
+        self.append(kind)
+
+    def set_canvas(self, filename : str,
+                   dw : int, color_mode : ColorMode, data : array,
+                   colordata_fg_r : array,
+                   colordata_fg_g : array,
+                   colordata_fg_b : array,
+                   colordata_bg_r : array,
+                   colordata_bg_g : array,
+                   colordata_bg_b : array,
+                   undos : list[None | DataRect],
+                   redos : list[None | DataRect]):
+        planes = (data,
+                  colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                  colordata_bg_r, colordata_bg_g, colordata_bg_b)
+        if filename != self.filename or undos is not self.undos or redos is not self.redos:
+            # a new name or different history, like another animation frame,
+            # so start over
+            old_path = self.get_path()
+            self.filename = filename
+            self.undos = undos
+            self.redos = redos
+            self.compact(dw, color_mode, planes)
+            if old_path != self.get_path():
+                old_path.unlink(missing_ok=True)
+            return
+
+        self.capture(dw, color_mode, planes)
+        if self.size + len(self.buffer) > max(JOURNAL_COMPACT_MIN, self.compact_size * JOURNAL_COMPACT_RATIO):
+            self.compact(dw, color_mode, planes)
+
+    def compact(self, dw : int, color_mode : ColorMode, planes : tuple[array]):
+        self.buffer.clear()
+        self.pending = [None]
+        self.capture(dw, color_mode, planes)
+        for undo in self.undos:
+            self.append(b'U', pack_undo(undo))
+        for redo in self.redos:
+            self.append(b'R', pack_undo(redo))
+
+        path = self.get_path()
+        temp = path.with_name(path.name + '.tmp')
+        try:
+            with temp.open('wb') as out:
+                out.write(self.buffer)
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(temp, path)
+        except OSError as e:
+            self.error = str(e)
+        self.size = len(self.buffer)
+        self.compact_size = self.size
+        self.buffer.clear()
+        self.last_sync = time.monotonic()
+
+    def sync(self):
+        if len(self.buffer) == 0:
+            return
+        try:
+            with self.get_path().open('ab') as out:
+                out.write(self.buffer)
+                out.flush()
+                os.fsync(out.fileno())
+        except OSError as e:
+            self.error = str(e)
+        self.size += len(self.buffer)
+        self.buffer.clear()
+
+    def poll(self):
+        now : float = time.monotonic()
+        if now - self.last_sync < self.interval:
+            return
+        self.last_sync = now
+        self.sync()
+
+    def close(self):
+        # a clean exit doesn't need recovering from
+        self.get_path().unlink(missing_ok=True)
+
+def get_journal_path(filename : str):
+    if len(filename) == 0:
+        return pathlib.Path(AUTOSAVE_UNTITLED + JOURNAL_SUFFIX)
+    return pathlib.Path(filename + JOURNAL_SUFFIX)
+
+def read_journal(path : pathlib.Path):
+    # stops at the first record which wasn't completely written
+    header_size : int = struct.calcsize(JOURNAL_HEADER)
+    buf = path.read_bytes()
+    pos : int = 0
+    while pos + header_size <= len(buf):
+        kind, length = struct.unpack_from(JOURNAL_HEADER, buf, pos)
+        end : int = pos + header_size + length
+        if end + 4 > len(buf):
+            break
+        crc, = struct.unpack_from('<I', buf, end)
+        if crc != zlib.crc32(buf[pos:end]):
+            break
+        yield kind, buf[pos + header_size:end]
+        pos = end + 4
+
+def replay_journal(path : pathlib.Path):
+    # returns the canvas and history as they were, or None if there's no
+    # canvas in it
+    canvas = None
+    undos : list[None | DataRect] = []
+    redos : list[None | DataRect] = []
+    for kind, payload in read_journal(path):
+        if kind == b'A':
+            rect = unpack_rect(payload)
+        elif kind in (b'U', b'G', b'R'):
+            rect = unpack_undo(payload)
+        elif canvas is None:
+            return None
+        match kind:
+            case b'A':
+                if rect.whole_buffer:
+                    w, h, *new_canvas = rect.apply(0, None, None, None, None, None, None, None)
+                    canvas = [w * 2, h * 4, *new_canvas]
+                elif canvas is not None:
+                    dw, dh, data, color_mode, *colordata = canvas
+                    rect.apply(dw // 2, data, *colordata)
+            case b'U':
+                trim_undos(undos)
+                redos.clear()
+                undos.append(rect)
+            case b'G':
+                if len(undos) == 0 or not isinstance(undos[-1], SparseUndo):
+                    raise ValueError("Journal adds to an undo that isn't there.")
+                undos[-1].extend(rect)
+            case b'R':
+                redos.append(rect)
+            case b'Z':
+                canvas = list(apply_undo(undos, redos, *canvas)[4:])
+            case b'Y':
+                canvas = list(apply_redo(undos, redos, *canvas)[4:])
+    if canvas is None:
+        return None
+
+    return *canvas, undos, redos
+
 def get_max_color(colordata_fg : array,
                   colordata_bg : array):
     max_color : int = 0
@@ -2115,52 +4912,124 @@ def get_xywh(x1 : int, y1 : int,
 
     return sx1, sy1, w, h
 
+def span_to_int(data : array, start : int, end : int) -> int:
+    # pack a span of the array in to one big integer so a whole row can be
+    # operated on with a single bitwise operation instead of per pixel
+    return int.from_bytes(data[start:end].tobytes(), sys.byteorder)
+
+def int_to_span(data : array, start : int, end : int, value : int):
+    # reverse of span_to_int
+    data[start:end] = array(data.typecode, value.to_bytes((end - start) * data.itemsize, sys.byteorder))
+
+def span_mask(length : int, value : int = 1) -> int:
+    # packed row with every element set to value, for use with span_to_int
+    return int.from_bytes(array('i', itertools.repeat(value, length)).tobytes(), sys.byteorder)
+
 def fill_rect(data : array,
               dw : int, dh : int,
               x : int, y : int,
               w : int, h : int,
               mode : FillMode):
+    x1 : int = max(0, x)
+    x2 : int = min(dw, x + w)
+    if x2 <= x1:
+        return
+
     match mode:
         case FillMode.SET:
+            row = array('i', itertools.repeat(1, x2 - x1))
             for ty in range(max(0, y), min(dh, y + h)):
-                for tx in range(max(0, x), min(dw, x + w)):
-                    data[ty * dw + tx] = 1
+                data[ty * dw + x1:ty * dw + x2] = row
         case FillMode.CLEAR:
+            row = array('i', itertools.repeat(0, x2 - x1))
             for ty in range(max(0, y), min(dh, y + h)):
-                for tx in range(max(0, x), min(dw, x + w)):
-                    data[ty * dw + tx] = 0
+                data[ty * dw + x1:ty * dw + x2] = row
         case FillMode.INVERT:
+            mask = span_mask(x2 - x1)
             for ty in range(max(0, y), min(dh, y + h)):
-                for tx in range(max(0, x), min(dw, x + w)):
-                    data[ty * dw + tx] ^= 1
+                int_to_span(data, ty * dw + x1, ty * dw + x2,
+                            span_to_int(data, ty * dw + x1, ty * dw + x2) ^ mask)
+
+def shift_rect(data : array,
+               dw : int, dh : int,
+               x : int, y : int,
+               w : int, h : int,
+               ox : int, oy : int):
+    # move the pixels in the rect by ox, oy, leaving cleared pixels behind.
+    # rows are contiguous so moving a row is a single slice copy no matter
+    # which cells it crosses.
+    x1 : int = max(0, x)
+    x2 : int = min(dw, x + w)
+    y1 : int = max(0, y)
+    y2 : int = min(dh, y + h)
+    if x2 <= x1 or y2 <= y1:
+        return
+
+    rows = [data[ty * dw + x1:ty * dw + x2] for ty in range(y1, y2)]
+    fill_rect(data, dw, dh, x1, y1, x2 - x1, y2 - y1, FillMode.CLEAR)
+
+    # clip the destination to the canvas
+    nx1 : int = max(0, x1 + ox)
+    nx2 : int = min(dw, x2 + ox)
+    if nx2 <= nx1:
+        return
+    for i, row in enumerate(rows):
+        ty : int = y1 + i + oy
+        if ty >= 0 and ty < dh:
+            data[ty * dw + nx1:ty * dw + nx2] = row[nx1 - (x1 + ox):nx2 - (x1 + ox)]
+
+def fill_color_rect(cw : int,
+                    x : int, y : int,
+                    w : int, h : int,
+                    color_mode : ColorMode,
+                    colordata_fg_r : array,
+                    colordata_fg_g : array,
+                    colordata_fg_b : array,
+                    colordata_bg_r : array,
+                    colordata_bg_g : array,
+                    colordata_bg_b : array,
+                    fg_r : int, fg_g : int, fg_b : int,
+                    bg_r : int, bg_g : int, bg_b : int):
+    # cw, x, y, w and h are all in character cells
+    ch : int = len(colordata_fg_r) // cw
+    x1 : int = max(0, x)
+    x2 : int = min(cw, x + w)
+    if x2 <= x1:
+        return
+
+    planes = [(colordata_fg_r, fg_r), (colordata_bg_r, bg_r)]
+    if color_mode == ColorMode.DIRECT:
+        planes.extend(((colordata_fg_g, fg_g), (colordata_fg_b, fg_b),
+                       (colordata_bg_g, bg_g), (colordata_bg_b, bg_b)))
+
+    for plane, value in planes:
+        row = array('i', itertools.repeat(value, x2 - x1))
+        for ty in range(max(0, y), min(ch, y + h)):
+            plane[ty * cw + x1:ty * cw + x2] = row
 
 def draw_rect(data : array, dw : int,
               x : int, y : int,
               w : int, h : int,
               mode : FillMode):
     dh : int = len(data) // dw
+    # top and bottom are just 1 pixel tall fills
+    fill_rect(data, dw, dh, x, y, w, 1, mode)
+    fill_rect(data, dw, dh, x, y + h - 1, w, 1, mode)
+    # sides off the canvas would wrap around on to other rows
+    sides = [side for side in (x, x + w - 1) if side >= 0 and side < dw]
     match mode:
         case FillMode.SET:
-            for tx in range(max(0, x), min(dw, x + w)):
-                data[y * dw + tx] = 1
-                data[(y + h - 1) * dw + tx] = 1
             for ty in range(max(0, y + 1), min(dh, y + h - 1)):
-                data[ty * dw + x] = 1
-                data[ty * dw + (x + w - 1)] = 1
+                for side in sides:
+                    data[ty * dw + side] = 1
         case FillMode.CLEAR:
-            for tx in range(max(0, x), min(dw, x + w)):
-                data[y * dw + tx] = 0
-                data[(y + h - 1) * dw + tx] = 0
             for ty in range(max(0, y + 1), min(dh, y + h - 1)):
-                data[ty * dw + x] = 0
-                data[ty * dw + (x + w - 1)] = 0
+                for side in sides:
+                    data[ty * dw + side] = 0
         case FillMode.INVERT:
-            for tx in range(max(0, x), min(dw, x + w)):
-                data[y * dw + tx] ^= 1
-                data[(y + h - 1) * dw + tx] ^= 1
             for ty in range(max(0, y + 1), min(dh, y + h - 1)):
-                data[ty * dw + x] ^= 1
-                data[ty * dw + (x + w - 1)] ^= 1
+                for side in sides:
+                    data[ty * dw + side] ^= 1
 
 def fill_circle(data : array,
                 dw : int, dh : int,
@@ -3093,6 +5962,451 @@ def handler_cont(signum, frame):
     if callable(orig_cont):
         orig_cont(signum, frame)
 
+def get_script_term():
+    # without the editor, there may not be a terminal to get styling from, so
+    # make one which can save and load any color mode
+    global script_term
+
+    if script_term is None:
+        script_term = blessed.Terminal(kind="xterm-256color", force_styling=True)
+        script_term.number_of_colors = 1 << 24
+    return script_term
+
+class Canvas():
+    # a canvas and its undo history, for using this as a module to make or
+    # change files without a terminal.  coordinates are in pixels, colors are
+    # palette indexes or (r, g, b) for DIRECT, and None for a transparent
+    # background.
+    def __init__(self, width : int = 80, height : int = 48,
+                 color_mode : ColorMode = ColorMode.DIRECT):
+        if width < 2 or width % 2 != 0:
+            raise ValueError("Width must be non-zero and divisible by 2.")
+        if height < 4 or height % 4 != 0:
+            raise ValueError("Height must be non-zero and divisible by 4.")
+        self.width : int = width
+        self.height : int = height
+        self.color_mode : ColorMode = color_mode
+        self.data : array = array('i', itertools.repeat(0, width * height))
+        self.colordata_fg_r, self.colordata_fg_g, self.colordata_fg_b, \
+            self.colordata_bg_r, self.colordata_bg_g, self.colordata_bg_b = \
+            new_color_data(color_mode, width, height)
+        self.undos : list[None | DataRect | SparseUndo] = []
+        self.redos : list[None | DataRect | SparseUndo] = []
+        # inside batch(), changes don't each make an undo
+        self.batching : bool = False
+
+    @classmethod
+    def load(cls, filename : str,
+             max_color_mode : ColorMode = ColorMode.DIRECT,
+             t : None | blessed.Terminal = None):
+        # a saved file, or a PPM/PGM/PNG image to import
+        if t is None:
+            t = get_script_term()
+        if is_image_file(filename):
+            loaded = load_image(max_color_mode, filename)
+        else:
+            loaded = load_file(t, max_color_mode, filename)
+        canvas = cls(2, 4)
+        canvas.width, canvas.height, canvas.color_mode, canvas.data, \
+            canvas.colordata_fg_r, canvas.colordata_fg_g, canvas.colordata_fg_b, \
+            canvas.colordata_bg_r, canvas.colordata_bg_g, canvas.colordata_bg_b = loaded
+        return canvas
+
+    def save(self, filename : str,
+             color : bool = True,
+             minimize : bool = False,
+             blank_skip : BlankSkip = BlankSkip.NONE,
+             glyphs : Glyphs = Glyphs.OCTANT,
+             t : None | blessed.Terminal = None):
+        if t is None:
+            t = get_script_term()
+        save_file(t, pathlib.Path(filename), color, self.data, self.width, self.color_mode,
+                  *self.get_colordata(), minimize, blank_skip, glyphs)
+
+    def get_colordata(self):
+        return self.colordata_fg_r, self.colordata_fg_g, self.colordata_fg_b, \
+               self.colordata_bg_r, self.colordata_bg_g, self.colordata_bg_b
+
+    def make_undo(self, x : int, y : int, w : int, h : int,
+                  layers : PasteLayers = PasteLayers.BOTH):
+        if self.batching:
+            return
+        # only the part on the canvas
+        x1 : int = max(0, x)
+        y1 : int = max(0, y)
+        x2 : int = min(self.width, x + w)
+        y2 : int = min(self.height, y + h)
+        if x2 <= x1 or y2 <= y1:
+            return
+        make_undo(self.undos, self.redos,
+                  x1, y1, x2 - x1, y2 - y1, self.width, self.data,
+                  self.color_mode, *self.get_colordata(), layers)
+
+    @contextlib.contextmanager
+    def batch(self):
+        # everything changed inside is undone together, and with a single
+        # copy up front rather than one for every call
+        if self.batching:
+            yield self
+            return
+        self.make_undo(0, 0, self.width, self.height)
+        self.batching = True
+        try:
+            yield self
+        finally:
+            self.batching = False
+
+    def undo(self):
+        if len(self.undos) == 0:
+            return False
+        _, _, _, _, self.width, self.height, self.data, self.color_mode, \
+            self.colordata_fg_r, self.colordata_fg_g, self.colordata_fg_b, \
+            self.colordata_bg_r, self.colordata_bg_g, self.colordata_bg_b = \
+            apply_undo(self.undos, self.redos,
+                       self.width, self.height, self.data,
+                       self.color_mode, *self.get_colordata())
+        return True
+
+    def redo(self):
+        if len(self.redos) == 0:
+            return False
+        _, _, _, _, self.width, self.height, self.data, self.color_mode, \
+            self.colordata_fg_r, self.colordata_fg_g, self.colordata_fg_b, \
+            self.colordata_bg_r, self.colordata_bg_g, self.colordata_bg_b = \
+            apply_redo(self.undos, self.redos,
+                       self.width, self.height, self.data,
+                       self.color_mode, *self.get_colordata())
+        return True
+
+    def get_pixel(self, x : int, y : int):
+        if x < 0 or x >= self.width or y < 0 or y >= self.height:
+            return False
+        return bool(self.data[y * self.width + x])
+
+    def set_pixel(self, x : int, y : int, value : bool = True):
+        if x < 0 or x >= self.width or y < 0 or y >= self.height:
+            return
+        self.make_undo(x, y, 1, 1, PasteLayers.PIXELS)
+        self.data[y * self.width + x] = int(value)
+
+    def set_pixels(self, points, value : bool = True):
+        # many pixels with one undo for all of them
+        points = [(x, y) for x, y in points
+                  if x >= 0 and x < self.width and y >= 0 and y < self.height]
+        if len(points) == 0:
+            return
+        x1 : int = min(x for x, _ in points)
+        y1 : int = min(y for _, y in points)
+        x2 : int = max(x for x, _ in points) + 1
+        y2 : int = max(y for _, y in points) + 1
+        self.make_undo(x1, y1, x2 - x1, y2 - y1, PasteLayers.PIXELS)
+        value = int(value)
+        for x, y in points:
+            self.data[y * self.width + x] = value
+
+    def get_color_values(self, color : None | int | tuple[int, int, int]):
+        # what goes in the r, g and b planes for a color in this color mode
+        if color is None:
+            return -1, -1, -1
+        if self.color_mode == ColorMode.DIRECT:
+            if isinstance(color, int):
+                return XTERM_PALETTE[color]
+            return color
+        if not isinstance(color, int):
+            color = nearest_palette_color(self.color_mode, *color)
+        return color, -1, -1
+
+    def get_color(self, x : int, y : int):
+        # foreground and background of the cell the pixel is in
+        index : int = (y // 4) * (self.width // 2) + (x // 2)
+        fg_r, fg_g, fg_b, bg_r, bg_g, bg_b = (plane[index] for plane in self.get_colordata())
+        bg = None
+        if self.color_mode == ColorMode.DIRECT:
+            if bg_r >= 0:
+                bg = (bg_r, bg_g, bg_b)
+            return (fg_r, fg_g, fg_b), bg
+        if bg_r >= 0:
+            bg = bg_r
+        return fg_r, bg
+
+    def fill_color(self, x : int, y : int, w : int, h : int,
+                   fg : int | tuple[int, int, int],
+                   bg : None | int | tuple[int, int, int] = None):
+        # every cell the rect touches
+        cw, ch = pixels_to_occupied_wh(x, y, w, h)
+        self.make_undo(x // 2 * 2, y // 4 * 4, cw * 2, ch * 4, PasteLayers.COLORS)
+        fill_color_rect(self.width // 2, x // 2, y // 4, cw, ch, self.color_mode,
+                        *self.get_colordata(),
+                        *self.get_color_values(fg), *self.get_color_values(bg))
+
+    def set_color(self, x : int, y : int,
+                  fg : int | tuple[int, int, int],
+                  bg : None | int | tuple[int, int, int] = None):
+        self.fill_color(x, y, 1, 1, fg, bg)
+
+    def rect(self, x : int, y : int, w : int, h : int,
+             mode : FillMode = FillMode.SET,
+             outline : bool = False):
+        self.make_undo(x, y, w, h, PasteLayers.PIXELS)
+        if outline:
+            draw_rect(self.data, self.width, x, y, w, h, mode)
+        else:
+            fill_rect(self.data, self.width, self.height, x, y, w, h, mode)
+
+    def circle(self, x : int, y : int, w : int, h : int,
+               mode : FillMode = FillMode.SET,
+               outline : bool = False):
+        # fits in the rect
+        if x + w <= 0 or y + h <= 0:
+            # off the top or left, but it'd still be rounded on to the edge
+            return
+        self.make_undo(x, y, w, h, PasteLayers.PIXELS)
+        if outline:
+            draw_circle(self.data, self.width, self.height, x, y, w, h, mode)
+        else:
+            fill_circle(self.data, self.width, self.height, x, y, w, h, mode)
+
+    def line(self, x1 : int, y1 : int, x2 : int, y2 : int,
+             mode : FillMode = FillMode.SET):
+        self.make_undo(min(x1, x2), min(y1, y2), abs(x2 - x1) + 1, abs(y2 - y1) + 1,
+                       PasteLayers.PIXELS)
+        draw_line(self.width, self.data, x1, y1, x2, y2, mode)
+
+    def lines(self, segments, mode : FillMode = FillMode.SET):
+        # many (x1, y1, x2, y2) lines with one undo for all of them
+        segments = list(segments)
+        if len(segments) == 0:
+            return
+        x1 : int = min(min(seg[0], seg[2]) for seg in segments)
+        y1 : int = min(min(seg[1], seg[3]) for seg in segments)
+        x2 : int = max(max(seg[0], seg[2]) for seg in segments) + 1
+        y2 : int = max(max(seg[1], seg[3]) for seg in segments) + 1
+        self.make_undo(x1, y1, x2 - x1, y2 - y1, PasteLayers.PIXELS)
+        for sx1, sy1, sx2, sy2 in segments:
+            draw_line(self.width, self.data, sx1, sy1, sx2, sy2, mode)
+
+    def blit(self, source, x : int, y : int,
+             sx : int = 0, sy : int = 0,
+             sw : int = -1, sh : int = -1,
+             mode : PasteMode = PasteMode.REPLACE,
+             layers : PasteLayers = PasteLayers.BOTH):
+        # the part of another Canvas at sx, sy, all of it by default, drawn
+        # here at x, y.  like pasting, it's done in whole character cells.
+        if sw < 0:
+            sw = source.width - sx
+        if sh < 0:
+            sh = source.height - sy
+        if layers != PasteLayers.PIXELS and \
+           source.color_mode != self.color_mode and \
+           (source.color_mode == ColorMode.DIRECT or
+            self.color_mode == ColorMode.DIRECT or
+            (source.color_mode == ColorMode.C256 and
+             self.color_mode == ColorMode.C16 and
+             get_max_color(source.colordata_fg_r, source.colordata_bg_r) > 15)):
+            raise ValueError("Source and destination color modes are incompatible.")
+        # leave out what's off the top and left, the rest is cut to fit
+        if x < 0:
+            sx -= x
+            sw += x
+            x = 0
+        if y < 0:
+            sy -= y
+            sh += y
+            y = 0
+        sx1 : int = max(0, sx)
+        sy1 : int = max(0, sy)
+        sw = min(source.width, sx + sw) - sx1
+        sh = min(source.height, sy + sh) - sy1
+        if sw <= 0 or sh <= 0 or x >= self.width or y >= self.height:
+            return
+        rect = make_copy(sx1, sy1, sw, sh, source.width, source.data, source.color_mode,
+                         *source.get_colordata())
+        w, h = rect.get_dims()
+        self.make_undo(x // 2 * 2, y // 4 * 4, w * 2, h * 4, layers)
+        rect.apply(self.width // 2, self.data, *self.get_colordata(),
+                   x // 2, y // 4, mode, layers)
+
+class RecordingOutput(io.TextIOBase):
+    # stands in for stdout, keeping what's written and counting the bytes it
+    # would have been and the canvas cells drawn.  given a stream, it's
+    # passed on to that as well.
+    def __init__(self, keep : bool = True, stream = None):
+        self.keep : bool = keep
+        self.stream = stream
+        self.chunks : list[str] = []
+        self.bytes : int = 0
+        self.cells : int = 0
+
+    def writable(self):
+        return True
+
+    def write(self, s : str):
+        self.bytes += len(s.encode('utf-8'))
+        # cells are printed a character at a time
+        if s in CHAR_CELLS:
+            self.cells += 1
+        if self.keep:
+            self.chunks.append(s)
+        if self.stream is not None:
+            self.stream.write(s)
+        return len(s)
+
+    def flush(self):
+        if self.stream is not None:
+            self.stream.flush()
+
+    def getvalue(self):
+        return ''.join(self.chunks)
+
+class HeadlessTerminal(blessed.Terminal):
+    # a terminal without a tty, which gets its keys from a script and writes
+    # to a RecordingOutput
+    def __init__(self, keys : list[str],
+                 width : int = HEADLESS_WIDTH,
+                 height : int = HEADLESS_HEIGHT,
+                 keep : bool = True):
+        self.output : RecordingOutput = RecordingOutput(keep)
+        super().__init__(kind='xterm-256color', stream=self.output, force_styling=True)
+        self.number_of_colors = 1 << 24
+        self.headless_width : int = width
+        self.headless_height : int = height
+        self.keys = iter(keys)
+        self.key_count : int = 0
+        self.quit_keys = iter(read_key_script(self, HEADLESS_QUIT_KEYS) * HEADLESS_QUIT_TRIES)
+
+    @property
+    def width(self):
+        return self.headless_width
+
+    @property
+    def height(self):
+        return self.headless_height
+
+    def inkey(self, timeout : None | float = None, esc_delay : float = 0.35):
+        key : None | str = next(self.keys, None)
+        if key is not None:
+            self.key_count += 1
+            return blessed.keyboard.Keystroke(key)
+        key = next(self.quit_keys, None)
+        if key is None:
+            raise RuntimeError("Didn't quit after the key script ran out.")
+        return blessed.keyboard.Keystroke(key)
+
+def get_key_sequence(t : blessed.Terminal, name : str):
+    # the reverse of keycode_to_name, for a single key
+    if name == "SPACE":
+        return ' '
+    code : int = getattr(t, name)
+    for sequence, keycode in t._keymap.items():
+        if keycode == code:
+            return sequence
+    raise ValueError(f"No sequence for key {name}.")
+
+def read_key_script(t : blessed.Terminal, lines):
+    # one key per line, either a KEY_ name, SPACE, or text which is typed
+    # a character at a time
+    keys : list[str] = []
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if line == "SPACE" or (line.startswith('KEY_') and hasattr(t, line)):
+            keys.append(get_key_sequence(t, line))
+        else:
+            keys.extend(line)
+    return keys
+
+def run_headless(keys : list[str],
+                 argv : list[str] = [],
+                 width : int = HEADLESS_WIDTH,
+                 height : int = HEADLESS_HEIGHT,
+                 keep : bool = True):
+    # run the editor on the keys given without a terminal.  returns the
+    # number of keys used, how long it took and the RecordingOutput with what
+    # would've gone to the terminal.
+    global t
+
+    orig_t = t
+    orig_argv = sys.argv
+    t = HeadlessTerminal(keys, width, height, keep)
+    sys.argv = [orig_argv[0], *argv]
+    try:
+        start : float = time.perf_counter()
+        with contextlib.redirect_stdout(t.output):
+            main()
+        elapsed : float = time.perf_counter() - start
+        return t.key_count, elapsed, t.output
+    finally:
+        t = orig_t
+        sys.argv = orig_argv
+
+def replay_file(args):
+    with open(args.replay, 'r') as infile:
+        keys = read_key_script(t, infile)
+    # the same arguments, the headless run doesn't replay again
+    count, elapsed, output = run_headless(keys, sys.argv[1:], keep=False)
+    print(f"{count} keys in {elapsed:.3f} seconds, "
+          f"{count / max(elapsed, 1e-9):.1f} keys/s, "
+          f"{output.bytes / max(count, 1):.1f} bytes/key")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="2x4 Octant character editor for the terminal, in color")
+    parser.add_argument('filename', nargs='?',
+                        help="file to load, or a PPM/PGM/PNG image to import")
+    parser.add_argument('--autosave-interval', type=float, default=AUTOSAVE_INTERVAL,
+                        help="seconds between autosaves, 0 to turn off (default: %(default)s)")
+    parser.add_argument('--autosave-budget', type=int, default=AUTOSAVE_BUDGET,
+                        help="most bytes per second an autosave writes, 0 for no limit (default: %(default)s)")
+    parser.add_argument('--watch', action='store_true',
+                        help="reload the file when it's changed by something else")
+    parser.add_argument('--journal', action='store_true',
+                        help="keep a journal of changes and undo history to recover "
+                             "from if the editor doesn't exit cleanly")
+    parser.add_argument('--import-colors', choices=('average', 'kmeans', 'exhaustive'), default='average',
+                        help="how imported images pick each cell's pixels and 2 colors: "
+                             "dither and average, or search for the best fitting pair of colors "
+                             "by 2-means clustering or trying every split (default: %(default)s)")
+    parser.add_argument('--convert', metavar='OUTPUT',
+                        help="save the file to OUTPUT and exit without starting the editor")
+    parser.add_argument('--replay', metavar='SCRIPT',
+                        help="run without a terminal on the keys in SCRIPT, one per line as "
+                             "a KEY_ name, SPACE or text to type, then report keys per second "
+                             "and bytes drawn per key")
+    parser.add_argument('--frame-stats', metavar='JSON', nargs='?', const='',
+                        help="time every action and frame from the start and save the figures "
+                             "to JSON on quitting, or the file name with .frames.json added")
+    parser.add_argument('--undo-memory', metavar='BYTES', type=int, default=UNDO_MEMORY,
+                        help="drop the oldest undos once they hold more than this many bytes, "
+                             "0 for no limit (default: %(default)s)")
+    parser.add_argument('--glyphs', choices=[glyphs.name.lower() for glyphs in Glyphs], default='octant',
+                        help="characters to save with, braille is the same 2x4 as octants, "
+                             "sextants and quadrants lose some detail (default: %(default)s)")
+
+    return parser.parse_args()
+
+def load_args_file(t : blessed.Terminal, color_mode : ColorMode, args):
+    # the file given on the command line.  imported images also have the error
+    # of each cell if they were searched.
+    if is_image_file(args.filename):
+        if args.import_colors == 'average':
+            return *load_image(color_mode, args.filename), None
+        return optimize_image(color_mode, args.filename, args.import_colors == 'exhaustive')
+
+    return *load_file(t, color_mode, args.filename), None
+
+def convert_file(args):
+    # without the editor, there may not be a terminal to get styling from,
+    # and files keep whatever colors they have
+    ct = get_script_term()
+    color_mode : ColorMode = ColorMode.DIRECT
+
+    width, _, color_mode, data, \
+        colordata_fg_r, colordata_fg_g, colordata_fg_b, \
+        colordata_bg_r, colordata_bg_g, colordata_bg_b, _ = \
+        load_args_file(ct, color_mode, args)
+    save_file(ct, pathlib.Path(args.convert), True, data, width, color_mode,
+              colordata_fg_r, colordata_fg_g, colordata_fg_b,
+              colordata_bg_r, colordata_bg_g, colordata_bg_b,
+              glyphs=Glyphs[args.glyphs.upper()])
+
 def main():
     global need_winch
     global need_cont
@@ -3101,6 +6415,10 @@ def main():
     global interrupted
     global canvas_width
     global canvas_height
+    global undo_journal
+    global undo_memory
+    global clipboards
+    global macro
 
     x : int = 0
     y : int = 0
@@ -3117,7 +6435,8 @@ def main():
     refresh_matrix : None | tuple[int] = None
     undos : list[None | DataRect] = []
     redos : list[None | DataRect] = []
-    clipboard : None | DataRect = None
+    clipboards = Clipboards()
+    clipboard_name : str = CLIPBOARD_DEFAULT
     selecting : bool = False
     select_x : int = -1
     select_y : int = -1
@@ -3135,9 +6454,55 @@ def main():
     line_y : int = -1
     set_line : bool = False
     palette : list = []
+    heatmap : None | array = None
+    show_heatmap : bool = False
+    paste_mode : PasteMode = PasteMode.REPLACE
+    paste_layers : PasteLayers = PasteLayers.BOTH
+    animation : None | Animation = None
+    frame : int = 0
+    onion : bool = False
+    onion_data : None | array = None
+    macro = Macro()
+    macro_start_x : int = 0
+    macro_start_y : int = 0
+    macro_plays : int = 0
+    macro_play : int = 0
+    macro_x : int = 0
+    macro_y : int = 0
+    macro_step_x : int = 0
+    macro_step_y : int = 0
+    # where things changed while playing, to draw when it's done
+    macro_refresh : None | tuple[int] = None
+    macro_stdout = None
+    macro_status : None | str = None
+    profiler : Profiler = Profiler()
+    frame_stats : None | FrameStats = None
+    show_frame_stats : bool = False
+    # counts what's sent while timing frames
+    stats_output : None | RecordingOutput = None
+    action_start : None | float = None
+    key : None | int | KeyActions = None
+    render_start : float = 0.0
+    render_bytes : int = 0
+    render_cells : int = 0
 
     last_filename : str = ""
 
+    args = parse_args()
+    glyphs = Glyphs[args.glyphs.upper()]
+    undo_memory = args.undo_memory
+
+    if args.convert is not None:
+        if args.filename is None:
+            print("A file to convert is needed.", file=sys.stderr)
+            return
+        convert_file(args)
+        return
+
+    if args.replay is not None and not isinstance(t, HeadlessTerminal):
+        replay_file(args)
+        return
+
     term : Term = Term(t)
 
     # set initial canvas size to the largest that'll fit
@@ -3150,12 +6515,14 @@ def main():
     elif t.number_of_colors < 256:
         max_color_mode = ColorMode.C16
 
-    if len(sys.argv) > 1:
+    if args.filename is not None:
         canvas_width, canvas_height, color_mode, data, \
             colordata_fg_r, colordata_fg_g, colordata_fg_b, \
-            colordata_bg_r, colordata_bg_g, colordata_bg_b = \
-            load_file(t, max_color_mode, sys.argv[1])
-        last_filename = sys.argv[1]
+            colordata_bg_r, colordata_bg_g, colordata_bg_b, heatmap = \
+            load_args_file(t, max_color_mode, args)
+        if not is_image_file(args.filename):
+            # imported images get saved somewhere else
+            last_filename = args.filename
     else:
         color_mode = max_color_mode
 
@@ -3169,11 +6536,41 @@ def main():
             colordata_bg_r, colordata_bg_g, colordata_bg_b = \
             new_color_data(color_mode, canvas_width, canvas_height)
 
+    ready_status : str = "Ready. (Shift+H for Help)"
+    if args.journal:
+        journal_path : pathlib.Path = get_journal_path(last_filename)
+        if journal_path.exists():
+            try:
+                recovered = replay_journal(journal_path)
+            except (OSError, ValueError) as e:
+                recovered = None
+                ready_status = f"Couldn't recover from {journal_path}: {e}"
+            if recovered is not None:
+                canvas_width, canvas_height, data, color_mode, \
+                    colordata_fg_r, colordata_fg_g, colordata_fg_b, \
+                    colordata_bg_r, colordata_bg_g, colordata_bg_b, \
+                    undos, redos = recovered
+                ready_status = f"Recovered from {journal_path}. (Shift+H for Help)"
+        undo_journal = UndoJournal(last_filename)
+
     fg_r, fg_g, fg_b, bg_r, bg_g, bg_b = get_default_colors(color_mode)
 
+    autosaver : Autosaver = Autosaver(t, args.autosave_interval, args.autosave_budget)
+    watcher : None | Watcher = None
+    watch_patterns : tuple = get_load_patterns(t)
+    if args.watch and len(last_filename) > 0:
+        watcher = Watcher(last_filename)
+
     #global logfile
     #logfile = open("log.txt", 'w')
 
+    if os.environ.get(PROFILE_ENV):
+        profiler.start()
+    if args.frame_stats is not None:
+        frame_stats = FrameStats()
+        stats_output = RecordingOutput(False, sys.stdout)
+        sys.stdout = stats_output
+
     orig_winch = signal.getsignal(signal.SIGWINCH)
     orig_cont = signal.getsignal(signal.SIGCONT)
     signal.signal(signal.SIGWINCH, handler_winch)
@@ -3186,8 +6583,56 @@ def main():
             term.send_normal()
 
             while True:
+                if frame_stats is not None:
+                    if action_start is not None:
+                        name : str = KeyActions.NONE.name
+                        if isinstance(key, KeyActions):
+                            name = key.name
+                        frame_stats.add_action(name, time.perf_counter() - action_start)
+                        action_start = None
+                    render_start = time.perf_counter()
+                    render_bytes = stats_output.bytes
+                    render_cells = stats_output.cells
                 check_term_size(term)
-                if canvas_fits:
+                if macro_plays > 0 and not macro.is_playing():
+                    macro_play += 1
+                    if macro_play < macro_plays:
+                        x = macro_x + macro_step_x * macro_play
+                        y = macro_y + macro_step_y * macro_play
+                        macro.play()
+                    else:
+                        # done, draw everything that changed at once.  what
+                        # was sent while playing went nowhere.
+                        sys.stdout = macro_stdout
+                        term.reset()
+                        rx1 : int = max(0, macro_refresh[0])
+                        ry1 : int = max(0, macro_refresh[1])
+                        rx2 : int = min(canvas_width, macro_refresh[0] + macro_refresh[2])
+                        ry2 : int = min(canvas_height, macro_refresh[1] + macro_refresh[3])
+                        if rx2 > rx1 and ry2 > ry1:
+                            refresh_matrix = (rx1, ry1, rx2 - rx1, ry2 - ry1)
+                        macro_status = f"Played macro {macro_plays} times."
+                        macro_plays = 0
+
+                if macro.is_playing():
+                    # nothing is drawn while playing, just keep what changed
+                    # and the changes to modes the drawing would've made
+                    macro_refresh = union_rect(macro_refresh, (x, y, 1, 1))
+                    if refresh_matrix is not None:
+                        macro_refresh = union_rect(macro_refresh, refresh_matrix)
+                        refresh_matrix = None
+                    if selecting and cancel:
+                        selecting = False
+                        cancel = False
+                    if line_mode:
+                        if cancel:
+                            line_mode = False
+                            cancel = False
+                        elif set_line:
+                            set_line = False
+                            line_x = x
+                            line_y = y
+                elif canvas_fits:
                     if refresh_matrix is not None:
                         term.send_normal()
                         min_width, min_height = get_min_term_size()
@@ -3215,7 +6660,7 @@ def main():
                                        colordata_bg_r, colordata_bg_g, colordata_bg_b)
                         if first:
                             first = False
-                            print_status(term, "Ready. (Shift+H for Help)")
+                            print_status(term, ready_status)
                         else:
                             print_status(term, "Ready.")
                         refresh_matrix = None
@@ -3310,22 +6755,33 @@ def main():
                                           COLORS, grid, zoomed_color,
                                           select_pixels, color_mode, data,
                                           colordata_fg_r, colordata_fg_g, colordata_fg_b,
-                                          colordata_bg_r, colordata_bg_g, colordata_bg_b)
+                                          colordata_bg_r, colordata_bg_g, colordata_bg_b,
+                                          heatmap if show_heatmap else None,
+                                          onion_data if onion else None)
                     disp_x : int = x
                     disp_y : int = y
                     if selecting and not select_pixels:
                         disp_x = x // 2
                         disp_y = y // 4
+                    errstr : str = ""
+                    if show_heatmap and len(heatmap) == len(colordata_fg_r):
+                        errstr = f"  Error {heatmap[(canvas_width // 2) * (y // 4) + (x // 2)]}"
+                    if animation is not None:
+                        errstr += f"  Frame {frame + 1}/{len(animation)}"
+                    if macro.recording:
+                        errstr += "  Recording"
+                    if show_frame_stats:
+                        errstr += f"  {frame_stats.get_overlay()}"
                     if color_mode == ColorMode.DIRECT:
                         bgstr = "Transparent"
                         if bg_r >= 0:
                             bgstr = f"{bg_r} {bg_g} {bg_b}"
-                        print_status(term, f"{color_mode.name} {disp_x}, {disp_y}  {fg_r} {fg_g} {fg_b}  {bgstr}", 1)
+                        print_status(term, f"{color_mode.name} {disp_x}, {disp_y}  {fg_r} {fg_g} {fg_b}  {bgstr}{errstr}", 1)
                     else:
                         bgstr = "Transparent"
                         if bg_r >= 0:
                             bgstr = f"{bg_r}"
-                        print_status(term, f"{color_mode.name} {disp_x}, {disp_y}  {fg_r}  {bgstr}", 1)
+                        print_status(term, f"{color_mode.name} {disp_x}, {disp_y}  {fg_r}  {bgstr}{errstr}", 1)
                     term.send_normal() # undo reverse
                 else:
                     print_status(term, "", 0)
@@ -3339,8 +6795,89 @@ def main():
                 ##### UPDATE DONE #####
                 #######################
 
+                if macro_status is not None:
+                    print_status(term, macro_status)
+                    macro_status = None
                 sys.stdout.flush()
-                _, key = inkey_numeric(t)
+                if frame_stats is not None:
+                    frame_stats.add_frame(time.perf_counter() - render_start,
+                                          stats_output.bytes - render_bytes,
+                                          stats_output.cells - render_cells)
+                autosaver.set_canvas(last_filename, canvas_width, color_mode, data,
+                                     colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                     colordata_bg_r, colordata_bg_g, colordata_bg_b)
+                if autosaver.error is not None:
+                    print_status(term, f"Autosave failed: {autosaver.error}")
+                    autosaver.error = None
+                    sys.stdout.flush()
+                autosaver.poll()
+                idle = (autosaver.poll,)
+                if undo_journal is not None:
+                    undo_journal.set_canvas(last_filename, canvas_width, color_mode, data,
+                                            colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                            colordata_bg_r, colordata_bg_g, colordata_bg_b,
+                                            undos, redos)
+                    if undo_journal.error is not None:
+                        print_status(term, f"Journal failed: {undo_journal.error}")
+                        undo_journal.error = None
+                        sys.stdout.flush()
+                    idle += (undo_journal.poll,)
+                if watcher is not None:
+                    idle += (watcher.poll,)
+                # waiting for keys would be most of it otherwise
+                profiler.pause()
+                _, key = inkey_numeric(t, idle)
+                profiler.resume()
+                if frame_stats is not None:
+                    action_start = time.perf_counter()
+                if watcher is not None and watcher.changed:
+                    try:
+                        line_count, changes = watcher.get_changes()
+                        parsed = None
+                        if line_count == canvas_height // 4:
+                            parsed = load_changes(t, watch_patterns, changes, canvas_width, color_mode)
+                        if parsed is None:
+                            # the size or color mode changed, so load it all again
+                            new_canvas = load_file(t, max_color_mode, watcher.filename)
+                    except (OSError, ValueError) as e:
+                        print_status(term, f"Failed to reload {watcher.filename}: {e}")
+                        continue
+
+                    if parsed is None:
+                        make_undo(undos, redos,
+                                  0, 0, canvas_width, canvas_height, canvas_width, data,
+                                  color_mode,
+                                  colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                  colordata_bg_r, colordata_bg_g, colordata_bg_b)
+                        old_color_mode : ColorMode = color_mode
+                        canvas_width, canvas_height, color_mode, data, \
+                            colordata_fg_r, colordata_fg_g, colordata_fg_b, \
+                            colordata_bg_r, colordata_bg_g, colordata_bg_b = new_canvas
+                        if color_mode != old_color_mode:
+                            # the colors mean something else in another mode
+                            fg_r, fg_g, fg_b, bg_r, bg_g, bg_b = get_default_colors(color_mode)
+                        x = min(x, canvas_width - 1)
+                        y = min(y, canvas_height - 1)
+                        select_x = min(select_x, canvas_width - 1)
+                        select_y = min(select_y, canvas_height - 1)
+                        term.clear()
+                        refresh_matrix = (0, 0, canvas_width, canvas_height)
+                        print_status(term, f"Reloaded {watcher.filename}.")
+                    elif len(parsed) > 0:
+                        first : int = min(parsed)
+                        count : int = max(parsed) - first + 1
+                        make_undo(undos, redos,
+                                  0, first * 4, canvas_width, count * 4, canvas_width, data,
+                                  color_mode,
+                                  colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                  colordata_bg_r, colordata_bg_g, colordata_bg_b)
+                        for iy, (line_rows, line_colordata) in parsed.items():
+                            put_line(iy, line_rows, line_colordata, canvas_width, color_mode, data,
+                                     colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                     colordata_bg_r, colordata_bg_g, colordata_bg_b)
+                        refresh_matrix = (0, first * 4, canvas_width, count * 4)
+                        print_status(term, f"Reloaded {len(parsed)} lines of {watcher.filename}.")
+                    continue
                 last_x = x
                 last_y = y
 
@@ -3370,11 +6907,13 @@ def main():
                                                               select_x, select_y,
                                                               canvas_width, canvas_height)
 
-                                    clipboard = make_copy(bx, by, bw, bh, canvas_width, data, color_mode,
-                                                          colordata_fg_r, colordata_fg_g, colordata_fg_b,
-                                                          colordata_bg_r, colordata_bg_g, colordata_bg_b)
-                                    #print_status(t, f"Copied. {sx1} {sy1} {sx2} {sy2} {cw} {ch} {clipboard.get_dims()}")
-                                    print_status(term, f"Copied.")
+                                    clipboards.copy(clipboard_name, bx, by, bw, bh, canvas_width, data, color_mode,
+                                                    colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                                    colordata_bg_r, colordata_bg_g, colordata_bg_b)
+                                    if clipboard_name == CLIPBOARD_DEFAULT:
+                                        print_status(term, f"Copied.")
+                                    else:
+                                        print_status(term, f"Copied to {clipboard_name}.")
                                 case KeyActions.RECT:
                                     bx, by, bw, bh = get_xywh(x, y,
                                                               select_x, select_y,
@@ -3387,22 +6926,75 @@ def main():
                                               bx * 2, by * 4, bw * 2, bh * 4, canvas_width, data,
                                               color_mode,
                                               colordata_fg_r, colordata_fg_g, colordata_fg_b,
-                                              colordata_bg_r, colordata_bg_g, colordata_bg_b)
+                                              colordata_bg_r, colordata_bg_g, colordata_bg_b,
+                                              PasteLayers.COLORS)
 
-                                    for ty in range(by, by + bh):
-                                        for tx in range(bx, bx + bw):
-                                            if color_mode == ColorMode.DIRECT:
-                                                colordata_fg_r[ty * (canvas_width // 2) + tx] = fg_r
-                                                colordata_fg_g[ty * (canvas_width // 2) + tx] = fg_g
-                                                colordata_fg_b[ty * (canvas_width // 2) + tx] = fg_b
-                                                colordata_bg_r[ty * (canvas_width // 2) + tx] = bg_r
-                                                colordata_bg_g[ty * (canvas_width // 2) + tx] = bg_g
-                                                colordata_bg_b[ty * (canvas_width // 2) + tx] = bg_b
-                                            else:
-                                                colordata_fg_r[ty * (canvas_width // 2) + tx] = fg_r
-                                                colordata_bg_r[ty * (canvas_width // 2) + tx] = bg_r
+                                    fill_color_rect(canvas_width // 2, bx, by, bw, bh, color_mode,
+                                                    colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                                    colordata_bg_r, colordata_bg_g, colordata_bg_b,
+                                                    fg_r, fg_g, fg_b, bg_r, bg_g, bg_b)
 
                                     refresh_matrix = (bx * 2, by * 4, bw * 2, bh * 4)
+                                case KeyActions.FLIP_H | KeyActions.FLIP_V | \
+                                     KeyActions.ROTATE_CW | KeyActions.ROTATE_CCW | \
+                                     KeyActions.SCALE:
+                                    bx, by, bw, bh = get_xywh(x, y,
+                                                              select_x, select_y,
+                                                              canvas_width, canvas_height)
+                                    selection = make_copy(bx, by, bw, bh, canvas_width, data, color_mode,
+                                                          colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                                          colordata_bg_r, colordata_bg_g, colordata_bg_b)
+                                    bw, bh = selection.get_dims()
+                                    bx //= 2
+                                    by //= 4
+
+                                    nw : int = 0
+                                    nh : int = 0
+                                    if key == KeyActions.SCALE:
+                                        ans = prompt(term, f"New size in tiles? (W H) [{bw} {bh}]")
+                                        if ans is None or len(ans.split()) == 0:
+                                            print_status(term, "Scale canceled.")
+                                            continue
+                                        try:
+                                            nw, nh = (int(v) for v in ans.split())
+                                        except ValueError:
+                                            print_status(term, "Size must be 2 integers.")
+                                            continue
+                                        if nw < 1 or nh < 1:
+                                            print_status(term, "Size must be non-zero.")
+                                            continue
+
+                                    selection = selection.transform(Transform[key.name], nw, nh)
+                                    nw, nh = selection.get_dims()
+                                    # area covering both the old and new footprints
+                                    uw : int = min(max(bw, nw), (canvas_width // 2) - bx)
+                                    uh : int = min(max(bh, nh), (canvas_height // 4) - by)
+
+                                    make_undo(undos, redos,
+                                              bx * 2, by * 4, uw * 2, uh * 4, canvas_width, data,
+                                              color_mode,
+                                              colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                              colordata_bg_r, colordata_bg_g, colordata_bg_b)
+
+                                    if nw != bw or nh != bh:
+                                        # the result won't cover the old area so clear it out
+                                        fill_rect(data, canvas_width, canvas_height,
+                                                  bx * 2, by * 4, bw * 2, bh * 4, FillMode.CLEAR)
+                                        fill_color_rect(canvas_width // 2, bx, by, bw, bh, color_mode,
+                                                        colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                                        colordata_bg_r, colordata_bg_g, colordata_bg_b,
+                                                        *get_default_colors(color_mode))
+                                    selection.apply(canvas_width // 2, data,
+                                                    colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                                    colordata_bg_r, colordata_bg_g, colordata_bg_b,
+                                                    bx, by)
+
+                                    # fit the selection to the result
+                                    select_x = bx * 2
+                                    select_y = by * 4
+                                    x = min(canvas_width // 2, bx + nw) * 2 - 1
+                                    y = min(canvas_height // 4, by + nh) * 4 - 1
+                                    refresh_matrix = (bx * 2, by * 4, uw * 2, uh * 4)
                             bx, by, bw, bh = get_xywh(x, y,
                                                       select_x, select_y,
                                                       canvas_width, canvas_height)
@@ -3442,7 +7034,8 @@ def main():
                                               bx, by, bw, bh, canvas_width, data,
                                               color_mode,
                                               colordata_fg_r, colordata_fg_g, colordata_fg_b,
-                                              colordata_bg_r, colordata_bg_g, colordata_bg_b)
+                                              colordata_bg_r, colordata_bg_g, colordata_bg_b,
+                                              PasteLayers.PIXELS)
 
                                     if tool_mode == ToolMode.OUTLINE:
                                         draw_rect(data, canvas_width, bx, by, bw, bh, tool_operation)
@@ -3460,7 +7053,8 @@ def main():
                                               bx, by, bw, bh, canvas_width, data,
                                               color_mode,
                                               colordata_fg_r, colordata_fg_g, colordata_fg_b,
-                                              colordata_bg_r, colordata_bg_g, colordata_bg_b)
+                                              colordata_bg_r, colordata_bg_g, colordata_bg_b,
+                                              PasteLayers.PIXELS)
 
                                     if tool_mode == ToolMode.OUTLINE:
                                         draw_circle(data, canvas_width, canvas_height, bx, by, bw, bh, tool_operation)
@@ -3471,6 +7065,36 @@ def main():
                                                               select_x, select_y,
                                                               canvas_width, canvas_height)
                                     refresh_matrix = (bx, by, bw, bh)
+                                case KeyActions.NUDGE_LEFT | KeyActions.NUDGE_RIGHT | \
+                                     KeyActions.NUDGE_UP | KeyActions.NUDGE_DOWN:
+                                    ox, oy = NUDGE_OFFSETS[key]
+                                    bx, by, bw, bh = get_xywh(x, y,
+                                                              select_x, select_y,
+                                                              canvas_width, canvas_height)
+                                    if bx + ox < 0 or by + oy < 0 or \
+                                       bx + bw + ox > canvas_width or by + bh + oy > canvas_height:
+                                        print_status(term, "Can't nudge past the edge of the canvas.")
+                                        continue
+                                    # area covering where the pixels were and where they go
+                                    ux, uy, uw, uh = get_xywh(bx + min(0, ox), by + min(0, oy),
+                                                              bx + bw - 1 + max(0, ox), by + bh - 1 + max(0, oy),
+                                                              canvas_width, canvas_height)
+
+                                    make_undo(undos, redos,
+                                              ux, uy, uw, uh, canvas_width, data,
+                                              color_mode,
+                                              colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                              colordata_bg_r, colordata_bg_g, colordata_bg_b,
+                                              PasteLayers.PIXELS)
+
+                                    shift_rect(data, canvas_width, canvas_height, bx, by, bw, bh, ox, oy)
+
+                                    # selection follows the pixels
+                                    x += ox
+                                    y += oy
+                                    select_x += ox
+                                    select_y += oy
+                                    refresh_matrix = (ux, uy, uw, uh)
 
                             bx, by, bw, bh = get_xywh(x, y,
                                                       select_x, select_y,
@@ -3502,7 +7126,8 @@ def main():
                                           bx, by, bw, bh, canvas_width, data,
                                           color_mode,
                                           colordata_fg_r, colordata_fg_g, colordata_fg_b,
-                                          colordata_bg_r, colordata_bg_g, colordata_bg_b)
+                                          colordata_bg_r, colordata_bg_g, colordata_bg_b,
+                                          PasteLayers.PIXELS)
 
                                 draw_line(canvas_width, data, line_x, line_y, x, y, tool_operation)
                             case KeyActions.CANCEL:
@@ -3529,11 +7154,11 @@ def main():
                             y += 1
                         case KeyActions.TOGGLE:
                             if x >= 0 and x < canvas_width and y >= 0 and y < canvas_height:
-                                make_undo(undos, redos,
-                                          x, y, 1, 1, canvas_width, data,
-                                          color_mode,
-                                          colordata_fg_r, colordata_fg_g, colordata_fg_b,
-                                          colordata_bg_r, colordata_bg_g, colordata_bg_b)
+                                make_sparse_undo(undos, redos, key,
+                                                 x, y, canvas_width, data,
+                                                 color_mode,
+                                                 colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                                 colordata_bg_r, colordata_bg_g, colordata_bg_b)
 
                                 data[canvas_width * y + x] = not data[canvas_width * y + x]
                         case KeyActions.RESIZE:
@@ -3728,11 +7353,13 @@ def main():
                             # screen was cleared so needs to be drawn
                             refresh_matrix = (0, 0, canvas_width, canvas_height)
                         case KeyActions.PUT_COLOR:
-                            make_undo(undos, redos,
-                                      x, y, 1, 1, canvas_width, data,
-                                      color_mode,
-                                      colordata_fg_r, colordata_fg_g, colordata_fg_b,
-                                      colordata_bg_r, colordata_bg_g, colordata_bg_b)
+                            if x < 0 or x >= canvas_width or y < 0 or y >= canvas_height:
+                                continue
+                            make_sparse_undo(undos, redos, key,
+                                             x, y, canvas_width, data,
+                                             color_mode,
+                                             colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                             colordata_bg_r, colordata_bg_g, colordata_bg_b)
 
                             if color_mode == ColorMode.DIRECT:
                                 colordata_fg_r[((y // 4) * (canvas_width // 2)) + (x // 2)] = fg_r
@@ -3783,12 +7410,191 @@ def main():
 
                                 save_file(t, path, color, data, canvas_width, color_mode,
                                           colordata_fg_r, colordata_fg_g, colordata_fg_b,
-                                          colordata_bg_r, colordata_bg_g, colordata_bg_b)
+                                          colordata_bg_r, colordata_bg_g, colordata_bg_b,
+                                          term.minimize_sgr, term.blank_skip, glyphs)
 
                                 last_filename = filename
+                                autosaver.discard(last_filename)
+                                if watcher is not None:
+                                    watcher.saved(last_filename)
+                                elif args.watch:
+                                    watcher = Watcher(last_filename)
                                 print_status(term, f"File saved as {last_filename}.")
                             else:
                                 print_status(term, "Save canceled.")
+                        case KeyActions.MINIMIZE_SGR:
+                            term.minimize_sgr = not term.minimize_sgr
+                            refresh_matrix = (0, 0, canvas_width, canvas_height)
+                            if term.minimize_sgr:
+                                print_status(term, f"Minimized color codes toggled on.")
+                            else:
+                                print_status(term, f"Minimized color codes toggled off.")
+                        case KeyActions.NEW_FRAME | KeyActions.DELETE_FRAME | \
+                             KeyActions.NEXT_FRAME | KeyActions.PREV_FRAME:
+                            planes = [data,
+                                      colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                      colordata_bg_r, colordata_bg_g, colordata_bg_b]
+                            if animation is None:
+                                if key != KeyActions.NEW_FRAME:
+                                    print_status(term, "No other frames.")
+                                    continue
+                                animation = Animation(canvas_width, color_mode, planes)
+                            elif not animation.fits(canvas_width, color_mode, data):
+                                print_status(term, "Frames must all be the same size and color mode.")
+                                continue
+                            else:
+                                animation.set_frame(frame, planes)
+                            animation.undos[frame] = (undos, redos)
+
+                            match key:
+                                case KeyActions.NEW_FRAME:
+                                    animation.insert_frame(frame)
+                                    frame += 1
+                                case KeyActions.DELETE_FRAME:
+                                    if len(animation) == 1:
+                                        print_status(term, "Can't delete the only frame.")
+                                        continue
+                                    if not prompt_yn(term, "Delete frame?"):
+                                        print_status(term, "Delete canceled.")
+                                        continue
+                                    animation.delete_frame(frame)
+                                    frame = min(frame, len(animation) - 1)
+                                case KeyActions.NEXT_FRAME:
+                                    frame = (frame + 1) % len(animation)
+                                case KeyActions.PREV_FRAME:
+                                    frame = (frame - 1) % len(animation)
+
+                            # this frame's arrays are let go of, so anything
+                            # copied from them needs its own copy
+                            clipboards.changing(data, 0, 0, canvas_width // 2, canvas_height // 4, True)
+                            data, colordata_fg_r, colordata_fg_g, colordata_fg_b, \
+                                colordata_bg_r, colordata_bg_g, colordata_bg_b = \
+                                animation.get_frame(frame)
+                            undos, redos = animation.undos[frame]
+                            onion_data = None
+                            if frame > 0:
+                                onion_data = animation.get_frame(frame - 1)[0]
+                            refresh_matrix = (0, 0, canvas_width, canvas_height)
+                            print_status(term, f"Frame {frame + 1} of {len(animation)}.")
+                        case KeyActions.ONION:
+                            onion = not onion
+                            if onion:
+                                print_status(term, f"Onion skin toggled on.")
+                            else:
+                                print_status(term, f"Onion skin toggled off.")
+                        case KeyActions.PLAY:
+                            if animation is None or len(animation) == 1:
+                                print_status(term, "No other frames.")
+                                continue
+                            if not animation.fits(canvas_width, color_mode, data):
+                                print_status(term, "Frames must all be the same size and color mode.")
+                                continue
+                            fps = prompt(term, f"Frames per second? [{ANIMATION_FPS}]")
+                            if fps is None:
+                                continue
+                            try:
+                                fps = float(fps) if len(fps) > 0 else ANIMATION_FPS
+                            except ValueError:
+                                print_status(term, "Frames per second must be a number.")
+                                continue
+                            if fps <= 0:
+                                print_status(term, "Frames per second must be more than 0.")
+                                continue
+
+                            animation.set_frame(frame, [data,
+                                                        colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                                        colordata_bg_r, colordata_bg_g, colordata_bg_b])
+                            print_status(term, "Playing, press any key to stop.")
+                            play_animation(term, animation, fps, CANVAS_X, TOP_BARS)
+                            term.clear()
+                            refresh_matrix = (0, 0, canvas_width, canvas_height)
+                            print_status(term, "Stopped.")
+                        case KeyActions.GLYPHS:
+                            glyphs = GLYPHS_CYCLE[glyphs]
+                            print_status(term, f"Saving with {glyphs.name} characters.")
+                        case KeyActions.BLANK_SKIP:
+                            term.blank_skip = BLANK_SKIP_CYCLE[term.blank_skip]
+                            refresh_matrix = (0, 0, canvas_width, canvas_height)
+                            print_status(term, f"Blank skipping {term.blank_skip.name} selected.")
+                        case KeyActions.EXPORT:
+                            filename = prompt(term, "Export filename? (.png, .ppm, .html, .svg, .cast)")
+                            if filename is None or len(filename) == 0:
+                                print_status(term, "Export canceled.")
+                                continue
+
+                            path = pathlib.Path(filename)
+                            suffix = path.suffix.lower()
+                            if suffix not in ('.png', '.ppm', '.html', '.htm', '.svg', '.cast'):
+                                print_status(term, "Unknown export format.")
+                                continue
+                            if path.exists():
+                                ans = prompt_yn(term, "File exists, overwrite?")
+                                if not ans:
+                                    print_status(term, "Export canceled.")
+                                    continue
+
+                            if suffix == '.cast':
+                                fps = prompt(term, f"Frames per second? [{ANIMATION_FPS}]")
+                                if fps is None:
+                                    print_status(term, "Export canceled.")
+                                    continue
+                                try:
+                                    fps = float(fps) if len(fps) > 0 else ANIMATION_FPS
+                                except ValueError:
+                                    print_status(term, "Frames per second must be a number.")
+                                    continue
+                                if fps <= 0:
+                                    print_status(term, "Frames per second must be more than 0.")
+                                    continue
+
+                                planes = [data,
+                                          colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                          colordata_bg_r, colordata_bg_g, colordata_bg_b]
+                                if animation is None:
+                                    # just the 1 frame
+                                    export_asciicast(path, t, Animation(canvas_width, color_mode, planes), fps)
+                                elif not animation.fits(canvas_width, color_mode, data):
+                                    print_status(term, "Frames must all be the same size and color mode.")
+                                    continue
+                                else:
+                                    animation.set_frame(frame, planes)
+                                    export_asciicast(path, t, animation, fps)
+                                print_status(term, f"Exported to {filename}.")
+                                continue
+
+                            if suffix in ('.html', '.htm'):
+                                export_html(path, data, canvas_width, color_mode,
+                                            colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                            colordata_bg_r, colordata_bg_g, colordata_bg_b)
+                                print_status(term, f"Exported to {filename}.")
+                                continue
+
+                            pw, ph = EXPORT_PIXEL_SIZE
+                            size = prompt(term, f"Pixel size? (W H) [{pw} {ph}]")
+                            if size is None:
+                                print_status(term, "Export canceled.")
+                                continue
+                            if len(size) > 0:
+                                try:
+                                    pw, ph = (int(v) for v in size.split())
+                                except ValueError:
+                                    print_status(term, "Size must be 2 integers.")
+                                    continue
+                                if pw < 1 or ph < 1:
+                                    print_status(term, "Size must be non-zero.")
+                                    continue
+
+                            if suffix == '.svg':
+                                export_svg(path, data, canvas_width, color_mode,
+                                           colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                           colordata_bg_r, colordata_bg_g, colordata_bg_b,
+                                           pw, ph)
+                            else:
+                                export_image(path, data, canvas_width, color_mode,
+                                             colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                             colordata_bg_r, colordata_bg_g, colordata_bg_b,
+                                             pw, ph)
+                            print_status(term, f"Exported to {filename}.")
                         case KeyActions.REDRAW:
                             term.clear()
                             refresh_matrix = (0, 0, canvas_width, canvas_height)
@@ -3840,9 +7646,11 @@ def main():
                             select_y = y
                             print_status(term, "Entered pixels selection mode.")
                         case KeyActions.PASTE:
+                            clipboard = clipboards.get(clipboard_name)
                             if clipboard != None:
                                 w, h = clipboard.get_dims()
-                                if clipboard.color_mode != color_mode and \
+                                if paste_layers != PasteLayers.PIXELS and \
+                                   clipboard.color_mode != color_mode and \
                                    (clipboard.color_mode == ColorMode.DIRECT or
                                     color_mode == ColorMode.DIRECT or
                                     (clipboard.color_mode == ColorMode.C256 and
@@ -3858,18 +7666,119 @@ def main():
                                           x // 2 * 2, y // 4 * 4, w * 2, h * 4, canvas_width, data,
                                           color_mode,
                                           colordata_fg_r, colordata_fg_g, colordata_fg_b,
-                                          colordata_bg_r, colordata_bg_g, colordata_bg_b)
+                                          colordata_bg_r, colordata_bg_g, colordata_bg_b,
+                                          paste_layers)
 
                                 # apply wants dimensions in character cells
                                 # this is normally abstracted
                                 clipboard.apply(canvas_width // 2, data,
                                                 colordata_fg_r, colordata_fg_g, colordata_fg_b,
                                                 colordata_bg_r, colordata_bg_g, colordata_bg_b,
-                                                x // 2, y // 4)
+                                                x // 2, y // 4, paste_mode, paste_layers)
                                 refresh_matrix = (x, y, w * 2, h * 4)
                                 print_status(term, "Pasted.")
                             else:
                                 print_status(term, "Clipboard is empty.")
+                        case KeyActions.SELECT_CLIPBOARD:
+                            names = ", ".join(name for name in clipboards.get_names() if name != CLIPBOARD_DEFAULT)
+                            name = prompt(term, f"Clipboard name? (blank for default) [{names}]")
+                            if name is None:
+                                print_status(term, "Clipboard not changed.")
+                                continue
+                            clipboard_name = name
+                            if clipboard_name == CLIPBOARD_DEFAULT:
+                                print_status(term, "Using default clipboard.")
+                            else:
+                                print_status(term, f"Using clipboard {clipboard_name}.")
+                        case KeyActions.RECORD_MACRO:
+                            if macro.recording:
+                                macro.stop_recording(x - macro_start_x, y - macro_start_y)
+                                print_status(term, f"Recorded macro of {len(macro.keys)} keys.")
+                            else:
+                                macro.start_recording()
+                                macro_start_x = x
+                                macro_start_y = y
+                                print_status(term, "Recording macro.")
+                        case KeyActions.PLAY_MACRO:
+                            if macro.recording:
+                                # not this key either
+                                macro.drop_last()
+                                print_status(term, "Can't play a macro while recording.")
+                                continue
+                            if len(macro.keys) == 0:
+                                print_status(term, "No macro recorded.")
+                                continue
+                            count = prompt(term, "Times to play? [1]")
+                            if count is None:
+                                print_status(term, "Macro canceled.")
+                                continue
+                            if len(count) == 0:
+                                count = 1
+                            else:
+                                try:
+                                    count = int(count)
+                                except ValueError:
+                                    print_status(term, "Times must be an integer.")
+                                    continue
+                                if count < 1:
+                                    print_status(term, "Times must be at least 1.")
+                                    continue
+                            step = prompt(term, f"Step between plays? [{macro.step_x},{macro.step_y}]")
+                            if step is None:
+                                print_status(term, "Macro canceled.")
+                                continue
+                            macro_step_x = macro.step_x
+                            macro_step_y = macro.step_y
+                            if len(step) > 0:
+                                try:
+                                    macro_step_x, macro_step_y = (int(v) for v in step.split(','))
+                                except ValueError:
+                                    print_status(term, "Step must be 2 integers, X,Y.")
+                                    continue
+
+                            macro_plays = count
+                            macro_play = 0
+                            macro_x = x
+                            macro_y = y
+                            macro_refresh = (x, y, 1, 1)
+                            macro_stdout = sys.stdout
+                            sys.stdout = RecordingOutput(False)
+                            macro.play()
+                        case KeyActions.PROFILE:
+                            if profiler.is_running():
+                                profile_path = get_profile_path(last_filename)
+                                try:
+                                    summary = profiler.stop(profile_path)
+                                except OSError as e:
+                                    print_status(term, f"Failed to save profile: {e}")
+                                    continue
+                                # just what fits
+                                print_status(term, t.truncate(f"Saved {profile_path}: {summary}", t.width))
+                            else:
+                                profiler.start()
+                                print_status(term, "Profiling started.")
+                        case KeyActions.MEMORY:
+                            usage = get_memory_usage((data,
+                                                      colordata_fg_r, colordata_fg_g, colordata_fg_b,
+                                                      colordata_bg_r, colordata_bg_g, colordata_bg_b),
+                                                     undos, redos, palette, animation,
+                                                     (heatmap, onion_data))
+                            memstr : str = "  ".join(f"{name} {format_size(size)}" for name, size in usage.items())
+                            limitstr : str = "no limit"
+                            if undo_memory > 0:
+                                limitstr = f"limit {format_size(undo_memory)}"
+                            print_status(term, t.truncate(f"{memstr}  Total {format_size(sum(usage.values()))}  "
+                                                          f"({len(undos)} undos, {limitstr})", t.width))
+                        case KeyActions.FRAME_STATS:
+                            show_frame_stats = not show_frame_stats
+                            if frame_stats is None:
+                                frame_stats = FrameStats()
+                                stats_output = RecordingOutput(False, sys.stdout)
+                                sys.stdout = stats_output
+                            if show_frame_stats:
+                                print_status(term, f"Frame stats toggled on.")
+                            else:
+                                print_status(term, f"Frame stats toggled off.")
                         case KeyActions.LINE:
                             line_x = x
                             line_y = y
@@ -3905,6 +7814,21 @@ def main():
                                 else:
                                     fg_r = bg_r
                                 bg_r = temp
+                        case KeyActions.PASTE_MODE:
+                            paste_mode = PASTE_MODE_CYCLE[paste_mode]
+                            print_status(term, f"Paste mode {paste_mode.name} selected.")
+                        case KeyActions.PASTE_LAYERS:
+                            paste_layers = PASTE_LAYERS_CYCLE[paste_layers]
+                            print_status(term, f"Paste layers {paste_layers.name} selected.")
+                        case KeyActions.HEATMAP:
+                            if heatmap is None:
+                                print_status(term, "No color error map, import an image with --import-colors.")
+                            else:
+                                show_heatmap = not show_heatmap
+                                if show_heatmap:
+                                    print_status(term, f"Color error map toggled on.")
+                                else:
+                                    print_status(term, f"Color error map toggled off.")
                         case KeyActions.PICK_FG_COLOR:
                             if color_mode == ColorMode.DIRECT:
                                 fg_r = colordata_fg_r[((y // 4) * (canvas_width // 2)) + (x // 2)]
@@ -3941,6 +7865,29 @@ def main():
             need_help = False
             print_help(t)
 
+    if macro_plays > 0:
+        # quit while playing
+        sys.stdout = macro_stdout
+    if frame_stats is not None:
+        sys.stdout = stats_output.stream
+    if args.frame_stats is not None:
+        frame_stats_path = get_frame_stats_path(last_filename)
+        if args.frame_stats:
+            frame_stats_path = pathlib.Path(args.frame_stats)
+        try:
+            frame_stats.save(frame_stats_path)
+            print(f"Saved frame stats to {frame_stats_path}")
+        except OSError as e:
+            print(f"Failed to save frame stats: {e}", file=sys.stderr)
+    if profiler.is_running():
+        profile_path = get_profile_path(last_filename)
+        try:
+            print(f"Saved {profile_path}: {profiler.stop(profile_path)}")
+        except OSError as e:
+            print(f"Failed to save profile: {e}", file=sys.stderr)
+    autosaver.stop()
+    if undo_journal is not None:
+        undo_journal.close()
 
 if __name__ == '__main__':
     main()